@@ -3,6 +3,7 @@
 import streamlit as st
 from components.upload import render_uploader
 from components.chatUI import render_chat
+from components.scope import render_scope
 from components.history_download import render_history_download
 
 # --- Page Configuration ---
@@ -38,6 +39,10 @@ with st.sidebar:
     st.title("📄 VisionDoc RAG")
     st.caption("Your intelligent document assistant")
     
+    render_scope()
+
+    st.divider()
+
     render_uploader()
     
     st.divider()
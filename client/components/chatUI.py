@@ -1,9 +1,18 @@
 # /components/chatUI.py
 
 import streamlit as st
-from utils.api import ask_question
+from utils.api import ask_question_stream
 import requests
 
+def render_image(image_url: str, thumbnail_url: str = None):
+    """
+    Shows the compact thumbnail of an answer image with a link to the full-size
+    version, falling back to the full image for answers without a thumbnail.
+    """
+    st.image(thumbnail_url or image_url)
+    if thumbnail_url:
+        st.markdown(f"[Open full-size image]({image_url})")
+
 def render_chat():
     """
     Renders the main chat interface, including history and user input handling.
@@ -18,7 +27,7 @@ def render_chat():
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
             if msg.get("image_url"):
-                st.image(msg["image_url"])
+                render_image(msg["image_url"], msg.get("thumbnail_url"))
             if msg.get("sources"):
                 # Deduplicate sources and display them cleanly
                 sources_text = ", ".join(list(set(msg["sources"])))
@@ -29,34 +38,43 @@ def render_chat():
         st.session_state.messages.append({"role": "user", "content": user_input})
         st.chat_message("user").markdown(user_input)
 
-        # Process and display the assistant's response
+        # Process and display the assistant's response as it is generated
         with st.chat_message("assistant"):
-            with st.spinner("Thinking... This may take a moment for complex questions."):
-                response = ask_question(user_input)
-            
-            if response.status_code == 200:
-                data = response.json()
-                answer = data.get("response", "Sorry, I couldn't find an answer.")
-                image_url = data.get("image_url")
-                sources = data.get("sources", [])
-                
-                st.markdown(answer)
-                if image_url:
-                    st.image(image_url)
-                if sources:
-                    sources_text = ", ".join(list(set(sources)))
-                    st.caption(f"Sources: {sources_text}")
+            answer_area = st.container()
+            details_area = st.container()
+            meta = {}
 
+            def answer_tokens():
+                for event in ask_question_stream(user_input, st.session_state.get("scope")):
+                    if event["type"] == "meta":
+                        # Sources and image arrive before the first token
+                        meta.update(event)
+                        with details_area:
+                            if event.get("image_url"):
+                                render_image(event["image_url"], event.get("thumbnail_url"))
+                            if event.get("sources"):
+                                sources_text = ", ".join(list(set(event["sources"])))
+                                st.caption(f"Sources: {sources_text}")
+                    elif event["type"] == "token":
+                        yield event["text"]
+                    elif event["type"] == "error":
+                        raise RuntimeError(event["error"])
+
+            try:
+                with answer_area:
+                    answer = st.write_stream(answer_tokens())
                 # Save the complete response to the session state
                 st.session_state.messages.append({
                     "role": "assistant",
-                    "content": answer,
-                    "image_url": image_url,
-                    "sources": sources
+                    "content": answer or "Sorry, I couldn't find an answer.",
+                    "image_url": meta.get("image_url"),
+                    "thumbnail_url": meta.get("thumbnail_url"),
+                    "sources": meta.get("sources", [])
                 })
-            else:
-                st.error(f"Error from backend: {response.text}")
+            except (requests.RequestException, RuntimeError) as e:
+                detail = e.response.text if getattr(e, "response", None) is not None else str(e)
+                st.error(f"Error from backend: {detail}")
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content": "Sorry, there was an error processing your request."
-                })
\ No newline at end of file
+                })
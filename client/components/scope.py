@@ -0,0 +1,25 @@
+# /components/scope.py
+
+import streamlit as st
+
+def render_scope():
+    """
+    Renders the search scope controls in the Streamlit sidebar.
+    The chosen collection also applies to new uploads; empty fields search everything.
+    """
+    st.header("Search scope")
+
+    collection = st.text_input("Collection", placeholder="All collections",
+                               help="Uploads go to this collection and questions only search it.")
+    documents = st.text_input("Documents", placeholder="All documents",
+                              help="Comma-separated file names, e.g. manual.pdf, specs.pdf")
+    col_from, col_to = st.columns(2)
+    page_from = col_from.number_input("From page", min_value=1, value=None, step=1)
+    page_to = col_to.number_input("To page", min_value=1, value=None, step=1)
+
+    st.session_state.scope = {
+        "collection": collection.strip() or None,
+        "sources": [name.strip() for name in documents.split(",") if name.strip()],
+        "page_from": int(page_from) if page_from else None,
+        "page_to": int(page_to) if page_to else None,
+    }
@@ -1,7 +1,18 @@
 # /components/upload.py
 
+import time
 import streamlit as st
-from utils.api import upload_pdfs_api
+from utils.api import upload_pdf_api, get_job_status
+
+# Seconds between two progress polls while an ingestion job is running.
+POLL_INTERVAL = 2
+
+def _job_progress(jobs: list) -> float:
+    """Returns the fraction of pages embedded across all files of the given jobs."""
+    files = [f for job in jobs for f in job["files"].values()]
+    total = sum(f.get("total_pages") or 0 for f in files)
+    embedded = sum(f.get("pages_embedded", 0) for f in files)
+    return embedded / total if total else 0.0
 
 def render_uploader():
     """
@@ -18,10 +29,32 @@ def render_uploader():
     )
 
     if st.button("Upload to DB", use_container_width=True) and uploaded_files:
-        with st.spinner("Processing documents... This may take a few minutes."):
-            response = upload_pdfs_api(uploaded_files)
-            if response.status_code == 200:
+        # One streamed request (and ingestion job) per file keeps memory flat on both ends
+        job_ids = []
+        with st.spinner("Uploading documents..."):
+            for file in uploaded_files:
+                response = upload_pdf_api(file, st.session_state.get("scope", {}).get("collection"))
+                if response.status_code != 202:
+                    st.error(f"Error uploading {file.name}: {response.text}")
+                    return
+                job_ids.append(response.json()["job_id"])
+
+        progress_bar = st.progress(0.0, text="Queued for processing...")
+        while True:
+            jobs = []
+            for job_id in job_ids:
+                status_response = get_job_status(job_id)
+                if status_response.status_code != 200:
+                    st.error(f"Error: {status_response.text}")
+                    return
+                jobs.append(status_response.json())
+            file_states = ", ".join(f"{name}: {f['status']}" for job in jobs for name, f in job["files"].items())
+            progress_bar.progress(_job_progress(jobs), text=file_states)
+            failed = [job for job in jobs if job["status"] == "failed"]
+            if failed:
+                st.error(f"Error: {failed[0].get('error')}")
+                return
+            if all(job["status"] == "done" for job in jobs):
                 st.success("Documents processed successfully!")
                 st.rerun() # Rerun to update the app state
-            else:
-                st.error(f"Error: {response.text}")
\ No newline at end of file
+            time.sleep(POLL_INTERVAL)
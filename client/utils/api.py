@@ -1,33 +1,112 @@
 # /utils/api.py
 
+import json
 import requests
-from typing import List
+from requests.adapters import HTTPAdapter
+from typing import Iterator, List
 import streamlit as st
 from config import API_URL
 
-def upload_pdfs_api(files: List[st.runtime.uploaded_file_manager.UploadedFile]) -> requests.Response:
+# Connections kept open to the backend, shared by every call (and Streamlit session) in this process.
+POOL_SIZE = 16
+
+def _create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Reusing connections saves a TCP (and TLS) handshake per question
+_session = _create_session()
+
+def _scope_fields(scope: dict = None) -> dict:
+    """Form fields restricting a question to a collection, some documents and/or a page range."""
+    return {key: value for key, value in (scope or {}).items() if value not in (None, [], "")}
+
+def upload_pdf_api(file: st.runtime.uploaded_file_manager.UploadedFile, collection: str = None) -> requests.Response:
     """
-    Sends a list of uploaded PDF files to the backend's /upload_pdfs/ endpoint.
+    Streams one uploaded PDF to the backend's /upload_pdf_stream/ endpoint.
+    The file object itself is passed as the request body, so requests sends it
+    in blocks instead of first building a multipart body holding every byte.
 
     Args:
-        files: A list of Streamlit UploadedFile objects.
+        file: A Streamlit UploadedFile object.
+        collection: Optional collection to file the document under.
 
     Returns:
-        The Response object from the requests.post call.
+        The Response object from the session.post call. On success (202) its
+        JSON body contains the `job_id` of the queued ingestion.
     """
-    files_payload = [
-        ("files", (file.name, file.getvalue(), "application/pdf")) for file in files
-    ]
-    return requests.post(f"{API_URL}/upload_pdfs/", files=files_payload)
+    file.seek(0)
+    return _session.post(
+        f"{API_URL}/upload_pdf_stream/",
+        params={"filename": file.name, **({"collection": collection} if collection else {})},
+        data=file,
+        headers={"Content-Type": "application/pdf"},
+    )
 
-def ask_question(question: str) -> requests.Response:
+def ask_question(question: str, scope: dict = None) -> requests.Response:
     """
     Sends a user's question to the backend's /ask/ endpoint.
 
     Args:
         question: The user's question as a string.
+        scope: Optional {"collection", "sources", "page_from", "page_to"} restriction.
+
+    Returns:
+        The Response object from the session.post call.
+    """
+    return _session.post(f"{API_URL}/ask/", data={"question": question, **_scope_fields(scope)})
+
+def ask_question_stream(question: str, scope: dict = None) -> Iterator[dict]:
+    """
+    Sends a user's question to the backend's /ask_stream/ endpoint and yields
+    its NDJSON events as they arrive: "meta" (sources and image URLs), "token"
+    (a chunk of the answer), "done" (the full answer) or "error".
+
+    Args:
+        question: The user's question as a string.
+        scope: Optional {"collection", "sources", "page_from", "page_to"} restriction.
+
+    Raises:
+        requests.HTTPError: If the backend rejects the question before streaming starts.
+    """
+    data = {"question": question, **_scope_fields(scope)}
+    with _session.post(f"{API_URL}/ask_stream/", data=data, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
+
+def ask_questions_batch(questions: List[str], scope: dict = None) -> Iterator[dict]:
+    """
+    Sends many questions to the backend's /ask_batch/ endpoint in one request
+    and yields its NDJSON events as they arrive: one "answer" (or "error")
+    event per question, in the order given, each with its `index`, then "done".
+
+    Args:
+        questions: The questions to answer.
+        scope: Optional {"collection", "sources", "page_from", "page_to"} restriction.
+
+    Raises:
+        requests.HTTPError: If the backend rejects the batch before streaming starts.
+    """
+    data = {"questions": questions, **_scope_fields(scope)}
+    with _session.post(f"{API_URL}/ask_batch/", data=data, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
+
+def get_job_status(job_id: str) -> requests.Response:
+    """
+    Fetches the progress of an ingestion job from the backend's /jobs/{job_id} endpoint.
+
+    Args:
+        job_id: The ID returned by the upload endpoint.
 
     Returns:
-        The Response object from the requests.post call.
+        The Response object from the session.get call.
     """
-    return requests.post(f"{API_URL}/ask/", data={"question": question})
\ No newline at end of file
+    return _session.get(f"{API_URL}/jobs/{job_id}")
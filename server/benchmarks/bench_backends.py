@@ -0,0 +1,120 @@
+# benchmarks/bench_backends.py
+#
+# Compares the PyTorch and int8 ONNX inference backends for bge-m3 and
+# bge-reranker-v2-m3: load time, query/batch latency, resident memory and
+# score parity. Each backend is measured in a fresh subprocess so memory
+# numbers are not polluted by the other one.
+#
+# Usage (from the server/ directory):
+#   python benchmarks/bench_backends.py [--runs 50] [--backends torch onnx] [--skip-parity]
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+QUERIES = [
+    "What does the architecture diagram show?",
+    "¿Cuál es el flujo de datos entre los componentes?",
+    "Which part number is listed for the pump assembly?",
+    "Summarize the safety requirements on page 4.",
+]
+PASSAGE = (
+    "[TEXTUAL SUMMARY OF PAGE 3]:\nThe system ingests PDF documents, extracts text with OCR and "
+    "summarizes each page. [VISUAL DESCRIPTION OF PAGE 3]:\nA flowchart connects the upload service, "
+    "the OCR workers, the embedding model and the vector database. "
+)
+PASSAGES = [PASSAGE * (1 + i % 4) for i in range(10)]
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _percentiles(samples: list) -> dict:
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50_ms": pick(0.50) * 1000, "p95_ms": pick(0.95) * 1000, "mean_ms": statistics.mean(samples) * 1000}
+
+
+def _timed(fn, runs: int) -> dict:
+    fn()  # warm-up
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _percentiles(samples)
+
+
+def measure_backend(backend: str, runs: int) -> dict:
+    from modules.inference_backend import load_embeddings, load_cross_encoder
+
+    rss_start = _rss_mb()
+    started = time.perf_counter()
+    embeddings = load_embeddings(backend)
+    embed_load_s = time.perf_counter() - started
+    started = time.perf_counter()
+    reranker = load_cross_encoder(backend)
+    rerank_load_s = time.perf_counter() - started
+    rss_loaded = _rss_mb()
+
+    pairs = [[QUERIES[0], passage] for passage in PASSAGES]
+    result = {
+        "backend": backend,
+        "load_s": {"embeddings": embed_load_s, "reranker": rerank_load_s},
+        "embed_query": _timed(lambda: embeddings.embed_query(QUERIES[1]), runs),
+        "embed_10_docs": _timed(lambda: embeddings.embed_documents(PASSAGES), max(3, runs // 10)),
+        "rerank_10_pairs": _timed(lambda: reranker.predict(pairs), runs),
+        "rss_mb": {"before_load": rss_start, "after_load": rss_loaded, "end": _rss_mb()},
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the torch and onnx inference backends.")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx"])
+    parser.add_argument("--skip-parity", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Write the JSON report to this file as well.")
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_backend(args.child, args.runs)))
+        return
+
+    report = {"backends": []}
+    for backend in args.backends:
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", backend, "--runs", str(args.runs)],
+            cwd=SERVER_DIR, check=True, capture_output=True, text=True,
+        )
+        report["backends"].append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    if not args.skip_parity:
+        from modules.inference_backend import check_parity
+        report["parity"] = check_parity(QUERIES + PASSAGES, [[q, p] for q in QUERIES for p in PASSAGES])
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
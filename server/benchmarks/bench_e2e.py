@@ -0,0 +1,368 @@
+# benchmarks/bench_e2e.py
+#
+# Offline end-to-end benchmark of ingestion (`load_vectorstore`) and querying
+# (`query_chain` / `stream_query`). Groq and Replicate are replaced by the local
+# stub server in benchmarks/stub_providers.py with configurable latency, and the
+# embedding/reranker models can be swapped for tiny local models or for
+# deterministic stand-ins that need no download at all.
+#
+# Synthetic PDFs mix born-digital pages with scanned (image-only) pages; scanned
+# pages go through the real hi_res OCR, which downloads its layout model on the
+# first run. Use --scanned-ratio 0 for a run that needs no network at all.
+#
+# Usage (from the server/ directory):
+#   python benchmarks/bench_e2e.py [--docs 2] [--pages 20] [--scanned-ratio 0.25]
+#       [--models stub|tiny|default] [--queries 50] [--concurrency 4]
+#       [--llm-latency 0.3] [--vlm-latency 0.8] [--token-latency 0.01] [--output result.json]
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import shutil
+import resource
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TINY_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+TINY_RERANKER_MODEL = "cross-encoder/ms-marco-TinyBERT-L-2-v2"
+STUB_EMBEDDING_DIMS = 256
+
+WORDS = (
+    "pump valve sensor controller housing bracket gasket turbine compressor manifold relay "
+    "pressure flow temperature voltage calibration assembly maintenance inspection tolerance "
+    "diagram schematic interface module bearing coupling filter reservoir actuator"
+).split()
+
+
+# --- Synthetic documents ---
+def _page_text(rng: random.Random, doc_index: int, page_num: int, facts: list) -> str:
+    part = f"PN-{rng.randint(1000, 9999)}-{doc_index}{page_num}"
+    component = rng.choice(WORDS)
+    facts.append((part, component, page_num))
+    sentences = [
+        f"Section {page_num}. The {component} assembly uses part number {part}.",
+        *(" ".join(rng.choice(WORDS) for _ in range(14)).capitalize() + "." for _ in range(rng.randint(12, 24))),
+    ]
+    return " ".join(sentences)
+
+
+def make_pdf(path: str, pages: int, scanned_ratio: float, rng: random.Random, doc_index: int, facts: list) -> int:
+    """Writes a synthetic PDF; scanned pages carry only a rendered image, no text layer. Returns the scanned page count."""
+    import fitz  # PyMuPDF
+
+    scanned = 0
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        text = _page_text(rng, doc_index, page_num, facts)
+        page = doc.new_page()
+        box = page.rect + (50, 50, -50, -250)
+        if rng.random() < scanned_ratio:
+            scratch = fitz.open()
+            scratch_page = scratch.new_page()
+            scratch_page.insert_textbox(box, text, fontsize=10)
+            page.insert_image(page.rect, pixmap=scratch_page.get_pixmap(dpi=150))
+            scratch.close()
+            scanned += 1
+        else:
+            page.insert_textbox(box, text, fontsize=10)
+            # A small "diagram" so sub-image extraction and the image index are exercised
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 200, 120), False)
+            pixmap.set_rect(pixmap.irect, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+            page.insert_image(fitz.Rect(50, page.rect.height - 220, 350, page.rect.height - 40), pixmap=pixmap)
+    doc.save(path)
+    doc.close()
+    return scanned
+
+
+# --- Model stand-ins (--models stub) ---
+def _words(text: str) -> list:
+    return [w.strip(".,;:?!").lower() for w in text.split()]
+
+
+class HashEmbeddings:
+    """Deterministic bag-of-words hashing embeddings; no model download, meaningful word overlap."""
+
+    def _embed(self, text: str) -> list:
+        vector = [0.0] * STUB_EMBEDDING_DIMS
+        for word in _words(text):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % STUB_EMBEDDING_DIMS] += 1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+class OverlapCrossEncoder:
+    """Scores (query, passage) pairs by word overlap, with `CrossEncoder.predict`'s interface."""
+
+    def predict(self, pairs, **_) -> list:
+        scores = []
+        for query, passage in pairs:
+            query_words, passage_words = set(_words(query)), set(_words(passage))
+            scores.append(len(query_words & passage_words) / (len(query_words) or 1))
+        return scores
+
+
+# --- Measurement helpers ---
+def _proc_status(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+class ResourceSampler:
+    """Samples RSS and thread counts in the background while a phase runs."""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((_proc_status("VmRSS") / 1024, threading.active_count(), _proc_status("Threads")))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self) -> dict:
+        if not self.samples:
+            return {}
+        rss, python_threads, os_threads = zip(*self.samples)
+        return {
+            "rss_mb_max": max(rss),
+            "rss_mb_mean": sum(rss) / len(rss),
+            "python_threads_max": max(python_threads),
+            "os_threads_max": max(os_threads),
+            "os_threads_mean": sum(os_threads) / len(os_threads),
+        }
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": sum(ordered) / len(ordered) * 1000}
+
+
+class StageRecorder:
+    """Progress callback that timestamps every per-page stage event of the ingestion pipeline."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, filename, stage, page_num=None, total_pages=None):
+        if page_num is None:
+            return
+        with self._lock:
+            self.events.setdefault(stage, []).append(time.perf_counter() - self.started)
+
+    def report(self) -> dict:
+        stages = {}
+        for stage, stamps in self.events.items():
+            stamps = sorted(stamps)
+            span = stamps[-1] - stamps[0] if len(stamps) > 1 else 0.0
+            stages[stage] = {
+                "pages": len(stamps),
+                "first_s": stamps[0],
+                "last_s": stamps[-1],
+                "pages_per_s": len(stamps) / span if span else None,
+            }
+        return stages
+
+
+# --- Phases ---
+def run_ingestion(index, pdf_paths: list) -> dict:
+    from modules.load_vectorstore import load_vectorstore
+
+    recorder = StageRecorder()
+    with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        pages = load_vectorstore(pdf_paths, index, progress=recorder)
+        elapsed = time.perf_counter() - started
+    return {
+        "pages_indexed": pages,
+        "seconds": elapsed,
+        "pages_per_s": pages / elapsed if elapsed else None,
+        "stages": recorder.report(),
+        "resources": sampler.report(),
+    }
+
+
+def run_queries(index, questions: list, concurrency: int) -> dict:
+    from modules.query_handlers import query_chain, stream_query, answer_batch
+
+    chain = index.chain
+    query_chain(chain, questions[0])  # warm-up: loads the reranker and opens connections
+
+    def timed_query(question):
+        started = time.perf_counter()
+        query_chain(chain, question)
+        return time.perf_counter() - started
+
+    def timed_stream(question):
+        started = time.perf_counter()
+        first_token = None
+        for event in stream_query(chain, question):
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter() - started
+        return first_token, time.perf_counter() - started
+
+    with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed_query, questions))
+        elapsed = time.perf_counter() - started
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            streamed = list(pool.map(timed_stream, questions))
+        batch_started = time.perf_counter()
+        batch_answered = sum(event["type"] == "answer" for event in answer_batch(chain, questions))
+        batch_elapsed = time.perf_counter() - batch_started
+    return {
+        "queries": len(questions),
+        "concurrency": concurrency,
+        "queries_per_s": len(questions) / elapsed,
+        "latency": _percentiles(latencies),
+        "stream_time_to_first_token": _percentiles([ttft for ttft, _ in streamed if ttft is not None]),
+        "stream_total": _percentiles([total for _, total in streamed]),
+        "batch_queries_per_s": batch_answered / batch_elapsed,
+        "resources": sampler.report(),
+    }
+
+
+def cleanup(sources: list, index):
+    """Removes the benchmark's documents from the shared ingestion cache, checkpoints, image index and image store."""
+    from modules.load_vectorstore import ingest_cache, checkpoints
+    from modules.image_index import remove_index
+    from modules.scoping import DEFAULT_COLLECTION
+
+    for source, _ in sources:
+        # Also deletes the stored images no other document references
+        remove_index(DEFAULT_COLLECTION, source)
+        ingest_cache.forget_source(DEFAULT_COLLECTION, source)
+        checkpoints.forget(DEFAULT_COLLECTION, source)
+        index.delete_source(DEFAULT_COLLECTION, source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end ingestion and query benchmark.")
+    parser.add_argument("--docs", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=20, help="Pages per document.")
+    parser.add_argument("--scanned-ratio", type=float, default=0.25)
+    parser.add_argument("--models", choices=["stub", "tiny", "default"], default="stub",
+                        help="stub: hashing embeddings + word-overlap reranker; tiny: small HF models; default: bge-m3 + bge-reranker.")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds before the stub LLM answers.")
+    parser.add_argument("--vlm-latency", type=float, default=0.8, help="Seconds before the stub VLM answers.")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds per generated answer token.")
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep-artifacts", action="store_true", help="Keep the generated images and cache entries.")
+    parser.add_argument("--output", help="Write the JSON report to this file as well.")
+    args = parser.parse_args()
+
+    from stub_providers import StubConfig, start_stub_server
+
+    # One stub per provider, so each gets its own latency
+    groq_stub = start_stub_server(0, StubConfig(latency=args.llm_latency, answer_tokens=args.answer_tokens,
+                                                 token_latency=args.token_latency))
+    replicate_stub = start_stub_server(0, StubConfig(latency=args.vlm_latency))
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{groq_stub.server_port}/openai/v1"
+    os.environ["REPLICATE_BASE_URL"] = f"http://127.0.0.1:{replicate_stub.server_port}/v1"
+    os.environ.setdefault("GROQ_API_KEY", "stub")
+    os.environ.setdefault("REPLICATE_API_TOKEN", "stub")
+    # The stubs do not rate-limit, so the client-side limits should not either
+    for prefix in ("GROQ", "REPLICATE"):
+        os.environ.setdefault(f"{prefix}_RPM", "100000")
+        os.environ.setdefault(f"{prefix}_TPM", "100000000")
+    if args.models == "stub":
+        # Distinct names keep the stand-ins' vectors out of the real models' embedding cache namespace
+        os.environ["EMBEDDING_MODEL_NAME"] = "stub/hash-embeddings"
+        os.environ["RERANKER_MODEL_NAME"] = "stub/word-overlap"
+    elif args.models == "tiny":
+        os.environ["EMBEDDING_MODEL_NAME"] = TINY_EMBEDDING_MODEL
+        os.environ["RERANKER_MODEL_NAME"] = TINY_RERANKER_MODEL
+
+    # Imported only now: the modules read their configuration at import time
+    from modules.models import registry
+    from modules.reranker import BatchingReranker
+    from modules.load_vectorstore import cached_embeddings
+    from modules.index_manager import IndexManager
+
+    if args.models == "stub":
+        registry.register("embeddings", HashEmbeddings)
+        registry.register("reranker", lambda: BatchingReranker(OverlapCrossEncoder()))
+    started = time.perf_counter()
+    registry.warm_up()
+    model_load_s = time.perf_counter() - started
+
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    work_dir = tempfile.mkdtemp(prefix="visiondoc-bench-")
+    facts, sources, pdf_paths, scanned = [], [], [], 0
+    for doc_index in range(args.docs):
+        path = os.path.join(work_dir, f"bench_{run_id}_{doc_index}.pdf")
+        scanned += make_pdf(path, args.pages, args.scanned_ratio, rng, doc_index, facts)
+        pdf_paths.append(path)
+        sources.append((os.path.basename(path), args.pages))
+
+    index = IndexManager(cached_embeddings, persist_dir=os.path.join(work_dir, "index"))
+    report = {
+        "config": {**vars(args), "scanned_pages": scanned},
+        "model_load_s": model_load_s,
+        "models": registry.status(),
+    }
+    try:
+        report["ingestion"] = run_ingestion(index, pdf_paths)
+        questions = [
+            rng.choice([f"Which part number does the {component} assembly use?", f"What is {part} used for?"])
+            for part, component, _ in (rng.choice(facts) for _ in range(args.queries))
+        ]
+        report["query"] = run_queries(index, questions, args.concurrency)
+    finally:
+        if not args.keep_artifacts:
+            cleanup(sources, index)
+            shutil.rmtree(work_dir, ignore_errors=True)
+        groq_stub.shutdown()
+        replicate_stub.shutdown()
+
+    # ru_maxrss is reported in kilobytes on Linux; children are the OCR worker processes
+    report["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report["peak_rss_children_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# benchmarks/stub_providers.py
+#
+# Local stand-in for the Groq and Replicate HTTP APIs used during ingestion and
+# answering (including streamed chat completions). Point the server at it with:
+#   GROQ_BASE_URL=http://127.0.0.1:8900/openai/v1 REPLICATE_BASE_URL=http://127.0.0.1:8900/v1
+#
+# Usage: python benchmarks/stub_providers.py --port 8900 --latency 0.5 --rate-limit-every 10
+
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubConfig:
+    """Behaviour shared by all request handlers of one stub server."""
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, rate_limit_every: int = 0, retry_after: float = 1.0,
+                 answer_tokens: int = 64, token_latency: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        # Length of generated chat answers and the delay per generated token
+        self.answer_tokens = answer_tokens
+        self.token_latency = token_latency
+        # Every Nth request is answered with 429 + Retry-After (0 disables)
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def should_reject(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            reject = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+            if reject:
+                self.rejected += 1
+            return bool(reject)
+
+    def sleep(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+
+def make_handler(config: StubConfig):
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _read_body(self) -> bytes:
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else b""
+
+        def do_POST(self):
+            raw = self._read_body()
+            if config.should_reject():
+                return self._send_json(429, {"error": "rate limited"}, {"Retry-After": str(config.retry_after)})
+            config.sleep()
+
+            if self.path == "/openai/v1/chat/completions":
+                body = json.loads(raw or b"{}")
+                prompt = body.get("messages", [{}])[-1].get("content", "")
+                if body.get("stream"):
+                    return self._stream_completion(body)
+                text = f"Stub summary of {len(prompt)} characters of input."
+                time.sleep(config.token_latency * config.answer_tokens)
+                return self._send_json(200, {
+                    "id": uuid.uuid4().hex,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4},
+                })
+            if self.path == "/v1/files":
+                file_id = uuid.uuid4().hex
+                host = self.headers.get("Host")
+                return self._send_json(201, {"id": file_id, "urls": {"get": f"http://{host}/v1/files/{file_id}"}})
+            if self.path == "/v1/predictions":
+                prediction_id = uuid.uuid4().hex
+                return self._send_json(201, {
+                    "id": prediction_id,
+                    "status": "succeeded",
+                    "output": ["Stub ", "visual ", "description."],
+                    "urls": {"get": f"http://{self.headers.get('Host')}/v1/predictions/{prediction_id}"},
+                })
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+        def _stream_completion(self, body: dict):
+            """Answers in OpenAI/Groq server-sent-event chunks, one token every `token_latency` seconds."""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            completion_id = uuid.uuid4().hex
+            tokens = ["Stub "] + ["answer "] * max(0, config.answer_tokens - 2) + ["[Source: Page 1]"]
+            for i, token in enumerate(tokens + [None]):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "stub"),
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": token} if token is not None else {},
+                        "finish_reason": None if token is not None else "stop",
+                    }],
+                }
+                if token is not None and i:
+                    time.sleep(config.token_latency)
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def do_GET(self):
+            if self.path.startswith("/v1/predictions/"):
+                return self._send_json(200, {"id": self.path.rsplit("/", 1)[-1], "status": "succeeded", "output": ["Stub visual description."]})
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    return StubHandler
+
+
+def start_stub_server(port: int = 0, config: StubConfig = None) -> ThreadingHTTPServer:
+    """Starts the stub in a background thread and returns the server (see `server.server_port`)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config or StubConfig()))
+    threading.Thread(target=server.serve_forever, name="stub-providers", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Groq/Replicate stub server.")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with 429.")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--answer-tokens", type=int, default=64, help="Tokens per generated chat answer.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per generated token.")
+    args = parser.parse_args()
+    stub = start_stub_server(args.port, StubConfig(
+        args.latency, args.jitter, args.rate_limit_every, args.retry_after, args.answer_tokens, args.token_latency
+    ))
+    print(f"Stub providers listening on http://127.0.0.1:{stub.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
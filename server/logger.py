@@ -1,32 +1,62 @@
 # logger.py
 
-import logging
+import os
 import sys
+import queue
+import atexit
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# Minimum level written to the console; DEBUG also logs per-page and per-query details.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# ID of the HTTP request being handled, set by the request ID middleware in main.py.
+# Context variables follow the request into run_in_threadpool calls.
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps each record with the current request ID (captured on the calling thread)."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
 
 def setup_logger(name="VisionDocRAG"):
     """
     Sets up a standardized logger for the application.
+    Records are handed to a queue and written to stdout by a background
+    listener thread, so logging never blocks a request on console I/O.
     """
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(LOG_LEVEL)
 
     # Avoid adding duplicate handlers
     if logger.hasHandlers():
         logger.handlers.clear()
 
-    # Console handler
+    # Console handler, driven by the queue listener
     ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(logging.DEBUG)
+    ch.setLevel(LOG_LEVEL)
 
     # Formatter
     formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(name)s] - %(message)s",
+        "[%(asctime)s] [%(levelname)s] [%(name)s] [%(request_id)s] - %(message)s",
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     ch.setFormatter(formatter)
 
-    logger.addHandler(ch)
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, ch, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
     return logger
 
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
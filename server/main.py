@@ -1,51 +1,76 @@
 # main.py
 
-import os
+import json
+import time
+import uuid
+import asyncio
+from functools import partial
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, UploadFile, File, Form, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from typing import List, Optional
 from pathlib import Path
 from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-
-from modules.load_vectorstore import load_vectorstore, PERSIST_DIR
-from modules.llm import get_rag_chain
-from modules.query_handlers import query_chain
-from logger import logger
+from modules.load_vectorstore import load_vectorstore, save_uploaded_files, cached_embeddings, ingest_cache, checkpoints
+from modules.index_manager import IndexManager
+from modules.query_handlers import query_chain, stream_query, answer_batch, ASK_BATCH_MAX_QUESTIONS
+from modules.answer_cache import AnswerCache
+from modules.image_index import remove_index as remove_image_index
+from modules.image_store import ImmutableStaticFiles
+from modules.jobs import JobManager, JobQueueFullError, TERMINAL_STATUSES
+from modules.checkpoints import RetryScheduler
+from modules.scheduler import QueryScheduler, QueryRejectedError
+from modules.scoping import DEFAULT_COLLECTION, scope_filter, scope_key
+from modules.uploads import UploadWriter, UploadRejectedError, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE
+from modules.models import registry as model_registry, start_warm_up
+from modules.metrics import registry as metrics_registry, REQUEST_SECONDS
+from logger import logger, request_id_var
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Manages application startup and shutdown events.
-    Loads resource-intensive models once to be reused across requests.
+    Model weights are loaded once through the shared registry, in the
+    background by default so the server answers right away.
     """
-    logger.info("Starting application and loading base models...")
+    logger.info("Starting application...")
+    start_warm_up()
     
-    # Ensure embedding model consistency between ingestion and querying
-    app.state.embeddings = HuggingFaceEmbeddings(model_name="BAAI/bge-m3")
+    # Ensure embedding model consistency between ingestion and querying:
+    # the index reuses the ingestion pipeline's (cache-backed) bge-m3 instance.
+    app.state.index = IndexManager(cached_embeddings)
     
-    if os.path.exists(PERSIST_DIR) and os.listdir(PERSIST_DIR):
-        app.state.vectorstore = Chroma(persist_directory=str(PERSIST_DIR), embedding_function=app.state.embeddings)
-        app.state.chain = get_rag_chain(app.state.vectorstore)
+    if app.state.index.chain:
         logger.info("Existing vectorstore loaded and RAG chain initialized.")
     else:
-        app.state.vectorstore, app.state.chain = None, None
         logger.warning("No vectorstore found. System is waiting for a document upload.")
+
+    app.state.jobs = JobManager()
+    # Resumes files an earlier run left unfinished right away, then keeps retrying files with failed pages
+    app.state.retries = RetryScheduler(
+        checkpoints, lambda paths, collection: app.state.jobs.submit(paths, partial(_run_ingestion, collection=collection))
+    )
+    app.state.retries.start()
+    # Answers are keyed on the index version, so every ingestion or deletion invalidates them
+    app.state.answers = AnswerCache(embed_query=cached_embeddings.embed_query)
+    # Bounds the queries running and waiting in this worker process
+    app.state.queries = QueryScheduler()
     
     logger.info("Application ready to receive requests!")
     yield
+    app.state.retries.stop()
+    app.state.jobs.shutdown()
     logger.info("Application is shutting down.")
 
 app = FastAPI(title="VisionDoc-RAG", lifespan=lifespan)
 
 # --- Static File Serving ---
 SERVER_ROOT = Path(__file__).parent
-app.mount("/static", StaticFiles(directory=SERVER_ROOT / "static"), name="static")
+# Image names are content hashes, so responses carry ETags and immutable Cache-Control headers
+app.mount("/static", ImmutableStaticFiles(directory=SERVER_ROOT / "static"), name="static")
 
 # --- Middleware Configuration ---
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
@@ -59,41 +84,357 @@ async def catch_exception_middleware(request: Request, call_next):
         logger.exception("UNHANDLED EXCEPTION")
         return JSONResponse(status_code=500, content={"error": str(exc)})
 
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """
+    Tags every log line of a request with its ID (the caller's X-Request-ID, or a
+    new one), echoes the ID back in the response and records the request latency.
+    """
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+        # Label by route template, not the raw path, to keep the number of series bounded
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method, route=getattr(route, "path", "unmatched"), status=response.status_code,
+        )
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
 # --- API Endpoints ---
-@app.post("/upload_pdfs/")
-async def upload_pdfs(files: List[UploadFile] = File(...)):
-    """Handles PDF file uploads and triggers the ingestion pipeline."""
+def _run_ingestion(file_paths: list, progress, collection: str = None):
+    """Ingests files straight into the live index; pages become queryable file by file."""
+    return load_vectorstore(file_paths, app.state.index, progress=progress, collection=collection)
+
+@app.post("/upload_pdfs/", status_code=202)
+async def upload_pdfs(files: List[UploadFile] = File(...), collection: Optional[str] = Form(None)):
+    """
+    Stores uploaded PDFs and queues them for ingestion, returning a job ID right away.
+    `collection` groups them for scoped queries (see modules/scoping.py); a file
+    name is only unique within its collection.
+    """
     if not files:
         return JSONResponse(status_code=400, content={"error": "No files were uploaded."})
+    collection = collection or DEFAULT_COLLECTION
     try:
         logger.info(f"Received {len(files)} files for background processing.")
-        # Run the heavy ingestion task in a separate thread to avoid blocking the server
-        new_vectorstore = await run_in_threadpool(load_vectorstore, files)
-        
-        # Update the application state with the new data
-        app.state.vectorstore = new_vectorstore
-        app.state.chain = get_rag_chain(app.state.vectorstore)
-        
-        logger.info("Vectorstore reloaded and chain updated after ingestion.")
-        return {"message": "Files processed and vectorstore updated."}
+        # The request's temporary files are closed once we return, so persist them first
+        file_paths = await run_in_threadpool(save_uploaded_files, files, collection)
+        job = app.state.jobs.submit(file_paths, partial(_run_ingestion, collection=collection))
+        return JSONResponse(status_code=202, content={"message": "Files queued for processing.", "job_id": job.id})
+    except UploadRejectedError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except JobQueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "30"})
     except Exception as e:
         logger.exception("Error during PDF upload")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/upload_pdf_stream/", status_code=202)
+async def upload_pdf_stream(request: Request, filename: str, collection: Optional[str] = None):
+    """
+    Streams one PDF sent as the raw request body straight to disk and queues
+    it for ingestion. Unlike the multipart endpoint, the body is never spooled
+    to a temporary file first; memory use stays at one chunk for any file size.
+    """
+    declared = int(request.headers.get("content-length") or 0)
+    if declared > MAX_UPLOAD_BYTES:
+        return JSONResponse(status_code=413, content={"error": f"'{filename}' exceeds the upload limit."})
+    collection = collection or DEFAULT_COLLECTION
+    writer = None
+    try:
+        writer = UploadWriter(filename, collection)
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(writer.write, bytes(buffer))
+                buffer.clear()
+        await run_in_threadpool(writer.write, bytes(buffer))
+        path = await run_in_threadpool(writer.finish)
+        logger.info(f"Received {path.name} ({writer.size / 1e6:.1f} MB) for background processing.")
+        job = app.state.jobs.submit([path], partial(_run_ingestion, collection=collection))
+        return JSONResponse(status_code=202, content={"message": "File queued for processing.", "job_id": job.id})
+    except UploadRejectedError as e:
+        if writer:
+            writer.abort()
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except JobQueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "30"})
+    except Exception as e:
+        if writer:
+            writer.abort()
+        logger.exception("Error during streamed PDF upload")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns the current status and per-file/per-page progress of an ingestion job."""
+    snapshot = await run_in_threadpool(app.state.jobs.snapshot, job_id)
+    if snapshot is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job '{job_id}'."})
+    return snapshot
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    """Streams job progress as Server-Sent Events until the job finishes."""
+    if await run_in_threadpool(app.state.jobs.snapshot, job_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job '{job_id}'."})
+
+    async def event_stream():
+        last_version = -1
+        while True:
+            # The job may run in another worker process, so poll its snapshot rather than the job itself
+            snapshot = await run_in_threadpool(app.state.jobs.snapshot, job_id)
+            if snapshot is not None and snapshot["version"] != last_version:
+                last_version = snapshot["version"]
+                yield f"data: {json.dumps(snapshot)}\n\n"
+                if snapshot["status"] in TERMINAL_STATUSES:
+                    break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.delete("/documents/{source}")
+async def delete_document(source: str, collection: Optional[str] = None):
+    """
+    Removes every indexed page of a document from one collection (the default
+    one unless `collection` is given) without touching the rest of the corpus.
+    """
+    collection = collection or DEFAULT_COLLECTION
+    try:
+        deleted = await run_in_threadpool(app.state.index.delete_source, collection, source)
+        if not deleted:
+            return JSONResponse(status_code=404, content={"error": f"No indexed pages found for '{source}' in '{collection}'."})
+        ingest_cache.forget_source(collection, source)
+        checkpoints.forget(collection, source)
+        remove_image_index(collection, source)
+        return {"message": f"Deleted {deleted} page(s) of '{source}' from '{collection}'."}
+    except Exception as e:
+        logger.exception("Error deleting document")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+def _query_deadline(request: Request) -> float:
+    """Deadline of a query: the X-Request-Timeout header (seconds) if given, capped at QUERY_TIMEOUT_SECONDS."""
+    try:
+        requested = float(request.headers.get("X-Request-Timeout", 0))
+    except ValueError:
+        requested = None
+    return app.state.queries.deadline(requested)
+
+def _rejected(e: QueryRejectedError) -> JSONResponse:
+    return JSONResponse(status_code=e.status_code, content={"error": str(e)}, headers={"Retry-After": str(e.retry_after)})
+
+def _bad_scope(page_from: Optional[int], page_to: Optional[int]) -> Optional[JSONResponse]:
+    if page_from is not None and page_to is not None and page_from > page_to:
+        return JSONResponse(status_code=400, content={"error": "page_from must not be greater than page_to."})
+    return None
+
 @app.post("/ask/")
-async def ask_question(question: str = Form(...)):
-    """Handles user queries by invoking the RAG chain."""
-    if not app.state.chain:
+async def ask_question(request: Request, question: str = Form(...), collection: Optional[str] = Form(None),
+                       sources: Optional[List[str]] = Form(None), page_from: Optional[int] = Form(None),
+                       page_to: Optional[int] = Form(None)):
+    """
+    Handles user queries by invoking the RAG chain. The optional `collection`,
+    `sources` (repeatable) and `page_from`/`page_to` fields restrict retrieval
+    to those pages; without them the whole index is searched.
+    """
+    error = _bad_scope(page_from, page_to)
+    if error:
+        return error
+    where = scope_filter(collection, sources, page_from, page_to)
+    scope = scope_key(where)
+    # May reopen the vector store after another worker's write, so keep it off the event loop
+    _, chain, version = await run_in_threadpool(app.state.index.snapshot, where)
+    if not chain:
         return JSONResponse(status_code=400, content={"error": "The system is not ready. Please upload documents first."})
     try:
         logger.info(f"User query: {question}")
-        result = await run_in_threadpool(query_chain, app.state.chain, question)
+        # Cached answers cost nothing, so they skip admission control
+        cached = app.state.answers.get(question, version, scope)
+        if cached:
+            logger.info("Query answered from cache.")
+            return cached
+        result = await app.state.queries.run(
+            app.state.answers.get_or_compute, question, version, lambda: query_chain(chain, question), scope,
+            deadline=_query_deadline(request),
+        )
         logger.info("Query successful.")
         return result
+    except QueryRejectedError as e:
+        return _rejected(e)
     except Exception as e:
         logger.exception("Error processing question")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/ask_stream/")
+async def ask_question_stream(request: Request, question: str = Form(...), collection: Optional[str] = Form(None),
+                              sources: Optional[List[str]] = Form(None), page_from: Optional[int] = Form(None),
+                              page_to: Optional[int] = Form(None)):
+    """
+    Streams the answer as NDJSON: a "meta" line with the sources and image URLs
+    once retrieval is done, "token" lines as the LLM generates, then "done".
+    A stream holds a query slot until it ends. Its deadline bounds retrieval,
+    reranking and generation alike; when it passes, an "error" line ends the stream.
+    Accepts the same scope fields as /ask/.
+    """
+    error = _bad_scope(page_from, page_to)
+    if error:
+        return error
+    where = scope_filter(collection, sources, page_from, page_to)
+    scope = scope_key(where)
+    _, chain, version = await run_in_threadpool(app.state.index.snapshot, where)
+    if not chain:
+        return JSONResponse(status_code=400, content={"error": "The system is not ready. Please upload documents first."})
+    logger.info(f"User query (streaming): {question}")
+
+    cached = app.state.answers.get(question, version, scope)
+    if cached:
+        meta = {k: cached[k] for k in ("sources", "image_url", "thumbnail_url")}
+        events = [{"type": "meta", **meta}, {"type": "token", "text": cached["response"]}, {"type": "done", **cached}]
+        return StreamingResponse((json.dumps(event) + "\n" for event in events), media_type="application/x-ndjson")
+
+    scheduler = app.state.queries
+    deadline = _query_deadline(request)
+    try:
+        await scheduler.acquire(deadline)
+    except QueryRejectedError as e:
+        return _rejected(e)
+    started = time.monotonic()
+    released = False
+    streaming = False
+
+    def release():
+        # Runs once, on the event loop: when the stream's last step ends, or after the response if it never started
+        nonlocal released
+        if not released:
+            released = True
+            scheduler.release(started)
+
+    def release_unstarted():
+        if not streaming:
+            release()
+
+    async def events():
+        nonlocal streaming
+        streaming = True
+        stream = stream_query(chain, question)
+        step = None
+        try:
+            while True:
+                # Each step runs in the threadpool, bounded by what is left of the deadline: this covers
+                # retrieval, reranking and the wait for the first token as well as the tokens after it
+                step = asyncio.ensure_future(run_in_threadpool(next, stream, None))
+                try:
+                    event = await asyncio.wait_for(asyncio.shield(step), timeout=max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    logger.warning("Streaming query stopped at its deadline.")
+                    yield {"type": "error", "error": "The query did not finish before its deadline."}
+                    return
+                if event is None:
+                    break
+                if event["type"] == "done":
+                    answer = {k: event[k] for k in ("response", "sources", "image_url", "thumbnail_url")}
+                    app.state.answers.put(question, version, answer, scope)
+                yield event
+            logger.info("Streaming query successful.")
+        except Exception as e:
+            # Headers are already sent, so the error travels in-band
+            logger.exception("Error streaming answer")
+            yield {"type": "error", "error": str(e)}
+        finally:
+            if step is None or step.done():
+                release()
+            else:
+                # A step cannot be interrupted, so the slot is held until it finishes, as in QueryScheduler.run
+                step.add_done_callback(lambda t: (release(), t.cancelled() or t.exception()))
+
+    lines = (json.dumps(event) + "\n" async for event in events())
+    return StreamingResponse(lines, media_type="application/x-ndjson", background=BackgroundTask(release_unstarted))
+
+@app.post("/ask_batch/")
+async def ask_batch(request: Request, questions: List[str] = Form(...), collection: Optional[str] = Form(None),
+                    sources: Optional[List[str]] = Form(None), page_from: Optional[int] = Form(None),
+                    page_to: Optional[int] = Form(None)):
+    """
+    Answers many questions (repeated `questions` fields) in one request and
+    streams one NDJSON line per question in the order given, then a "done"
+    line with the counts. Cached answers are returned right away; the rest
+    share batched retrieval and concurrent generation (see `answer_batch`).
+    Accepts the same scope fields as /ask/. The batch holds one query slot
+    until it ends; its deadline only bounds the wait for that slot.
+    """
+    if len(questions) > ASK_BATCH_MAX_QUESTIONS:
+        return JSONResponse(status_code=413, content={"error": f"A batch may hold at most {ASK_BATCH_MAX_QUESTIONS} questions."})
+    error = _bad_scope(page_from, page_to)
+    if error:
+        return error
+    where = scope_filter(collection, sources, page_from, page_to)
+    scope = scope_key(where)
+    _, chain, version = await run_in_threadpool(app.state.index.snapshot, where)
+    if not chain:
+        return JSONResponse(status_code=400, content={"error": "The system is not ready. Please upload documents first."})
+
+    answers = app.state.answers
+    cached = [answers.get(question, version, scope) for question in questions]
+    logger.info(f"Batch of {len(questions)} question(s), {sum(c is not None for c in cached)} answered from cache.")
+
+    scheduler = app.state.queries
+    # Like single questions, a fully cached batch skips admission control
+    needs_slot = any(c is None for c in cached)
+    if needs_slot:
+        try:
+            await scheduler.acquire(_query_deadline(request))
+        except QueryRejectedError as e:
+            return _rejected(e)
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    released = not needs_slot
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            scheduler.release(started)
+
+    def events():
+        answered = failed = 0
+        try:
+            for event in answer_batch(chain, questions, cached):
+                if event["type"] == "answer":
+                    answered += 1
+                    if cached[event["index"]] is None:
+                        answer = {k: event[k] for k in ("response", "sources", "image_url", "thumbnail_url")}
+                        answers.put(event["question"], version, answer, scope)
+                else:
+                    failed += 1
+                yield event
+            logger.info(f"Batch finished: {answered} answered, {failed} failed.")
+            yield {"type": "done", "answered": answered, "failed": failed}
+        except Exception as e:
+            logger.exception("Error answering batch")
+            yield {"type": "error", "error": str(e)}
+        finally:
+            loop.call_soon_threadsafe(release)
+
+    lines = (json.dumps(event) + "\n" for event in events())
+    return StreamingResponse(lines, media_type="application/x-ndjson", background=BackgroundTask(release))
+
+@app.get("/models")
+async def models():
+    """Reports which shared models are loaded and how long each took to load."""
+    return model_registry.status()
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage ingestion and query latencies, page outcomes and HTTP latencies in the Prometheus text format."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/test")
 async def test():
     """A simple endpoint to check if the server is running."""
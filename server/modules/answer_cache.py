@@ -0,0 +1,193 @@
+# modules/answer_cache.py
+
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from logger import logger
+
+# --- Module-level Configuration ---
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 512))  # 0 disables the cache
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600))
+# Cosine similarity above which a paraphrased question reuses a cached answer; 0 disables the
+# semantic match. Costs one query embedding per cache miss on the exact key.
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0))
+
+
+def normalize_question(question: str) -> str:
+    """Case-, whitespace- and punctuation-insensitive form of a question, used as the cache key."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip(" ?!.¿¡")
+
+
+class _Entry:
+    __slots__ = ("result", "vector", "expires")
+
+    def __init__(self, result: dict, vector, expires: float):
+        self.result = result
+        self.vector = vector
+        self.expires = expires
+
+
+class AnswerCache:
+    """
+    LRU/TTL cache of `/ask` results in front of the RAG chain.
+
+    Entries are keyed on the normalized question, the index version and the
+    search scope (see `modules.scoping.scope_key`), so any committed write to
+    the index (an ingestion or a deletion) makes every older answer
+    unreachable; they are dropped the first time a newer version is seen.
+    Optionally, a question whose embedding is close enough to a cached one
+    reuses that answer. Concurrent calls for the same key are coalesced: one
+    runs the chain and the others wait for its result.
+    """
+
+    def __init__(self, embed_query=None, max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL_SECONDS, similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.embed_query = embed_query
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity if embed_query else 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, question: str):
+        vector = np.asarray(self.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _lookup(self, key: tuple, now: float):
+        """Exact-key lookup; must be called with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, vector, version: int, scope: str, now: float):
+        """Most similar live entry of `version` and `scope` above the threshold; must be called with the lock held."""
+        best_key, best_score = None, self.similarity
+        for key, entry in self._entries.items():
+            if key[1] != version or key[2] != scope or entry.vector is None or entry.expires < now:
+                continue
+            score = float(np.dot(vector, entry.vector))
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key]
+
+    def _store(self, key: tuple, result: dict, vector):
+        if key[1] != self._version:
+            return  # the index changed while the chain was running
+        self._entries[key] = _Entry(result, vector, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _advance(self, version: int) -> bool:
+        """
+        Moves the cache to `version`, dropping every answer of an older one.
+        Returns False for a version older than the current one, whose answers
+        must be neither served nor stored. Must be called with the lock held.
+        """
+        if self._version is not None and version < self._version:
+            return False
+        if version != self._version:
+            # Index changed: answers computed against the old content are invalid
+            self._entries.clear()
+            self._version = version
+        return True
+
+    def get_or_compute(self, question: str, version: int, compute, scope: str = "") -> dict:
+        """Returns the cached answer for `question` at index `version` and `scope`, or runs `compute()` once to produce it."""
+        if self.max_entries <= 0:
+            return compute()
+        key = (normalize_question(question), version, scope)
+        now = time.monotonic()
+        with self._lock:
+            current = self._advance(version)
+        if not current:
+            # Snapshot taken before the latest index write; its answer must not be cached
+            return compute()
+        with self._lock:
+            entry = self._lookup(key, now)
+            if entry is not None:
+                self.hits += 1
+                return entry.result
+            waiter = self._in_flight.get(key)
+            owner = waiter is None
+            if owner:
+                waiter = self._in_flight[key] = Future()
+            else:
+                self.hits += 1
+        if not owner:
+            return waiter.result()
+
+        try:
+            vector = None
+            if self.similarity:
+                vector = self._embed(question)
+                with self._lock:
+                    entry = self._nearest(vector, version, scope, time.monotonic())
+                    if entry is not None:
+                        self.hits += 1
+                if entry is not None:
+                    logger.debug(f"Answer cache: semantic hit for '{question}'")
+                    result = entry.result
+                    waiter.set_result(result)
+                    return result
+            with self._lock:
+                self.misses += 1
+            result = compute()
+            with self._lock:
+                self._store(key, result, vector)
+            waiter.set_result(result)
+            return result
+        except BaseException as exc:
+            # Errors are not cached; requests waiting on this one see the same error
+            waiter.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def get(self, question: str, version: int, scope: str = ""):
+        """Exact-key lookup for callers that produce answers themselves, e.g. the streaming endpoint."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            if not self._advance(version):
+                return None
+            entry = self._lookup((normalize_question(question), version, scope), time.monotonic())
+            if entry is not None:
+                self.hits += 1
+            return entry.result if entry else None
+
+    def put(self, question: str, version: int, result: dict, scope: str = ""):
+        """Stores an answer produced outside `get_or_compute`."""
+        if self.max_entries <= 0:
+            return
+        vector = self._embed(question) if self.similarity else None
+        with self._lock:
+            if not self._advance(version):
+                return  # the index changed while the answer was produced
+            self._store((normalize_question(question), version, scope), result, vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
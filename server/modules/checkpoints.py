@@ -0,0 +1,289 @@
+# modules/checkpoints.py
+
+import os
+import time
+import uuid
+import fcntl
+import sqlite3
+import threading
+from pathlib import Path
+
+from modules.ingest_cache import CACHE_DIR
+from modules.jobs import JobQueueFullError
+from modules.scoping import DEFAULT_COLLECTION
+from logger import logger
+
+# --- Module-level Configuration ---
+CHECKPOINT_PATH = CACHE_DIR / "checkpoints.sqlite3"
+# One lock file per live process that may run ingestion (see `_owner_alive`).
+OWNERS_DIR = CACHE_DIR / "owners"
+# Runs of a file that ends with failed pages before it is left for a manual re-upload.
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 5))
+# Delay before the first background retry of such a file; doubled after every further attempt.
+INGEST_RETRY_DELAY_SECONDS = int(os.environ.get("INGEST_RETRY_DELAY_SECONDS", 60))
+# How often the retry scheduler looks for files that are due.
+RETRY_POLL_SECONDS = 10
+
+# Page states after which a resumed run has nothing left to do for the page
+DONE_PAGE_STATES = ("embedded", "empty")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    collection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    path TEXT NOT NULL,
+    pdf_hash TEXT NOT NULL,
+    page_count INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    attempts INTEGER NOT NULL,
+    retry_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (collection, source)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    collection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    page_num INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    content TEXT,
+    error TEXT,
+    failures INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (collection, source, page_num)
+);
+"""
+
+
+def _owner_alive(owner: str) -> bool:
+    """
+    Whether the process that recorded `owner` is still running. Each process
+    holds an exclusive lock on its own file for its whole life; the kernel drops
+    the lock when the process dies, even after a crash, and unlike a PID the ID
+    is never reused by a later process.
+    """
+    path = OWNERS_DIR / f"{owner}.lock"
+    try:
+        with open(path, "r+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except BlockingIOError:
+        return True
+    os.remove(path)
+    return False
+
+
+class CheckpointLog:
+    """
+    Durable per-page progress of the files being ingested.
+
+    A file is recorded when its run starts ("running") and removed once all
+    of its pages are indexed. A run that ends with failed or degraded pages
+    leaves it "incomplete" with a backoff deadline for the retry scheduler,
+    and after INGEST_MAX_ATTEMPTS runs "failed". A crash leaves it "running"
+    under a dead owner, which `claim_interrupted` picks up. Several worker
+    processes may share the log; each file is claimed by one of them.
+    Files are keyed by collection and name, so the same file name uploaded
+    to two collections is tracked as two files.
+
+    Pages move through "text" (OCR or text-layer output, kept in the
+    ingestion cache) -> "enriched" (fused content stored here) -> "embedded".
+    "degraded" pages were indexed with a fallback because a summary or a
+    description failed; "failed" pages are missing from the index. Both are
+    processed again by the next run, and every result that did succeed is
+    served from the ingestion cache instead of being paid for twice.
+    """
+
+    def __init__(self, path: Path = CHECKPOINT_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._lock = threading.Lock()
+        OWNERS_DIR.mkdir(parents=True, exist_ok=True)
+        for stale in OWNERS_DIR.glob("*.lock"):
+            _owner_alive(stale.stem)  # removes the lock files of exited processes
+        self.owner = uuid.uuid4().hex
+        self._owner_file = open(OWNERS_DIR / f"{self.owner}.lock", "w")
+        fcntl.flock(self._owner_file, fcntl.LOCK_EX)
+
+    def _migrate(self):
+        """Moves checkpoints written before files were keyed by collection into their (or the default) collection."""
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if "collection" in {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}:
+                return
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+            collection = "COALESCE(f.collection, ?)" if "collection" in columns else "?"
+            owner = "f.owner" if "owner" in columns else "NULL"
+            self._conn.execute("ALTER TABLE files RENAME TO files_v1")
+            self._conn.execute("ALTER TABLE pages RENAME TO pages_v1")
+            # executescript() would commit the open transaction, so the tables are created one by one
+            for statement in filter(str.strip, _SCHEMA.split(";")):
+                self._conn.execute(statement)
+            self._conn.execute(
+                f"INSERT INTO files SELECT {collection}, f.source, f.path, f.pdf_hash, f.page_count, f.status, {owner}, "
+                "f.attempts, f.retry_at, f.updated_at FROM files_v1 f",
+                (DEFAULT_COLLECTION,),
+            )
+            self._conn.execute(
+                f"INSERT INTO pages SELECT {collection}, p.source, p.page_num, p.status, p.content, p.error, p.failures, "
+                "p.updated_at FROM pages_v1 p LEFT JOIN files_v1 f ON f.source = p.source",
+                (DEFAULT_COLLECTION,),
+            )
+            self._conn.execute("DROP TABLE files_v1")
+            self._conn.execute("DROP TABLE pages_v1")
+
+    def start_file(self, collection: str, source: str, path: str, pdf_hash: str, page_count: int) -> dict:
+        """
+        Records the start of a run over `source` in `collection` and returns the
+        checkpoints of its pages as {page_num: (status, content)}. Checkpoints
+        of another version of the file are discarded.
+        """
+        now = time.time()
+        key = (collection, source)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT pdf_hash, attempts FROM files WHERE collection = ? AND source = ?", key).fetchone()
+            same_run = row is not None and row[0] == pdf_hash
+            attempts = row[1] if same_run else 0
+            if row and not same_run:
+                self._conn.execute("DELETE FROM pages WHERE collection = ? AND source = ?", key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (collection, source, path, pdf_hash, page_count, status, owner, attempts, retry_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'running', ?, ?, NULL, ?)",
+                (collection, source, path, pdf_hash, page_count, self.owner, attempts + 1, now),
+            )
+            rows = self._conn.execute(
+                "SELECT page_num, status, content FROM pages WHERE collection = ? AND source = ?", key
+            ).fetchall()
+        return {page_num: (status, content) for page_num, status, content in rows}
+
+    def record(self, collection: str, source: str, page_num: int, status: str, content: str = None, error: str = None):
+        """Stores the latest state of one page; "failed" also counts towards the page's failures."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO pages (collection, source, page_num, status, content, error, failures, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (collection, source, page_num) DO UPDATE SET status = excluded.status, content = excluded.content, "
+                "error = excluded.error, failures = failures + excluded.failures, updated_at = excluded.updated_at",
+                (collection, source, page_num, status, content, error, int(status == "failed"), time.time()),
+            )
+
+    def finish_file(self, collection: str, source: str, complete: bool):
+        """Closes a run: forgets a completed file, otherwise schedules its next retry or gives up."""
+        key = (collection, source)
+        with self._lock, self._conn:
+            if complete:
+                self._conn.execute("DELETE FROM pages WHERE collection = ? AND source = ?", key)
+                self._conn.execute("DELETE FROM files WHERE collection = ? AND source = ?", key)
+                return
+            row = self._conn.execute("SELECT attempts FROM files WHERE collection = ? AND source = ?", key).fetchone()
+            if row is None:
+                return
+            attempts = row[0]
+            if attempts >= INGEST_MAX_ATTEMPTS:
+                status, retry_at = "failed", None
+            else:
+                status, retry_at = "incomplete", time.time() + INGEST_RETRY_DELAY_SECONDS * 2 ** (attempts - 1)
+            self._conn.execute(
+                "UPDATE files SET status = ?, retry_at = ?, updated_at = ? WHERE collection = ? AND source = ?",
+                (status, retry_at, time.time(), collection, source),
+            )
+        if status == "failed":
+            logger.warning(f"{collection}/{source}: pages still failing after {attempts} attempt(s); re-upload the file to retry.")
+        else:
+            logger.info(f"{collection}/{source}: some pages failed; retrying in {retry_at - time.time():.0f} s (attempt {attempts + 1}).")
+
+    def forget(self, collection: str, source: str):
+        """Drops the checkpoints of a deleted document."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pages WHERE collection = ? AND source = ?", (collection, source))
+            self._conn.execute("DELETE FROM files WHERE collection = ? AND source = ?", (collection, source))
+
+    def _claim(self, condition: str, params: tuple, dead_owners_only: bool = False) -> list:
+        """
+        Marks the matching files as queued by this process and returns their
+        (path, collection) pairs. Files no longer on disk are forgotten. The
+        write transaction makes the claim atomic across processes.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(f"SELECT collection, source, path, owner FROM files WHERE {condition}", params).fetchall()
+            claimed = []
+            for collection, source, path, owner in rows:
+                if dead_owners_only and owner and _owner_alive(owner):
+                    continue
+                if os.path.exists(path):
+                    self._conn.execute(
+                        "UPDATE files SET status = 'queued', owner = ?, updated_at = ? WHERE collection = ? AND source = ?",
+                        (self.owner, time.time(), collection, source),
+                    )
+                    claimed.append((path, collection))
+                else:
+                    self._conn.execute("DELETE FROM pages WHERE collection = ? AND source = ?", (collection, source))
+                    self._conn.execute("DELETE FROM files WHERE collection = ? AND source = ?", (collection, source))
+        return claimed
+
+    def claim_interrupted(self) -> list:
+        """(path, collection) of the files whose run was cut short because the process running them exited."""
+        return self._claim("status IN ('running', 'queued') AND attempts < ?", (INGEST_MAX_ATTEMPTS,), dead_owners_only=True)
+
+    def claim_due_retries(self) -> list:
+        """(path, collection) of the incomplete files whose retry deadline has passed."""
+        return self._claim("status = 'incomplete' AND retry_at <= ?", (time.time(),))
+
+    def release(self, paths: list):
+        """Returns claimed files to the retry schedule when they could not be queued."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE files SET status = 'incomplete', retry_at = ? WHERE path = ? AND status = 'queued'",
+                [(time.time() + RETRY_POLL_SECONDS, path) for path in paths],
+            )
+
+
+class RetryScheduler:
+    """
+    Background thread that resumes files whose ingestion was interrupted (right
+    away on start, then whenever another worker process exits mid-run) and
+    re-ingests incomplete files once their retry deadline passes.
+    """
+
+    def __init__(self, checkpoints: CheckpointLog, submit, poll_seconds: float = RETRY_POLL_SECONDS):
+        # submit(paths, collection) queues one ingestion job
+        self._checkpoints = checkpoints
+        self._submit = submit
+        self._poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest-retry", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll(self):
+        for claim, message in (
+            (self._checkpoints.claim_interrupted, "Resuming ingestion of {} interrupted file(s)."),
+            (self._checkpoints.claim_due_retries, "Retrying ingestion of {} file(s) with failed pages."),
+        ):
+            by_collection = {}
+            for path, collection in claim():
+                by_collection.setdefault(collection, []).append(path)
+            for collection, paths in by_collection.items():
+                try:
+                    self._submit(paths, collection)
+                    logger.info(message.format(len(paths)))
+                except JobQueueFullError:
+                    self._checkpoints.release(paths)
+
+    def _run(self):
+        while True:
+            try:
+                self._poll()
+            except Exception:
+                logger.exception("Ingestion retry scheduler error")
+            if self._stop.wait(self._poll_seconds):
+                break
@@ -0,0 +1,126 @@
+# modules/chunking.py
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+# --- Module-level Configuration ---
+# "page" indexes each fused page as one document, "chunk" indexes overlapping sub-page
+# chunks that point back to their parent page.
+CHUNKING_MODE = os.environ.get("CHUNKING_MODE", "page").lower()
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 1200))  # characters
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", 200))
+# Reranked chunks considered for the context in chunk mode.
+CHUNK_TOP_K = int(os.environ.get("CHUNK_TOP_K", 6))
+# Approximate token budget of the context sent to the LLM in chunk mode.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1500))
+# A parent page replaces its chunks in the context when at least this many of them made the cut.
+PARENT_EXPAND_MIN_CHUNKS = int(os.environ.get("PARENT_EXPAND_MIN_CHUNKS", 2))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id TEXT PRIMARY KEY,
+    collection TEXT,
+    source TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_source ON pages (source);
+"""
+
+_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+def split_page(doc: Document, page_id: str) -> Tuple[List[str], List[Document]]:
+    """Splits a fused page into (chunk IDs, chunk documents) that carry the parent page ID."""
+    ids, chunks = [], []
+    for i, text in enumerate(_splitter.split_text(doc.page_content)):
+        ids.append(f"{page_id}::c{i}")
+        chunks.append(Document(page_content=text, metadata={**doc.metadata, "page_id": page_id, "chunk": i}))
+    return ids, chunks
+
+
+class PageStore:
+    """Persistent full text of the parent pages of indexed chunks, keyed by page ID."""
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        if "collection" not in {row[1] for row in self._conn.execute("PRAGMA table_info(pages)")}:
+            self._conn.execute("ALTER TABLE pages ADD COLUMN collection TEXT")
+        self._lock = threading.Lock()
+
+    def put(self, page_ids: List[str], docs: List[Document]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (id, collection, source, page_number, text) VALUES (?, ?, ?, ?, ?)",
+                [(page_id, doc.metadata.get("collection"), doc.metadata["source"], doc.metadata["page_number"], doc.page_content)
+                 for page_id, doc in zip(page_ids, docs)],
+            )
+
+    def get(self, page_ids: List[str]) -> Dict[str, str]:
+        if not page_ids:
+            return {}
+        placeholders = ",".join("?" * len(page_ids))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id, text FROM pages WHERE id IN ({placeholders})", page_ids).fetchall()
+        return dict(rows)
+
+    def delete(self, page_ids: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM pages WHERE id = ?", [(page_id,) for page_id in page_ids])
+
+    def delete_source(self, collection: str, source: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pages WHERE collection = ? AND source = ?", (collection, source))
+
+
+def assemble_context(ranked_chunks: List[Document], page_store: PageStore, budget: int = CONTEXT_TOKEN_BUDGET) -> List[Document]:
+    """
+    Turns reranked chunks (best first) into the documents sent to the LLM.
+    A page with several strong chunks is expanded back to the full parent page;
+    other chunks are sent alone. Documents are added in rank order until the
+    token budget is spent (the best one is always kept). Each excerpt is
+    labelled with its page number so the `[Source: Page N]` citations survive.
+    """
+    hits_per_page = {}
+    for doc in ranked_chunks:
+        page_id = doc.metadata.get("page_id")
+        if page_id:
+            hits_per_page[page_id] = hits_per_page.get(page_id, 0) + 1
+    expand = [page_id for page_id, hits in hits_per_page.items() if hits >= PARENT_EXPAND_MIN_CHUNKS]
+    parents = page_store.get(expand)
+
+    context, expanded, spent = [], set(), 0
+    for doc in ranked_chunks:
+        page_id = doc.metadata.get("page_id")
+        if page_id in expanded:
+            continue
+        metadata = {k: v for k, v in doc.metadata.items() if k != "chunk"}
+        parent = parents.get(page_id)
+        if parent is not None and (not context or spent + estimate_tokens(parent) <= budget):
+            expanded.add(page_id)
+            content = parent
+        elif page_id:
+            # Parent not expanded, or too large for what is left of the budget
+            content = f"[EXCERPT OF PAGE {doc.metadata.get('page_number')}]:\n{doc.page_content}"
+        else:
+            content = doc.page_content  # whole-page document indexed before chunking was enabled
+        cost = estimate_tokens(content)
+        if context and spent + cost > budget:
+            continue
+        context.append(Document(page_content=content, metadata=metadata))
+        spent += cost
+    return context
@@ -0,0 +1,252 @@
+# modules/enrichment.py
+
+import os
+import time
+import base64
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+import httpx
+from dotenv import load_dotenv
+
+from logger import logger
+
+load_dotenv()
+
+# --- Module-level Configuration ---
+# Base URLs can point at a local stub server to exercise the engine without paid API calls.
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+REPLICATE_BASE_URL = os.environ.get("REPLICATE_BASE_URL", "https://api.replicate.com/v1")
+GROQ_SUMMARY_MODEL = "llama-3.3-70b-versatile"
+REPLICATE_VLM_VERSION = "452b2fa0b66d8acdf40e05a7f0af948f9c6065f6da5af22fce4cead99a26ff3d"  # lucataco/bakllava
+
+# Images up to this size are inlined as data URIs; larger ones go through the Replicate files API.
+INLINE_IMAGE_MAX_BYTES = 256 * 1024
+# Upper bound on output tokens per summary, used to budget the tokens/minute limit.
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", 1024))
+REQUEST_TIMEOUT = float(os.environ.get("ENRICH_REQUEST_TIMEOUT", 120))
+MAX_RETRIES = int(os.environ.get("ENRICH_MAX_RETRIES", 6))
+# Longest wait for a Replicate prediction to finish; it is then canceled and the page retried later.
+PREDICTION_TIMEOUT = float(os.environ.get("REPLICATE_PREDICTION_TIMEOUT", 600))
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ProviderLimits:
+    """Rate and concurrency limits of one upstream provider, read from the environment."""
+
+    def __init__(self, prefix: str, rpm: int, tpm: int, concurrency: int):
+        self.name = prefix.lower()
+        # 0 (or less) disables a bucket, e.g. tokens/minute for Replicate, which bills by time, not tokens
+        self.requests_per_minute = max(int(os.environ.get(f"{prefix}_RPM", rpm)), 0)
+        self.tokens_per_minute = max(int(os.environ.get(f"{prefix}_TPM", tpm)), 0)
+        self.concurrency = int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency))
+        if self.concurrency < 1:
+            raise ValueError(f"{prefix}_CONCURRENCY must be at least 1, got {self.concurrency}")
+
+
+GROQ_LIMITS = ProviderLimits("GROQ", rpm=30, tpm=12000, concurrency=8)
+REPLICATE_LIMITS = ProviderLimits("REPLICATE", rpm=600, tpm=0, concurrency=16)
+
+
+class ProviderError(Exception):
+    """Raised when a provider call fails permanently or runs out of retries."""
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket refilled continuously at `per_minute / 60` tokens per second.
+    Requests larger than the bucket are clamped to its capacity so they can never wait forever.
+    `per_minute` must be positive; callers skip the bucket for unlimited providers.
+    """
+
+    def __init__(self, per_minute: int):
+        if per_minute <= 0:
+            raise ValueError(f"per_minute must be positive, got {per_minute}")
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Empties the bucket for `seconds`, e.g. after the provider answered 429."""
+        self.tokens = -seconds * self.rate
+        self.updated = time.monotonic()
+
+
+def _retry_after_seconds(response: httpx.Response):
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _auth_headers(env_var: str) -> dict:
+    token = os.environ.get(env_var)
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class ProviderClient:
+    """
+    Sends requests to one provider through the shared HTTP connection pool while
+    enforcing its concurrency limit, requests/minute and tokens/minute buckets,
+    and retrying transient failures with jittered exponential backoff.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, limits: ProviderLimits, headers: dict):
+        self.http = http
+        self.limits = limits
+        self.headers = headers
+        self._semaphore = asyncio.Semaphore(limits.concurrency)
+        self._requests = TokenBucket(limits.requests_per_minute) if limits.requests_per_minute else None
+        self._tokens = TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+
+    async def request(self, method: str, url: str, tokens: int = 0, **kwargs) -> httpx.Response:
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        for attempt in range(MAX_RETRIES + 1):
+            if self._requests:
+                await self._requests.acquire()
+            if self._tokens and tokens:
+                await self._tokens.acquire(tokens)
+            try:
+                async with self._semaphore:
+                    response = await self.http.request(method, url, headers=headers, **kwargs)
+            except (httpx.TimeoutException, httpx.NetworkError) as exc:
+                if attempt == MAX_RETRIES:
+                    raise ProviderError(f"{self.limits.name}: {exc!r} after {attempt + 1} attempts") from exc
+                delay = backoff_delay(attempt)
+                logger.warning(f"{self.limits.name}: {exc!r}, retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code < 400:
+                return response
+            if response.status_code not in RETRYABLE_STATUS or attempt == MAX_RETRIES:
+                raise ProviderError(f"{self.limits.name}: HTTP {response.status_code}: {response.text[:500]}")
+
+            delay = _retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            if response.status_code == 429 and self._requests:
+                # Hold back every caller of this provider, not only the one that was rejected
+                self._requests.pause(delay)
+            logger.warning(f"{self.limits.name}: HTTP {response.status_code}, retrying in {delay:.1f} s (attempt {attempt + 1}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+
+class EnrichmentEngine:
+    """
+    Runs all Groq and Replicate enrichment calls on a single asyncio event loop
+    in a background thread. Synchronous callers (the ingestion pipeline threads)
+    use `run` to execute a coroutine on that loop and wait for its result.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="enrichment-loop", daemon=True)
+        self._thread.start()
+        self.run(self._setup())
+
+    async def _setup(self):
+        pool_size = GROQ_LIMITS.concurrency + REPLICATE_LIMITS.concurrency
+        self.http = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self.groq = ProviderClient(self.http, GROQ_LIMITS, _auth_headers("GROQ_API_KEY"))
+        self.replicate = ProviderClient(self.http, REPLICATE_LIMITS, _auth_headers("REPLICATE_API_TOKEN"))
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def summarize(self, prompt: str) -> str:
+        """Generates a chat completion with the summarization model."""
+        body = {
+            "model": GROQ_SUMMARY_MODEL,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0,
+            "max_tokens": SUMMARY_MAX_TOKENS,
+        }
+        tokens = len(prompt) // 4 + SUMMARY_MAX_TOKENS
+        response = await self.groq.request("POST", f"{GROQ_BASE_URL}/chat/completions", tokens=tokens, json=body)
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def _image_input(self, image_bytes: bytes, mime_type: str) -> str:
+        if len(image_bytes) <= INLINE_IMAGE_MAX_BYTES:
+            return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode()}"
+        files = {"content": ("page", image_bytes, mime_type)}
+        response = await self.replicate.request("POST", f"{REPLICATE_BASE_URL}/files", files=files)
+        return response.json()["urls"]["get"]
+
+    async def describe(self, image_bytes: bytes, question: str, mime_type: str = "image/png") -> str:
+        """Runs the VLM on an image and waits for the prediction to finish."""
+        body = {"version": REPLICATE_VLM_VERSION, "input": {"image": await self._image_input(image_bytes, mime_type), "question": question}}
+        response = await self.replicate.request("POST", f"{REPLICATE_BASE_URL}/predictions", json=body, headers={"Prefer": "wait"})
+        prediction = response.json()
+        deadline = time.monotonic() + PREDICTION_TIMEOUT
+        delay = 1.0
+        while prediction["status"] not in ("succeeded", "failed", "canceled"):
+            if time.monotonic() >= deadline:
+                await self._cancel(prediction)
+                raise ProviderError(f"replicate: prediction {prediction.get('id')} still {prediction['status']} after {PREDICTION_TIMEOUT:.0f} s")
+            await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+            delay = min(delay * 1.5, 10.0)
+            response = await self.replicate.request("GET", prediction["urls"]["get"])
+            prediction = response.json()
+        if prediction["status"] != "succeeded":
+            raise ProviderError(f"replicate: prediction {prediction.get('id')} {prediction['status']}: {prediction.get('error')}")
+        output = prediction["output"]
+        return "".join(output) if isinstance(output, list) else str(output)
+
+    async def _cancel(self, prediction: dict):
+        """Best-effort cancellation of a prediction that is no longer awaited, so it stops being billed."""
+        url = prediction.get("urls", {}).get("cancel") or f"{REPLICATE_BASE_URL}/predictions/{prediction.get('id')}/cancel"
+        try:
+            await self.replicate.request("POST", url)
+        except Exception as exc:
+            logger.warning(f"replicate: could not cancel prediction {prediction.get('id')}: {exc}")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> EnrichmentEngine:
+    """Returns the process-wide enrichment engine, starting it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = EnrichmentEngine()
+        return _engine
@@ -0,0 +1,186 @@
+# modules/image_index.py
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from modules.image_store import IMAGE_SAVE_DIR
+from modules.scoping import collection_dir
+
+# --- Module-level Configuration ---
+SERVER_ROOT = Path(__file__).parent.parent
+IMAGE_INDEX_DIR = SERVER_ROOT / "image_index"
+IMAGE_REFS_PATH = IMAGE_INDEX_DIR / "refs.sqlite3"
+os.makedirs(IMAGE_INDEX_DIR, exist_ok=True)
+
+_REFS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (owner TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (owner, name));
+CREATE INDEX IF NOT EXISTS refs_name ON refs (name);
+"""
+
+_cache = {}
+_cache_lock = threading.Lock()
+_refs = None
+_refs_lock = threading.Lock()
+
+
+def _index_path(collection: str, source: str) -> Path:
+    """Sidecar of a document; documents indexed before collections had one directory for all of them."""
+    directory = IMAGE_INDEX_DIR / collection_dir(collection) if collection else IMAGE_INDEX_DIR
+    return directory / f"{os.path.splitext(source)[0]}.json"
+
+
+def _owner(collection: str, source: str) -> str:
+    """Reference owner of a document: its sidecar path relative to IMAGE_INDEX_DIR."""
+    return _index_path(collection, source).relative_to(IMAGE_INDEX_DIR).as_posix()
+
+
+def _entry_names(entry: dict) -> set:
+    """File and thumbnail names used by one page entry; the largest image is one of `images`."""
+    images = [entry["full"]] + entry.get("images", [])
+    return {name for image in images for name in (image["file"], image["thumb"])}
+
+
+class ImageRefs:
+    """
+    Reference counts of the content-hashed image store: which documents use each
+    stored image. An image is deleted together with its last reference, so
+    deleting or re-ingesting a document frees the images only it used while
+    images shared with other documents stay.
+
+    A document claims its images while they are rendered and trims its references
+    to its final index once that is written. Images are deleted inside a write
+    transaction, so a concurrent claim waits for it and then stores the image again.
+    """
+
+    def __init__(self, path: Path = IMAGE_REFS_PATH, index_dir: Path = IMAGE_INDEX_DIR,
+                 image_dir: Path = IMAGE_SAVE_DIR):
+        self._index_dir = Path(index_dir)
+        self._image_dir = Path(image_dir)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_REFS_SCHEMA)
+        self._lock = threading.Lock()
+        self._backfill()
+
+    def _backfill(self):
+        """Registers, once, the sidecars written before images were reference-counted."""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if self._conn.execute("PRAGMA user_version").fetchone()[0]:
+                return
+            for path in self._index_dir.rglob("*.json"):
+                with open(path, encoding="utf-8") as f:
+                    pages = json.load(f)
+                owner = path.relative_to(self._index_dir).as_posix()
+                names = set().union(*map(_entry_names, pages.values()))
+                self._conn.executemany("INSERT OR IGNORE INTO refs (owner, name) VALUES (?, ?)",
+                                       [(owner, name) for name in names])
+            self._conn.execute("PRAGMA user_version = 1")
+
+    def claim(self, owner: str, names):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO refs (owner, name) VALUES (?, ?)",
+                                   [(owner, name) for name in names])
+
+    def keep(self, owner: str, names=()) -> int:
+        """Drops the owner's references outside `names` and deletes the images left without any; returns how many."""
+        names = set(names)
+        deleted = 0
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute("SELECT name FROM refs WHERE owner = ?", (owner,)).fetchall()
+            dropped = [name for (name,) in rows if name not in names]
+            self._conn.executemany("DELETE FROM refs WHERE owner = ? AND name = ?", [(owner, name) for name in dropped])
+            for name in dropped:
+                if self._conn.execute("SELECT 1 FROM refs WHERE name = ? LIMIT 1", (name,)).fetchone():
+                    continue
+                try:
+                    os.remove(self._image_dir / name)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+
+def _image_refs() -> ImageRefs:
+    """Lazily opens the reference counts, so importing this module costs no database work."""
+    global _refs
+    with _refs_lock:
+        if _refs is None:
+            _refs = ImageRefs()
+        return _refs
+
+
+def claim_images(collection: str, source: str, names):
+    """Records that a document being rendered uses the stored images `names`; see `store_pixmap`."""
+    _image_refs().claim(_owner(collection, source), names)
+
+
+def build_page_entry(full_page: dict, images: list) -> dict:
+    """
+    Builds the index entry of one page.
+    `full_page` is the image-store record {"file", "thumb", ...} of the rendered page and
+    `images` holds one dict per extracted sub-image: {"file", "thumb", "area", "bbox", "hash"},
+    where `area` is the image size in pixels. The largest image is resolved here
+    so the query path does not have to compare anything.
+    """
+    full = {"file": full_page["file"], "thumb": full_page["thumb"]}
+    largest = max(images, key=lambda img: img["area"]) if images else None
+    if largest:
+        largest = {"file": largest["file"], "thumb": largest["thumb"]}
+    return {"full": full, "largest": largest, "images": images}
+
+
+def write_index(collection: str, source: str, pages: dict):
+    """Atomically writes the sidecar index {page_number: entry} of a document in a collection."""
+    path = _index_path(collection, source)
+    path.parent.mkdir(exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({str(num): entry for num, entry in pages.items()}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    with _cache_lock:
+        _cache.pop((collection, source), None)
+    # Images a previous version of the document used, and no other document does, go now
+    _image_refs().keep(_owner(collection, source), set().union(*map(_entry_names, pages.values())))
+
+
+def remove_index(collection: str, source: str):
+    """Removes the sidecar of a document and the stored images no other document uses."""
+    with _cache_lock:
+        _cache.pop((collection, source), None)
+    try:
+        os.remove(_index_path(collection, source))
+    except FileNotFoundError:
+        pass
+    _image_refs().keep(_owner(collection, source))
+
+
+def _load(collection: str, source: str) -> dict:
+    """Returns the parsed index of a document, re-reading it only when the sidecar changed."""
+    path = _index_path(collection, source)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    key = (collection, source)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, encoding="utf-8") as f:
+        pages = json.load(f)
+    with _cache_lock:
+        _cache[key] = (mtime, pages)
+    return pages
+
+
+def page_images(collection: str, source: str, page_number: int) -> dict:
+    """
+    Returns the index entry of a page, or None if the page was never indexed.
+    `collection` is None for pages indexed before collections existed.
+    """
+    return _load(collection, source).get(str(page_number))
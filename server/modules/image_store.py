@@ -0,0 +1,93 @@
+# modules/image_store.py
+
+import os
+import hashlib
+import tempfile
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from PIL import Image
+from fastapi.staticfiles import StaticFiles
+
+# --- Module-level Configuration ---
+SERVER_ROOT = Path(__file__).parent.parent
+IMAGE_SAVE_DIR = SERVER_ROOT / "static" / "images"
+# "jpeg" or "webp"; both are far smaller than the PNGs they replace. Pages are encoded on the
+# serial render thread of the ingestion pipeline, and WebP takes ~25x longer than JPEG per page.
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 80))
+# Longest side, in pixels, of the thumbnails shown in the chat UI.
+THUMBNAIL_MAX_SIZE = int(os.environ.get("THUMBNAIL_MAX_SIZE", 640))
+
+IMAGE_EXTENSION = "jpg" if IMAGE_FORMAT == "jpeg" else IMAGE_FORMAT
+IMAGE_MIME_TYPE = f"image/{IMAGE_FORMAT}"
+# Names are content hashes, so a URL's bytes never change and can be cached forever.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+os.makedirs(IMAGE_SAVE_DIR, exist_ok=True)
+
+
+def _to_rgb_image(pixmap) -> Image.Image:
+    """Converts a PyMuPDF pixmap of any colourspace, with or without alpha, to an RGB PIL image."""
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    if pixmap.colorspace is None or pixmap.colorspace.n != 3:
+        pixmap = fitz.Pixmap(fitz.csRGB, pixmap)
+    return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def _save(image: Image.Image, path: Path):
+    # A unique temporary name: two jobs may store the same image at the same time
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, suffix=".tmp", delete=False) as tmp:
+        try:
+            image.save(tmp, format=IMAGE_FORMAT.upper(), quality=IMAGE_QUALITY)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    os.chmod(tmp.name, 0o644)  # temporary files are created owner-only
+    os.replace(tmp.name, path)
+
+
+def store_pixmap(pixmap, claim=None) -> dict:
+    """
+    Stores a rendered page or extracted image once, under the hash of its pixels.
+    Re-storing identical pixels (a logo repeated on every page, an unchanged
+    page of a re-uploaded PDF) only returns the existing names.
+    `claim(names)`, if given, records the caller's reference before the existing
+    copy is checked, so a document deleted meanwhile cannot remove it in between.
+    Returns {"hash", "file", "thumb"} with file names relative to IMAGE_SAVE_DIR.
+    """
+    digest = hashlib.sha256(pixmap.samples)
+    digest.update(f"{pixmap.width}x{pixmap.height}x{pixmap.n}".encode())
+    image_hash = digest.hexdigest()
+    name = f"{image_hash[:32]}.{IMAGE_EXTENSION}"
+    thumb_name = f"{image_hash[:32]}_thumb.{IMAGE_EXTENSION}"
+    if claim:
+        claim([name, thumb_name])
+
+    full_path = IMAGE_SAVE_DIR / name
+    thumb_path = IMAGE_SAVE_DIR / thumb_name
+    if not (full_path.exists() and thumb_path.exists()):
+        image = _to_rgb_image(pixmap)
+        _save(image, full_path)
+        image.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+        _save(image, thumb_path)
+    return {"hash": image_hash, "file": name, "thumb": thumb_name}
+
+
+def image_path(name: str) -> Path:
+    return IMAGE_SAVE_DIR / name
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    StaticFiles that marks every response as immutable. Starlette already sends
+    ETag/Last-Modified and answers If-None-Match with 304; with content-hashed
+    names browsers can additionally skip revalidation altogether.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
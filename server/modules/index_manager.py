@@ -0,0 +1,282 @@
+# modules/index_manager.py
+
+import os
+import fcntl
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import List
+
+from langchain_core.documents import Document
+
+from modules.load_vectorstore import PERSIST_DIR, page_doc_id
+from modules.llm import get_rag_chain
+from modules.lexical_index import LexicalIndex
+from modules.chunking import CHUNKING_MODE, PageStore, split_page
+from modules.ingest_cache import CachedEmbeddings
+from modules.metrics import span
+from modules.scoping import DEFAULT_COLLECTION, scope_filter
+from logger import logger
+
+# "chroma" keeps the vectors in ChromaDB; "mmap" in a memory-mapped int8/float16 matrix
+# (see modules/mmap_store.py) that several worker processes share through the page cache.
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "chroma").lower()
+
+
+def open_vectorstore(embeddings, persist_dir=PERSIST_DIR, backend: str = VECTOR_BACKEND, reload: bool = False):
+    """
+    Opens the persistent vector store of the selected backend.
+    `reload` re-reads a Chroma store that another process has written to.
+    """
+    if backend == "mmap":
+        from modules.mmap_store import MmapVectorStore
+        return MmapVectorStore(Path(persist_dir) / "mmap", embeddings)
+    from langchain_community.vectorstores import Chroma
+    if reload:
+        # Chroma keeps one client per path and process, whose in-memory HNSW index does not see
+        # other processes' writes. Clearing its client cache makes the next client load the
+        # index from disk, while queries still running on the old client can finish.
+        from chromadb.api.client import SharedSystemClient
+        if not hasattr(SharedSystemClient, "clear_system_cache"):
+            raise RuntimeError("This chromadb version has no clear_system_cache(); cannot reload the index "
+                               "after another worker's write. Run a single worker or use VECTOR_BACKEND=mmap.")
+        SharedSystemClient.clear_system_cache()
+    return Chroma(persist_directory=str(persist_dir), embedding_function=embeddings)
+
+
+class SharedIndexVersion:
+    """
+    Index version and write lock shared by every worker process serving the
+    same persist directory. The version is a small file bumped after each
+    committed write; the lock is an flock held for the duration of a write.
+    """
+
+    def __init__(self, persist_dir):
+        Path(persist_dir).mkdir(parents=True, exist_ok=True)
+        self._path = Path(persist_dir) / "index.version"
+        self._lock_path = Path(persist_dir) / "index.lock"
+
+    def read(self) -> int:
+        try:
+            return int(self._path.read_text() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self) -> int:
+        """Increments the version. Call with the lock held."""
+        version = self.read() + 1
+        tmp_path = self._path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(str(version))
+        os.replace(tmp_path, self._path)
+        return version
+
+    @contextmanager
+    def locked(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class IndexManager:
+    """
+    Owns the persistent vector store and the RAG chain built on top of it.
+
+    The store is opened once and then mutated in place: pages are upserted
+    under stable per-page IDs and stale pages are deleted by ID, so the cost
+    of an update is proportional to the pages that changed. The chain reads
+    the live collection, so it is built once and never rebuilt after an
+    upload. Writers are serialized; readers take `snapshot()` without locking.
+    A BM25 lexical index over the same IDs is kept in step with every write.
+
+    Several worker processes may share one persist directory: writes are
+    serialized across processes too, and a worker that finds the shared
+    version moved reopens its view of the vector store before the next
+    query or write.
+    """
+
+    def __init__(self, embeddings, persist_dir=PERSIST_DIR):
+        self._write_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._embeddings = embeddings
+        self._persist_dir = persist_dir
+        self._shared = SharedIndexVersion(persist_dir)
+        self.vectorstore = open_vectorstore(embeddings, persist_dir)
+        self.lexical = LexicalIndex(Path(persist_dir) / "lexical.sqlite3")
+        # Full text of the parent pages, only needed when pages are indexed as chunks
+        self.page_store = PageStore(Path(persist_dir) / "pages.sqlite3") if CHUNKING_MODE == "chunk" else None
+        if self.count() and not (self.lexical.count() and self.lexical.has_scope_fields()):
+            with self._shared.locked():
+                if not self.lexical.count():
+                    self._backfill_lexical()
+                elif not self.lexical.has_scope_fields():
+                    stored = self.vectorstore.get(include=["metadatas"])
+                    self.lexical.set_scope_fields(stored["ids"], stored["metadatas"])
+                    logger.info(f"Added the scope fields of {len(stored['ids'])} page(s) to the lexical index.")
+        # Shared by all workers and bumped after every committed write; lets callers detect index changes cheaply
+        self.version = self._shared.read()
+        self._chain = get_rag_chain(self.vectorstore, self.lexical, self.page_store) if self.count() else None
+
+    def _backfill_lexical(self):
+        """Builds the lexical index of a vector store created before it existed."""
+        stored = self.vectorstore.get(include=["documents", "metadatas"])
+        self.lexical.upsert(stored["ids"], stored["documents"], stored["metadatas"])
+        logger.info(f"Built the lexical index for {len(stored['ids'])} existing page(s).")
+
+    def count(self) -> int:
+        if VECTOR_BACKEND == "mmap":
+            return self.vectorstore.count()
+        return self.vectorstore._collection.count()
+
+    @property
+    def chain(self):
+        """The RAG chain, or None while the index is still empty."""
+        return self._chain
+
+    def snapshot(self, where: dict = None):
+        """
+        Returns a consistent (vectorstore, chain, version) triple for a single query.
+        With `where` (see modules/scoping.py) the chain only retrieves matching pages.
+        """
+        self._sync()
+        with self._refresh_lock:
+            vectorstore, chain, version = self.vectorstore, self._chain, self.version
+        if chain is not None and where:
+            # Cheap to build: the models and the LLM client are shared, only the retriever objects are new
+            chain = get_rag_chain(vectorstore, self.lexical, self.page_store, search_filter=where)
+        return vectorstore, chain, version
+
+    def has_source(self, collection: str, source: str) -> bool:
+        """Whether any page of document `source` is indexed in `collection`."""
+        return bool(self.vectorstore.get(where=scope_filter(collection, [source]), limit=1, include=[])["ids"])
+
+    def _sync(self):
+        """Catches up with writes made by other worker processes since this one last looked."""
+        version = self._shared.read()
+        if version == self.version:
+            return
+        with self._refresh_lock:
+            if version == self.version:
+                return
+            if VECTOR_BACKEND != "mmap":
+                # The memory-mapped store follows other processes' writes by itself
+                self.vectorstore = open_vectorstore(self._embeddings, self._persist_dir, reload=True)
+                self._chain = None
+            if self._chain is None and self.count():
+                self._chain = get_rag_chain(self.vectorstore, self.lexical, self.page_store)
+            self.version = version
+        logger.info(f"Index reloaded at version {version} after a write by another worker.")
+
+    @contextmanager
+    def _writing(self):
+        """Serializes a write across threads and worker processes, on an up-to-date view of the index."""
+        with self._write_lock, self._shared.locked():
+            self._sync()
+            yield
+
+    def _commit(self):
+        """Bumps the shared version and publishes the chain the first time the index gains content."""
+        if self._chain is None and self.count():
+            self._chain = get_rag_chain(self.vectorstore, self.lexical, self.page_store)
+        self.version = self._shared.bump()
+
+    def upsert(self, docs: List[Document]) -> List[str]:
+        """
+        Adds or overwrites pages in place, keyed by their collection, source and
+        page number. In chunk mode each page is stored as overlapping chunks
+        plus its full text in the page store. Returns the page IDs.
+        """
+        if not docs:
+            return []
+        page_ids = [
+            page_doc_id(doc.metadata.setdefault("collection", DEFAULT_COLLECTION), doc.metadata["source"], doc.metadata["page_number"])
+            for doc in docs
+        ]
+        if self.page_store is not None:
+            ids, rows = [], []
+            for page_id, doc in zip(page_ids, docs):
+                chunk_ids, chunks = split_page(doc, page_id)
+                ids.extend(chunk_ids)
+                rows.extend(chunks)
+        else:
+            ids = page_ids
+            rows = [Document(page_content=doc.page_content, metadata={**doc.metadata, "page_id": page_id})
+                    for page_id, doc in zip(page_ids, docs)]
+        if isinstance(self._embeddings, CachedEmbeddings):
+            # Embed before taking the write lock; the store's own embedding call below
+            # is then served from the content-addressed cache
+            self._embeddings.embed_documents([row.page_content for row in rows])
+        with self._writing(), span("ingest", "persist"):
+            self.vectorstore.add_documents(rows, ids=ids)
+            self.lexical.upsert(ids, [row.page_content for row in rows], [row.metadata for row in rows])
+            if self.page_store is not None:
+                self.page_store.put(page_ids, docs)
+            # Drop what an earlier version of these pages left behind: surplus chunks,
+            # or entries written under the other CHUNKING_MODE
+            existing = self.vectorstore.get(where={"page_id": {"$in": page_ids}}, include=[])["ids"]
+            if self.page_store is not None:
+                existing += self.vectorstore.get(ids=page_ids, include=[])["ids"]
+            leftovers = sorted(set(existing) - set(ids))
+            if leftovers:
+                self.vectorstore.delete(ids=leftovers)
+                self.lexical.delete(leftovers)
+            self._commit()
+        return page_ids
+
+    def replace_source(self, collection: str, source: str, docs: List[Document]) -> int:
+        """
+        Replaces every page of `source` in `collection` with `docs`.
+        New pages are written before stale ones are removed, so a concurrent
+        query sees either the old or the new version of each page, never a gap.
+        Returns the number of stale pages deleted.
+        """
+        for doc in docs:
+            doc.metadata["collection"] = collection
+        new_ids = self.upsert(docs)
+        return self.prune_source(collection, source, new_ids)
+
+    def _entries_for_source(self, collection: str, source: str) -> List[tuple]:
+        """(entry ID, page ID) of every page or chunk of `source` in `collection`."""
+        stored = self.vectorstore.get(where=scope_filter(collection, [source]), include=["metadatas"])
+        # Pages indexed before page IDs were stored in the metadata are their own page
+        return [(entry_id, (metadata or {}).get("page_id") or entry_id)
+                for entry_id, metadata in zip(stored["ids"], stored["metadatas"])]
+
+    def _delete_entries(self, entries: List[tuple]):
+        entry_ids = [entry_id for entry_id, _ in entries]
+        self.vectorstore.delete(ids=entry_ids)
+        self.lexical.delete(entry_ids)
+        if self.page_store is not None:
+            self.page_store.delete(sorted({page_id for _, page_id in entries}))
+
+    def prune_source(self, collection: str, source: str, keep_ids: List[str]) -> int:
+        """
+        Deletes the pages of `source` in `collection` that are not in `keep_ids`,
+        i.e. pages left over from a previous, longer version of the document.
+        Returns the number of stale pages deleted.
+        """
+        keep = set(keep_ids)
+        with self._writing():
+            stale = [entry for entry in self._entries_for_source(collection, source) if entry[1] not in keep]
+            if stale:
+                self._delete_entries(stale)
+                self._commit()
+        stale_pages = len({page_id for _, page_id in stale})
+        logger.info(f"Index updated for '{source}' in '{collection}': {len(keep_ids)} page(s) current, "
+                    f"{stale_pages} stale page(s) removed.")
+        return stale_pages
+
+    def delete_source(self, collection: str, source: str) -> int:
+        """Removes every page of a document from one collection. Returns the number of pages deleted."""
+        with self._writing():
+            entries = self._entries_for_source(collection, source)
+            if entries:
+                self._delete_entries(entries)
+                self._commit()
+            if self.page_store is not None:
+                self.page_store.delete_source(collection, source)
+        pages = len({page_id for _, page_id in entries})
+        logger.info(f"Deleted {pages} page(s) of '{source}' from collection '{collection}'.")
+        return pages
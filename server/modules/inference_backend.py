@@ -0,0 +1,170 @@
+# modules/inference_backend.py
+
+import os
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from logger import logger
+
+# --- Module-level Configuration ---
+SERVER_ROOT = Path(__file__).parent.parent
+# "torch" runs the original full-precision models, "onnx" the int8-quantized ONNX Runtime exports.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = Path(os.environ.get("ONNX_MODEL_DIR", SERVER_ROOT / "onnx_models"))
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", 0))  # 0 lets ONNX Runtime pick
+# Overridable so benchmarks can run with small local models; the index must be rebuilt after a change.
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "BAAI/bge-m3")
+RERANKER_MODEL_NAME = os.environ.get("RERANKER_MODEL_NAME", "BAAI/bge-reranker-v2-m3")
+EMBED_MAX_LENGTH = int(os.environ.get("EMBED_MAX_LENGTH", 8192))
+# The ONNX reranker truncates (query, passage) pairs to this many tokens. The torch reranker
+# keeps the model's own limit unless RERANK_MAX_LENGTH is set explicitly.
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH") or 512)
+ONNX_BATCH_SIZE = 16
+
+QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def _export_dir(model_name: str) -> Path:
+    return ONNX_MODEL_DIR / model_name.replace("/", "__")
+
+
+def export_quantized(model_name: str, task: str) -> Path:
+    """
+    Exports a Hugging Face model to ONNX and applies dynamic int8 quantization.
+    `task` is "feature-extraction" or "text-classification". Needs `optimum[onnxruntime]`;
+    only runs once, the result is reused from ONNX_MODEL_DIR afterwards.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    target = _export_dir(model_name)
+    if (target / QUANTIZED_FILE).exists():
+        return target
+
+    started = time.perf_counter()
+    logger.info(f"Exporting {model_name} to ONNX (int8) in {target}. This only happens once.")
+    model_cls = ORTModelForFeatureExtraction if task == "feature-extraction" else ORTModelForSequenceClassification
+    model = model_cls.from_pretrained(model_name, export=True)
+    model.save_pretrained(target)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(target)
+
+    quantizer = ORTQuantizer.from_pretrained(target)
+    # Dynamic quantization needs no calibration data; AVX2 kernels run on any modern x86 CPU
+    config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=target, quantization_config=config)
+    logger.info(f"Exported {model_name} in {time.perf_counter() - started:.0f} s.")
+    return target
+
+
+class _OnnxModel:
+    """A tokenizer plus an ONNX Runtime session over the quantized export of a model."""
+
+    def __init__(self, model_name: str, task: str, max_length: int):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = export_quantized(model_name, task)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(str(model_dir / QUANTIZED_FILE), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+    def run(self, texts, text_pairs=None) -> np.ndarray:
+        encoded = self.tokenizer(
+            texts, text_pairs, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in encoded if name in self.input_names}
+        return self.session.run(None, feeds)[0]
+
+
+def _length_sorted_batches(lengths: List[int], batch_size: int):
+    """Yields index batches grouped by similar input length, so padding stays small."""
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+
+class OnnxEmbeddings(Embeddings):
+    """bge-m3 dense embeddings (CLS pooling, L2-normalized) from the int8 ONNX export."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        self.model = _OnnxModel(model_name, "feature-extraction", EMBED_MAX_LENGTH)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [None] * len(texts)
+        for batch in _length_sorted_batches([len(t) for t in texts], ONNX_BATCH_SIZE):
+            hidden = self.model.run([texts[i] for i in batch])
+            cls = hidden[:, 0]
+            cls = cls / np.linalg.norm(cls, axis=1, keepdims=True)
+            for i, vector in zip(batch, cls):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class OnnxCrossEncoder:
+    """bge-reranker-v2-m3 from the int8 ONNX export, with `CrossEncoder.predict`'s interface and sigmoid scores."""
+
+    def __init__(self, model_name: str = RERANKER_MODEL_NAME):
+        self.model = _OnnxModel(model_name, "text-classification", RERANK_MAX_LENGTH)
+
+    def predict(self, pairs, batch_size: int = ONNX_BATCH_SIZE, **_) -> np.ndarray:
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        # Callers such as BatchingReranker may already sort by length; sorting again is cheap
+        for batch in _length_sorted_batches([len(p[0]) + len(p[1]) for p in pairs], batch_size):
+            logits = self.model.run([pairs[i][0] for i in batch], [pairs[i][1] for i in batch])
+            scores[batch] = 1.0 / (1.0 + np.exp(-logits[:, 0]))
+        return scores
+
+
+def load_embeddings(backend: str = INFERENCE_BACKEND) -> Embeddings:
+    """Loads the bge-m3 embedding model on the selected backend."""
+    if backend == "onnx":
+        return OnnxEmbeddings()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+def load_cross_encoder(backend: str = INFERENCE_BACKEND):
+    """Loads the bge-reranker-v2-m3 model on the selected backend."""
+    if backend == "onnx":
+        return OnnxCrossEncoder()
+    from sentence_transformers import CrossEncoder
+    if os.environ.get("RERANK_MAX_LENGTH"):
+        return CrossEncoder(RERANKER_MODEL_NAME, max_length=RERANK_MAX_LENGTH)
+    return CrossEncoder(RERANKER_MODEL_NAME)
+
+
+def check_parity(texts: List[str], pairs: List[List[str]]) -> dict:
+    """
+    Compares the ONNX backend against PyTorch on the same inputs.
+    Reports the cosine similarity between the two backends' embeddings, the
+    largest absolute reranker score difference and whether both backends rank
+    the pairs in the same order.
+    """
+    torch_emb, onnx_emb = load_embeddings("torch"), load_embeddings("onnx")
+    a = np.array(torch_emb.embed_documents(texts))
+    b = np.array(onnx_emb.embed_documents(texts))
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    cosine = (a * b).sum(axis=1)
+
+    torch_scores = np.asarray(load_cross_encoder("torch").predict(pairs), dtype=np.float32)
+    onnx_scores = np.asarray(load_cross_encoder("onnx").predict(pairs), dtype=np.float32)
+    return {
+        "embedding_cosine_min": float(cosine.min()),
+        "embedding_cosine_mean": float(cosine.mean()),
+        "rerank_max_abs_diff": float(np.abs(torch_scores - onnx_scores).max()),
+        "rerank_same_order": bool((np.argsort(-torch_scores) == np.argsort(-onnx_scores)).all()),
+        "rerank_same_top1": bool(np.argmax(torch_scores) == np.argmax(onnx_scores)),
+    }
@@ -0,0 +1,215 @@
+# modules/ingest_cache.py
+
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from modules.metrics import span
+from modules.scoping import DEFAULT_COLLECTION
+
+# --- Module-level Configuration ---
+SERVER_ROOT = Path(__file__).parent.parent
+CACHE_DIR = SERVER_ROOT / "ingest_cache"
+CACHE_PATH = CACHE_DIR / "cache.sqlite3"
+# Recent query embeddings kept in memory, so a question repeated by a user, an evaluation
+# run or the answer cache's similarity lookup is embedded only once. 0 disables it.
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+
+_DOCUMENTS_TABLE = """
+CREATE TABLE IF NOT EXISTS documents (
+    pdf_hash TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    source TEXT NOT NULL,
+    page_count INTEGER NOT NULL,
+    ingested_at REAL NOT NULL,
+    PRIMARY KEY (pdf_hash, collection, source)
+)"""
+
+_SCHEMA = _DOCUMENTS_TABLE + """;
+CREATE TABLE IF NOT EXISTS ocr (image_hash TEXT PRIMARY KEY, text TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS summaries (text_hash TEXT PRIMARY KEY, summary TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS descriptions (image_hash TEXT PRIMARY KEY, description TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS embeddings (content_hash TEXT PRIMARY KEY, vector BLOB NOT NULL);
+"""
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_file(path, chunk_size: int = 1024 * 1024) -> str:
+    """Hashes a file in chunks so large PDFs are never fully loaded in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestionCache:
+    """
+    Persistent, content-addressed cache for the expensive ingestion steps.
+
+    Documents are keyed by the hash of the PDF file and the collection they
+    were ingested into, OCR text and visual
+    descriptions by the hash of the rendered page image, summaries by the hash
+    of the OCR text and embeddings by the hash of the fused page content. An
+    unchanged page of a revised PDF therefore hits the cache even though the
+    file hash differs.
+    """
+
+    def __init__(self, path: Path = CACHE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate_documents()
+        self._lock = threading.Lock()
+
+    def _migrate_documents(self):
+        """Moves document records written before collections into the default collection."""
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+            if "collection" in columns:
+                return
+            self._conn.execute("ALTER TABLE documents RENAME TO documents_v1")
+            self._conn.execute(_DOCUMENTS_TABLE)
+            self._conn.execute(
+                "INSERT INTO documents (pdf_hash, collection, source, page_count, ingested_at) "
+                "SELECT pdf_hash, ?, source, page_count, ingested_at FROM documents_v1",
+                (DEFAULT_COLLECTION,),
+            )
+            self._conn.execute("DROP TABLE documents_v1")
+
+    def _get(self, query: str, key: str):
+        with self._lock:
+            row = self._conn.execute(query, (key,)).fetchone()
+        return row[0] if row else None
+
+    def _put(self, query: str, params: tuple):
+        with self._lock, self._conn:
+            self._conn.execute(query, params)
+
+    # --- Documents ---
+    def find_document(self, pdf_hash: str, collection: str):
+        """Returns the source names under which this exact PDF was already ingested into `collection`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source FROM documents WHERE pdf_hash = ? AND collection = ?", (pdf_hash, collection)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_ingested(self, pdf_hash: str, collection: str, source: str, page_count: int):
+        self._put(
+            "INSERT OR REPLACE INTO documents (pdf_hash, collection, source, page_count, ingested_at) VALUES (?, ?, ?, ?, ?)",
+            (pdf_hash, collection, source, page_count, time.time()),
+        )
+
+    def forget_source(self, collection: str, source: str):
+        """Drops the ingestion record of a deleted document so it can be uploaded again."""
+        self._put("DELETE FROM documents WHERE collection = ? AND source = ?", (collection, source))
+
+    # --- Per-page artifacts ---
+    def get_ocr(self, image_hash: str):
+        return self._get("SELECT text FROM ocr WHERE image_hash = ?", image_hash)
+
+    def put_ocr(self, image_hash: str, text: str):
+        self._put("INSERT OR REPLACE INTO ocr (image_hash, text) VALUES (?, ?)", (image_hash, text))
+
+    def get_summary(self, text_hash: str):
+        return self._get("SELECT summary FROM summaries WHERE text_hash = ?", text_hash)
+
+    def put_summary(self, text_hash: str, summary: str):
+        self._put("INSERT OR REPLACE INTO summaries (text_hash, summary) VALUES (?, ?)", (text_hash, summary))
+
+    def get_description(self, image_hash: str):
+        return self._get("SELECT description FROM descriptions WHERE image_hash = ?", image_hash)
+
+    def put_description(self, image_hash: str, description: str):
+        self._put("INSERT OR REPLACE INTO descriptions (image_hash, description) VALUES (?, ?)", (image_hash, description))
+
+    def get_embedding(self, content_hash: str):
+        blob = self._get("SELECT vector FROM embeddings WHERE content_hash = ?", content_hash)
+        if blob is None:
+            return None
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def put_embedding(self, content_hash: str, vector: List[float]):
+        self._put(
+            "INSERT OR REPLACE INTO embeddings (content_hash, vector) VALUES (?, ?)",
+            (content_hash, array("f", vector).tobytes()),
+        )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model so that document vectors are looked up in the
+    ingestion cache first and only unseen texts reach the model.
+    Query embeddings are kept in a small in-memory LRU cache instead.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: IngestionCache, namespace: str,
+                 query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def _key(self, text: str) -> str:
+        return sha256_text(f"{self.namespace}\n{text}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = [self.cache.get_embedding(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with span("ingest", "embed"):
+                computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                self.cache.put_embedding(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embeds several questions, the ones not seen recently in a single model pass."""
+        with self._queries_lock:
+            vectors = [self._queries.get(text) for text in texts]
+            for text, vector in zip(texts, vectors):
+                if vector is not None:
+                    self._queries.move_to_end(text)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors
+        with span("query", "embed"):
+            if len(missing) == 1:
+                computed = [self.embeddings.embed_query(missing[0])]
+            else:
+                # bge-m3 uses no query instruction, so a query is embedded exactly like a document
+                computed = self.embeddings.embed_documents(missing)
+        by_text = dict(zip(missing, computed))
+        if self.query_cache_size > 0:
+            with self._queries_lock:
+                self._queries.update(by_text)
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        return [vector if vector is not None else by_text[text] for text, vector in zip(texts, vectors)]
@@ -0,0 +1,244 @@
+# modules/jobs.py
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.ingest_cache import CACHE_DIR
+from logger import logger
+
+# --- Module-level Configuration ---
+# Number of ingestion jobs allowed to run at the same time.
+INGEST_MAX_WORKERS = int(os.environ.get("INGEST_MAX_WORKERS", 2))
+# Jobs accepted beyond the running ones; further uploads are rejected until a slot frees up.
+INGEST_MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", 16))
+# Finished jobs are kept in memory for this many seconds so clients can still read their result.
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+# Job snapshots shared by all worker processes, so any of them can report any job.
+JOB_STORE_PATH = CACHE_DIR / "jobs.sqlite3"
+# Minimum seconds between two snapshot writes of a job while its pages progress.
+JOB_SNAPSHOT_INTERVAL = 1.0
+
+# Per-page stages reported while a file moves through the pipeline, in order.
+PAGE_STAGES = ("ocr", "summary", "vision", "embedded")
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class JobQueueFullError(Exception):
+    """Raised when the ingestion queue cannot accept another job."""
+
+
+class IngestionJob:
+    """
+    Tracks the state of a single ingestion request: an overall status plus
+    per-file and per-page progress. All updates go through `update`, which is
+    safe to call from any worker thread.
+    """
+
+    def __init__(self, file_paths: list):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self.files = {
+            os.path.basename(path): {"status": "queued", "total_pages": None, "pages": {}}
+            for path in file_paths
+        }
+        self.file_paths = list(file_paths)
+        self.saved_at = 0.0
+        self._lock = threading.Lock()
+
+    def _touch(self):
+        self.updated_at = time.time()
+        self.version += 1
+
+    def set_status(self, status: str, error: str = None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self._touch()
+
+    def update(self, filename: str, stage: str, page_num: int = None, total_pages: int = None):
+        """
+        Progress callback handed to the ingestion pipeline.
+        Without `page_num` the stage is a file-level status, otherwise it marks
+        a page stage (one of PAGE_STAGES) as completed.
+        """
+        with self._lock:
+            file_state = self.files.setdefault(filename, {"status": "queued", "total_pages": None, "pages": {}})
+            if total_pages is not None:
+                file_state["total_pages"] = total_pages
+            if page_num is None:
+                file_state["status"] = stage
+            else:
+                done = file_state["pages"].setdefault(page_num, [])
+                if stage not in done:
+                    done.append(stage)
+            self._touch()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            files = {}
+            for name, state in self.files.items():
+                pages = {str(num): list(stages) for num, stages in sorted(state["pages"].items())}
+                files[name] = {
+                    "status": state["status"],
+                    "total_pages": state["total_pages"],
+                    "pages_embedded": sum(1 for stages in state["pages"].values() if "embedded" in stages),
+                    "pages": pages,
+                }
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+                "version": self.version,
+                "files": files,
+            }
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+
+class JobStore:
+    """Latest snapshot of every recent job, in SQLite so that all worker processes share it."""
+
+    def __init__(self, path: Path = JOB_STORE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, updated_at REAL NOT NULL, snapshot TEXT NOT NULL)")
+        self._lock = threading.Lock()
+
+    def save(self, snapshot: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, updated_at, snapshot) VALUES (?, ?, ?)",
+                (snapshot["job_id"], snapshot["updated_at"], json.dumps(snapshot)),
+            )
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT snapshot FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune(self, cutoff: float):
+        """Deletes finished jobs last updated before `cutoff`; jobs still queued or running are kept."""
+        statuses = ",".join("?" * len(TERMINAL_STATUSES))
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE updated_at < ? AND json_extract(snapshot, '$.status') IN ({statuses})",
+                (cutoff, *TERMINAL_STATUSES),
+            )
+
+
+class JobManager:
+    """
+    Runs ingestion jobs on a bounded pool of background threads so that the
+    upload endpoint can return immediately with a job ID.
+    Job progress is mirrored to a JobStore, so with several worker processes
+    a job can be followed through whichever worker answers the request.
+    """
+
+    def __init__(self, max_workers: int = INGEST_MAX_WORKERS, max_pending: int = INGEST_MAX_PENDING,
+                 store: JobStore = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._store = store or JobStore()
+
+    def submit(self, file_paths: list, run, on_complete=None) -> IngestionJob:
+        """
+        Queues `run(file_paths, progress)` and returns the job tracking it.
+        `on_complete` receives the value returned by `run` once it succeeds.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFullError("Too many ingestion jobs are queued. Please retry later.")
+
+        job = IngestionJob(file_paths)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._save(job)
+        future = self._executor.submit(self._run_job, job, run, on_complete)
+        with self._lock:
+            self._futures[job.id] = future
+        logger.info(f"Ingestion job {job.id} queued with {len(file_paths)} file(s).")
+        return job
+
+    def _save(self, job: IngestionJob):
+        job.saved_at = time.monotonic()
+        try:
+            self._store.save(job.to_dict())
+        except sqlite3.Error:
+            logger.exception(f"Could not save the snapshot of job {job.id}")
+
+    def _progress(self, job: IngestionJob):
+        """Progress callback that updates the job and, at most every JOB_SNAPSHOT_INTERVAL, its stored snapshot."""
+
+        def progress(filename: str, stage: str, page_num: int = None, total_pages: int = None):
+            job.update(filename, stage, page_num, total_pages)
+            if time.monotonic() - job.saved_at >= JOB_SNAPSHOT_INTERVAL:
+                self._save(job)
+
+        return progress
+
+    def _run_job(self, job: IngestionJob, run, on_complete):
+        try:
+            job.set_status("running")
+            self._save(job)
+            result = run(job.file_paths, progress=self._progress(job))
+            if on_complete:
+                on_complete(result)
+            job.set_status("done")
+            logger.info(f"Ingestion job {job.id} finished.")
+        except Exception as exc:
+            logger.exception(f"Ingestion job {job.id} failed")
+            job.set_status("failed", error=str(exc))
+        finally:
+            self._save(job)
+            self._slots.release()
+
+    def get(self, job_id: str) -> IngestionJob:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def snapshot(self, job_id: str):
+        """Current state of a job run by this process, else the last state saved by any process; None if unknown."""
+        job = self.get(job_id)
+        return job.to_dict() if job is not None else self._store.get(job_id)
+
+    def _prune(self):
+        """Drops finished jobs older than the retention window."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        stale = [job_id for job_id, job in self._jobs.items() if job.finished and job.updated_at < cutoff]
+        for job_id in stale:
+            del self._jobs[job_id]
+            self._futures.pop(job_id, None)
+        self._store.prune(cutoff)
+
+    def shutdown(self):
+        """
+        Stops accepting work and cancels the jobs that have not started. Those
+        are marked failed, so their stored snapshot does not stay "queued"
+        forever; running jobs finish before the process exits.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            cancelled = [self._jobs[job_id] for job_id, future in self._futures.items() if future.cancelled()]
+        for job in cancelled:
+            job.set_status("failed", error="Interrupted by a server shutdown before it started. Please upload the files again.")
+            self._save(job)
+        if cancelled:
+            logger.info(f"{len(cancelled)} queued ingestion job(s) were cancelled by the shutdown.")
@@ -0,0 +1,198 @@
+# modules/lexical_index.py
+
+import os
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from modules.scoping import SCOPE_FIELDS, where_to_sql
+
+# --- Module-level Configuration ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms found in more than this share of the pages (stop words, boilerplate) are not scored:
+# they barely move BM25 but their posting lists grow with the corpus.
+LEXICAL_MAX_DF_RATIO = float(os.environ.get("LEXICAL_MAX_DF_RATIO", 0.5))
+# Terms with more postings than this are not scored either, bounding the work per query term.
+LEXICAL_MAX_POSTINGS = int(os.environ.get("LEXICAL_MAX_POSTINGS", 20000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id TEXT PRIMARY KEY,
+    length INTEGER NOT NULL,
+    collection TEXT,
+    source TEXT,
+    page_number INTEGER
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+"""
+# PRAGMA user_version of an index whose documents all carry their scope fields
+_SCOPED_VERSION = 1
+
+# Words, plus identifiers that keep their inner separators: "AB-1234", "v2.3", "3/4"
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased tokens of `text`. Compound identifiers are indexed whole and
+    by their parts, so "AB-1234" matches queries for "ab-1234" and for "1234".
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(_WORD_RE.findall(token))
+    return tokens
+
+
+class LexicalIndex:
+    """
+    Persistent BM25 inverted index over the same page documents as the vector
+    store, keyed by the same document IDs. It stores only postings, document
+    frequencies, document lengths and the scope fields of each document
+    (collection, source, page number) as indexed columns, so scoped searches
+    filter in SQL; the page text itself is read back from the vector store.
+    Writes are incremental: re-indexing a document replaces its postings.
+    Several worker processes may share the file.
+    """
+
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(docs)")}
+            for field in SCOPE_FIELDS:
+                if field not in columns:
+                    self._conn.execute(f"ALTER TABLE docs ADD COLUMN {field} {'INTEGER' if field == 'page_number' else 'TEXT'}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS docs_scope ON docs (collection, source, page_number)")
+            if not self._conn.execute("SELECT 1 FROM docs LIMIT 1").fetchone():
+                self._conn.execute(f"PRAGMA user_version = {_SCOPED_VERSION}")
+            if (self._conn.execute("SELECT 1 FROM postings LIMIT 1").fetchone()
+                    and not self._conn.execute("SELECT 1 FROM terms LIMIT 1").fetchone()):
+                # Index written before document frequencies were stored
+                self._conn.execute("INSERT OR IGNORE INTO terms (term, df) SELECT term, COUNT(*) FROM postings GROUP BY term")
+        self._lock = threading.Lock()
+        self._stats = None  # cached (document count, average length)
+        self._data_version = None  # SQLite's change counter when _stats was computed
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def has_scope_fields(self) -> bool:
+        """False for an index written before the scope fields were stored; see `set_scope_fields`."""
+        with self._lock:
+            return self._conn.execute("PRAGMA user_version").fetchone()[0] >= _SCOPED_VERSION
+
+    def set_scope_fields(self, ids: List[str], metadatas: List[dict]):
+        """Fills in the scope fields of existing documents from their vector store metadata."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE docs SET collection = ?, source = ?, page_number = ? WHERE id = ?",
+                [(*((metadata or {}).get(field) for field in SCOPE_FIELDS), doc_id) for doc_id, metadata in zip(ids, metadatas)],
+            )
+            self._conn.execute(f"PRAGMA user_version = {_SCOPED_VERSION}")
+
+    def upsert(self, ids: List[str], texts: List[str], metadatas: List[dict]):
+        with self._lock, self._conn:
+            self._delete(ids)
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                counts = Counter(tokenize(text))
+                self._conn.execute(
+                    "INSERT INTO docs (id, length, collection, source, page_number) VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, sum(counts.values()), *((metadata or {}).get(field) for field in SCOPE_FIELDS)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT (term) DO UPDATE SET df = df + 1",
+                    [(term,) for term in counts],
+                )
+            self._stats = None
+
+    def delete(self, ids: List[str]):
+        with self._lock, self._conn:
+            self._delete(ids)
+            self._stats = None
+
+    def _delete(self, ids: List[str]):
+        rows = [(doc_id,) for doc_id in ids]
+        self._conn.executemany("UPDATE terms SET df = df - 1 WHERE term IN (SELECT term FROM postings WHERE doc_id = ?)", rows)
+        self._conn.executemany("DELETE FROM postings WHERE doc_id = ?", rows)
+        self._conn.executemany("DELETE FROM docs WHERE id = ?", rows)
+
+    @staticmethod
+    def _column(key: str) -> str:
+        if key not in SCOPE_FIELDS:
+            raise ValueError(f"The lexical index cannot filter on {key!r}")
+        return f"d.{key}"
+
+    def _corpus_stats(self) -> tuple:
+        """
+        (document count, average length), recomputed after a write by this
+        connection or, as SQLite's data_version shows, by another worker.
+        Call with the lock held.
+        """
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._stats is None or version != self._data_version:
+            n_docs, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            self._stats = (n_docs, avg_length or 1.0)
+            self._data_version = version
+        return self._stats
+
+    def search(self, query: str, k: int, where: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """
+        Returns the `k` best (doc_id, BM25 score) pairs for `query`, only among
+        the documents matching `where` (a scope filter on SCOPE_FIELDS, see
+        modules/scoping.py) when given. Term statistics stay corpus-wide.
+        Terms too common to matter (see LEXICAL_MAX_DF_RATIO) are ignored.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms or k <= 0:
+            return []
+        scope_sql, scope_params = "", []
+        if where:
+            sql, scope_params = where_to_sql(where, self._column)
+            scope_sql = f" AND {sql}"
+        scores = Counter()
+        with self._lock:
+            n_docs, avg_length = self._corpus_stats()
+            if not n_docs:
+                return []
+            max_df = min(max(LEXICAL_MAX_DF_RATIO * n_docs, 1), LEXICAL_MAX_POSTINGS)
+            dfs = self._conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(terms))})", terms
+            ).fetchall()
+            scored = [(term, df) for term, df in dfs if 0 < df <= max_df]
+            if not scored:
+                return []
+            for term, df in scored:
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                # Postings outside the scope are filtered in SQL and never read back
+                rows = self._conn.execute(
+                    f"SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id WHERE p.term = ?{scope_sql}",
+                    (term, *scope_params),
+                ).fetchall()
+                for doc_id, tf, length in rows:
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[doc_id] += idf * tf * (BM25_K1 + 1) / norm
+        return scores.most_common(k)
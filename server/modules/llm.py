@@ -2,18 +2,113 @@
 
 import os
 from dotenv import load_dotenv
-from typing import List
+from functools import lru_cache
+import time
+from typing import List, Any, Optional
+from pydantic import Field
 
 from langchain_groq import ChatGroq
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from sentence_transformers import CrossEncoder
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForRetrieverRun
+
+from modules.models import registry
+from modules.chunking import assemble_context, CHUNK_TOP_K
+from modules.metrics import span, observe_stage, STAGE_ERRORS
+from logger import logger
 
 load_dotenv()
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+# Same override as the enrichment engine, e.g. to answer from benchmarks/stub_providers.py. It
+# includes the /openai/v1 root (see modules/enrichment.py), which the groq SDK appends itself.
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL")
+GROQ_HOST_URL = GROQ_BASE_URL.rstrip("/").removesuffix("/openai/v1") if GROQ_BASE_URL else None
+
+# Hybrid first stage: dense and BM25 candidates merged by reciprocal rank fusion.
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "true").lower() == "true"
+DENSE_K = int(os.environ.get("DENSE_K", 10))
+LEXICAL_K = int(os.environ.get("LEXICAL_K", 10))
+RRF_K = 60
+# Candidates handed to the reranker; the CrossEncoder cost scales with this, not with DENSE_K + LEXICAL_K.
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", 10))
+
+def _doc_key(doc: Document) -> tuple:
+    return doc.metadata.get("source"), doc.metadata.get("page_number"), doc.metadata.get("chunk")
+
+def embed_queries(embeddings, queries: List[str]) -> List[List[float]]:
+    """Embeds several queries in one pass when the embeddings support it (see CachedEmbeddings)."""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(queries)
+    return [embeddings.embed_query(query) for query in queries]
+
+def search_by_vectors(vectorstore, vectors: List[List[float]], k: int, search_filter: dict = None) -> List[List[Document]]:
+    """Dense search for several query vectors in a single call to the vector store."""
+    if hasattr(vectorstore, "similarity_search_by_vectors"):
+        return vectorstore.similarity_search_by_vectors(vectors, k=k, filter=search_filter)
+    # Chroma answers a list of query embeddings in one collection query
+    found = vectorstore._collection.query(query_embeddings=vectors, n_results=k, where=search_filter,
+                                          include=["documents", "metadatas"])
+    return [
+        [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+        for texts, metadatas in zip(found["documents"], found["metadatas"])
+    ]
+
+class HybridRetriever(BaseRetriever):
+    """
+    First-stage retriever that merges dense vector search with the BM25
+    lexical index using reciprocal rank fusion. Lexical hits recover exact
+    part numbers, acronyms and identifiers that embeddings blur, without
+    raising the number of candidates the reranker has to score.
+    `search_filter` (see modules/scoping.py) is applied inside both searches,
+    so every candidate comes from the scoped subset.
+    """
+    vectorstore: Any
+    lexical_index: Any
+    dense_k: int = DENSE_K
+    lexical_k: int = LEXICAL_K
+    top_k: int = RERANK_CANDIDATES
+    search_filter: Optional[dict] = None
+
+    def _lexical_documents(self, query: str) -> List[Document]:
+        hits = self.lexical_index.search(query, self.lexical_k, where=self.search_filter)
+        if not hits:
+            return []
+        ids = [doc_id for doc_id, _ in hits]
+        found = self.vectorstore.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            doc_id: Document(page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(found["ids"], found["documents"], found["metadatas"])
+        }
+        return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Embedded separately so the embedding and the search are timed as distinct stages
+        query_vector = self.vectorstore.embeddings.embed_query(query)
+        with span("query", "vector_search"):
+            dense = self.vectorstore.similarity_search_by_vector(query_vector, k=self.dense_k, filter=self.search_filter)
+        with span("query", "lexical_search"):
+            lexical = self._lexical_documents(query)
+        return self._fuse(dense, lexical)
+
+    def retrieve_batch(self, queries: List[str], query_vectors: List[List[float]]) -> List[List[Document]]:
+        """Fused candidates for several already-embedded queries, with one batched vector search."""
+        with span("query", "vector_search"):
+            dense = search_by_vectors(self.vectorstore, query_vectors, self.dense_k, self.search_filter)
+        with span("query", "lexical_search"):
+            lexical = [self._lexical_documents(query) for query in queries]
+        return [self._fuse(d, l) for d, l in zip(dense, lexical)]
+
+    def _fuse(self, dense: List[Document], lexical: List[Document]) -> List[Document]:
+        fused, docs = {}, {}
+        for ranking in (dense, lexical):
+            for rank, doc in enumerate(ranking):
+                key = _doc_key(doc)
+                docs.setdefault(key, doc)
+                fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:self.top_k]
+        return [docs[key] for key in best]
 
 class RerankingRetriever(BaseRetriever):
     """
@@ -22,8 +117,13 @@ class RerankingRetriever(BaseRetriever):
     them for maximum relevance (precision).
     """
     vectorstore_retriever: BaseRetriever
-    reranker: CrossEncoder = CrossEncoder('BAAI/bge-reranker-v2-m3')
+    # Shared micro-batching engine, so concurrent queries are scored in one forward pass.
+    # Resolved through the model registry on the first query, not when the chain is built.
+    reranker: Any = Field(default_factory=lambda: registry.lazy("reranker"))
     top_k: int = 3  # Final number of documents to pass to the LLM
+    # Set in chunk mode: the best `top_k` chunks are assembled into a token-budgeted
+    # context, expanding strong pages back to their full parent text
+    page_store: Any = None
 
     def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
         # Stage 1: Broad-phase retrieval
@@ -33,29 +133,51 @@ class RerankingRetriever(BaseRetriever):
         
         # Stage 2: Re-ranking for precision
         pairs = [[query, doc.page_content] for doc in initial_docs]
-        scores = self.reranker.predict(pairs)
-        
+        with span("query", "rerank"):
+            scores = self.reranker.predict(pairs)
+        return self._select(initial_docs, scores)
+
+    def retrieve_batch(self, queries: List[str]) -> List[List[Document]]:
+        """
+        Batch counterpart of `invoke`: embeds all queries in one pass, runs their
+        vector searches together and scores every (query, candidate) pair in a
+        single reranker call. Returns the final documents of each query, in order.
+        """
+        first_stage = self.vectorstore_retriever
+        query_vectors = embed_queries(first_stage.vectorstore.embeddings, queries)
+        if isinstance(first_stage, HybridRetriever):
+            candidates = first_stage.retrieve_batch(queries, query_vectors)
+        else:
+            search_kwargs = first_stage.search_kwargs
+            with span("query", "vector_search"):
+                candidates = search_by_vectors(first_stage.vectorstore, query_vectors,
+                                               search_kwargs.get("k", RERANK_CANDIDATES), search_kwargs.get("filter"))
+
+        pairs = [[query, doc.page_content] for query, docs in zip(queries, candidates) for doc in docs]
+        scores = []
+        if pairs:
+            with span("query", "rerank"):
+                scores = self.reranker.predict(pairs)
+        results, offset = [], 0
+        for docs in candidates:
+            results.append(self._select(docs, scores[offset:offset + len(docs)]) if docs else [])
+            offset += len(docs)
+        return results
+
+    def _select(self, initial_docs: List[Document], scores) -> List[Document]:
+        """Keeps the `top_k` best-scored candidates (assembled into a context in chunk mode)."""
         reranked_docs = sorted(zip(scores, initial_docs), key=lambda x: x[0], reverse=True)
         final_docs = [doc for score, doc in reranked_docs[:self.top_k]]
+        if self.page_store is not None:
+            final_docs = assemble_context(final_docs, self.page_store)
         
         if reranked_docs:
-            print(f"Retriever: Best doc (page {reranked_docs[0][1].metadata.get('page_number')}, score {reranked_docs[0][0]:.2f})")
+            logger.debug(f"Retriever: Best doc (page {reranked_docs[0][1].metadata.get('page_number')}, score {reranked_docs[0][0]:.2f})")
         
         return final_docs
 
-def get_rag_chain(vectorstore):
-    """
-    Constructs the high-quality RAG chain.
-    """
-    # Use the most powerful model for final answer generation
-    llm = ChatGroq(groq_api_key=GROQ_API_KEY, model_name="llama-3.3-70b-versatile", temperature=0)
-    
-    # The retriever fetches a larger number of candidates for the reranker to process
-    base_retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-    reranking_retriever = RerankingRetriever(vectorstore_retriever=base_retriever)
-
-    # This prompt template is the "brain" of the chatbot, instructing it on how to behave.
-    template = """
+# This prompt template is the "brain" of the chatbot, instructing it on how to behave.
+QA_TEMPLATE = """
     You are a world-class document analysis expert. Your task is to provide a detailed and precise answer to the user's question based ONLY on the following context.
     The context consists of fused textual and visual summaries from document pages. Synthesize all information for a complete answer.
     If the question is about a diagram, focus on the visual description part of the context.
@@ -70,7 +192,56 @@ def get_rag_chain(vectorstore):
 
     EXPERT ANSWER:
     """
-    QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
+QA_CHAIN_PROMPT = PromptTemplate.from_template(QA_TEMPLATE)
+
+class LLMTimingHandler(BaseCallbackHandler):
+    """Records every answer-generation call, streamed or not, as the "llm" query stage."""
+
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            observe_stage("query", "llm", time.perf_counter() - started)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if self._started.pop(run_id, None) is not None:
+            STAGE_ERRORS.inc(pipeline="query", stage="llm")
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """The answer-generation model, shared by the RAG chain and the streaming endpoint."""
+    # Use the most powerful model for final answer generation
+    return ChatGroq(groq_api_key=GROQ_API_KEY, base_url=GROQ_HOST_URL, model_name="llama-3.3-70b-versatile", temperature=0,
+                    callbacks=[LLMTimingHandler()])
+
+def format_context(docs: List[Document]) -> str:
+    """Joins the retrieved pages the same way the "stuff" chain does."""
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def get_rag_chain(vectorstore, lexical_index=None, page_store=None, search_filter=None):
+    """
+    Constructs the high-quality RAG chain.
+    `search_filter` restricts retrieval to matching pages (see modules/scoping.py).
+    """
+    llm = get_llm()
+    
+    # The retriever fetches a larger number of candidates for the reranker to process
+    if HYBRID_RETRIEVAL and lexical_index is not None:
+        base_retriever = HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index, search_filter=search_filter)
+    else:
+        search_kwargs = {"k": RERANK_CANDIDATES}
+        if search_filter:
+            search_kwargs["filter"] = search_filter
+        base_retriever = vectorstore.as_retriever(search_kwargs=search_kwargs)
+    if page_store is not None:
+        reranking_retriever = RerankingRetriever(vectorstore_retriever=base_retriever, page_store=page_store, top_k=CHUNK_TOP_K)
+    else:
+        reranking_retriever = RerankingRetriever(vectorstore_retriever=base_retriever)
 
     return RetrievalQA.from_chain_type(
         llm=llm,
@@ -78,4 +249,4 @@ def get_rag_chain(vectorstore):
         retriever=reranking_retriever,
         return_source_documents=True,
         chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
-    )
\ No newline at end of file
+    )
@@ -2,135 +2,453 @@
 
 import os
 import time
+import asyncio
+import threading
+import multiprocessing
+from functools import partial
 from pathlib import Path
 from dotenv import load_dotenv
 import fitz  # PyMuPDF
-import replicate
-from unstructured.partition.pdf import partition_pdf
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.documents import Document
-from langchain_groq import ChatGroq
+
+from modules.inference_backend import INFERENCE_BACKEND, EMBEDDING_MODEL_NAME
+from modules.models import registry
+from modules.ingest_cache import IngestionCache, CachedEmbeddings, sha256_text
+from modules.uploads import copy_upload, uploaded_file_hash
+from modules.ocr_worker import partition_pages
+from modules.enrichment import get_engine
+from modules.image_index import build_page_entry, claim_images, write_index as write_image_index
+from modules.image_store import store_pixmap, image_path, IMAGE_MIME_TYPE
+from modules.pipeline import Stage
+from modules.metrics import span, observe_stage, PAGES
+from modules.checkpoints import CheckpointLog, DONE_PAGE_STATES
+from modules.scoping import DEFAULT_COLLECTION
+from logger import logger
 
 load_dotenv()
 
 # --- Module-level Configuration ---
 SERVER_ROOT = Path(__file__).parent.parent
 PERSIST_DIR = SERVER_ROOT / "chroma_store"
-UPLOAD_DIR = SERVER_ROOT / "uploaded_pdfs"
-IMAGE_SAVE_DIR = SERVER_ROOT / "static" / "images"
 
-# Ensure necessary directories exist on module load
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(IMAGE_SAVE_DIR, exist_ok=True)
+# Text extraction mode: "auto" reads born-digital pages from the PDF text layer and only
+# sends scanned pages to hi_res OCR, "hi_res" OCRs every page, "fast" never runs OCR.
+EXTRACTION_MODE = os.environ.get("EXTRACTION_MODE", "auto")
+# A page qualifies for the fast path when its text layer has at least this many characters...
+FAST_PATH_MIN_CHARS = int(os.environ.get("FAST_PATH_MIN_CHARS", 200))
+# ...and images cover no more than this fraction of its area.
+FAST_PATH_MAX_IMAGE_COVERAGE = float(os.environ.get("FAST_PATH_MAX_IMAGE_COVERAGE", 0.5))
+# Worker processes for hi_res OCR and the number of pages each OCR task handles.
+OCR_PROCESSES = int(os.environ.get("OCR_PROCESSES", os.cpu_count() or 1))
+OCR_PAGES_PER_TASK = int(os.environ.get("OCR_PAGES_PER_TASK", 4))
+# Pipeline threads waiting on enrichment; the calls themselves are throttled per provider
+# by the asyncio enrichment engine (see modules/enrichment.py).
+ENRICH_MAX_WORKERS = int(os.environ.get("ENRICH_MAX_WORKERS", 22))
+# Capacity of each queue between pipeline stages; bounds the pages held in memory.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 32))
+# Maximum number of enriched pages embedded and upserted together.
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 16))
 
-# --- Singleton AI Models (loaded once for efficiency) ---
+# --- Shared AI Models (loaded once, on first use or during warm-up) ---
 # State-of-the-art multilingual embedding model for maximum retrieval precision.
-embeddings = HuggingFaceEmbeddings(model_name="BAAI/bge-m3")
-# Powerful LLM for high-quality text summarization during ingestion.
-groq_llm = ChatGroq(groq_api_key=os.environ.get("GROQ_API_KEY"), model_name="llama-3.3-70b-versatile", temperature=0)
+# Runs on PyTorch or on the int8 ONNX export depending on INFERENCE_BACKEND; the
+# registry hands ingestion and querying the same instance.
+embeddings = registry.lazy("embeddings")
+# Content-addressed cache so unchanged pages never hit the OCR engine or the paid APIs twice.
+ingest_cache = IngestionCache()
+cached_embeddings = CachedEmbeddings(embeddings, ingest_cache, namespace=f"{EMBEDDING_MODEL_NAME}:{INFERENCE_BACKEND}")
+# Per-page progress of unfinished files, so a restart or an API outage does not redo finished pages.
+checkpoints = CheckpointLog()
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+
+def page_doc_id(collection: str, source: str, page_num: int) -> str:
+    """
+    Stable vector store ID for a page, so re-ingesting a document overwrites
+    instead of duplicating. The collection is part of it, so a file uploaded
+    to two collections is stored twice instead of moving between them.
+    """
+    return f"{collection}::{source}::p{page_num}"
 
 
-def summarize_text(content: str, filename: str, page_num: int) -> str:
+async def summarize_text(content: str, filename: str, page_num: int) -> str:
     """
     Uses a powerful LLM to clean and summarize raw OCR text into a coherent paragraph.
     This creates a high-quality textual representation for each page.
+    Raises on failure so the caller can fall back without caching the fallback.
     """
-    print(f"Summarizing text for {filename}, page {page_num}...")
+    logger.debug(f"Summarizing text for {filename}, page {page_num}...")
     prompt = f"Summarize the following OCR text from page {page_num} of '{filename}' into a concise, information-dense paragraph. Correct obvious OCR errors. Text: ```{content}```"
-    try:
-        return groq_llm.invoke(prompt).content
-    except Exception as e:
-        print(f"Error summarizing page {page_num}: {e}")
-        return content  # Return raw text as a fallback
+    return await get_engine().summarize(prompt)
 
-def describe_image(image_path: str, filename: str, page_num: int) -> str:
+async def describe_image(image_bytes: bytes, filename: str, page_num: int) -> str:
     """
     Uses a VLM via Replicate API to generate a detailed visual description of a page image.
-    Includes a retry mechanism to handle API timeouts and instability.
+    Rate limiting and retries with backoff are handled by the enrichment engine.
     """
-    print(f"Describing visuals for {filename}, page {page_num}...")
-    max_retries = 3
-    for attempt in range(max_retries):
+    logger.debug(f"Describing visuals for {filename}, page {page_num}...")
+    question = f"This is page {page_num} of the document '{filename}'. Describe it in extreme detail. If it is a technical diagram or architecture flowchart, you MUST transcribe all text from every node and explain what each component does and how they are connected. Be structured and exhaustive."
+    return await get_engine().describe(image_bytes, question, mime_type=IMAGE_MIME_TYPE)
+
+def _no_progress(filename: str, stage: str, page_num: int = None, total_pages: int = None):
+    """Default progress callback used when ingestion runs outside of a job."""
+
+async def _enrich_page(content: str, filename: str, page_num: int, image_bytes: bytes, progress) -> tuple:
+    """
+    Runs the summary and the visual description of a page concurrently on the engine's event loop.
+    A None input skips that half. Each half returns (result, succeeded), or None when skipped.
+    """
+
+    async def text_task():
         try:
-            with open(image_path, "rb") as image_file:
-                model_version = "lucataco/bakllava:452b2fa0b66d8acdf40e05a7f0af948f9c6065f6da5af22fce4cead99a26ff3d"
-                question = f"This is page {page_num} of the document '{filename}'. Describe it in extreme detail. If it is a technical diagram or architecture flowchart, you MUST transcribe all text from every node and explain what each component does and how they are connected. Be structured and exhaustive."
-                output = replicate.run(model_version, input={"image": image_file, "question": question})
-                return output
+            with span("ingest", "summarize"):
+                summary = await summarize_text(content, filename, page_num)
+            ok = True
         except Exception as e:
-            if "timed out" in str(e).lower() and attempt < max_retries - 1:
-                print(f"Attempt {attempt + 1} failed for page {page_num}: Timeout. Retrying in 5 seconds...")
-                time.sleep(5)
-            else:
-                print(f"Error describing page {page_num} after {max_retries} attempts: {e}")
-                return "No visual description could be generated."
+            logger.warning(f"Error summarizing {filename} page {page_num}: {e}")
+            summary, ok = content, False  # Return raw text as a fallback
+        progress(filename, "summary", page_num)
+        return summary, ok
 
-def process_page_hybrid(page_data: tuple) -> Document:
+    async def visual_task():
+        try:
+            with span("ingest", "describe"):
+                description = await describe_image(image_bytes, filename, page_num)
+            ok = True
+        except Exception as e:
+            logger.warning(f"Error describing {filename} page {page_num}: {e}")
+            description, ok = "No visual description could be generated.", False
+        progress(filename, "vision", page_num)
+        return description, ok
+
+    async def skipped():
+        return None
+
+    return tuple(await asyncio.gather(
+        text_task() if content is not None else skipped(),
+        visual_task() if image_bytes is not None else skipped(),
+    ))
+
+def process_page_hybrid(page_data: tuple, progress=_no_progress) -> tuple:
     """
     Processes a single page by generating both textual and visual summaries in parallel.
     Fuses them into a single rich context for the vector store.
+    Cached summaries and descriptions are reused; only successful results are cached.
+    Returns (document, complete); `complete` is False when a fallback replaced a failed half.
     """
-    content, filename, page_num, image_path = page_data
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        future_text = executor.submit(summarize_text, content, filename, page_num)
-        future_visual = executor.submit(describe_image, str(image_path), filename, page_num)
-        text_summary = future_text.result()
-        visual_summary = future_visual.result()
+    content, filename, page_num, image_name, image_hash = page_data
+    text_hash = sha256_text(content)
+    text_summary = ingest_cache.get_summary(text_hash)
+    visual_summary = ingest_cache.get_description(image_hash) if image_hash else None
+    if text_summary is not None:
+        progress(filename, "summary", page_num)
+    if visual_summary is not None:
+        progress(filename, "vision", page_num)
+
+    complete = True
+    if text_summary is None or visual_summary is None:
+        image_bytes = image_path(image_name).read_bytes() if visual_summary is None else None
+        text_result, visual_result = get_engine().run(_enrich_page(
+            content if text_summary is None else None, filename, page_num, image_bytes, progress
+        ))
+        if text_result is not None:
+            text_summary, ok = text_result
+            complete = complete and ok
+            if ok:
+                ingest_cache.put_summary(text_hash, text_summary)
+        if visual_result is not None:
+            visual_summary, ok = visual_result
+            complete = complete and ok
+            if ok and image_hash:
+                ingest_cache.put_description(image_hash, visual_summary)
 
     fused_content = f"[TEXTUAL SUMMARY OF PAGE {page_num}]:\n{text_summary}\n\n[VISUAL DESCRIPTION OF PAGE {page_num}]:\n{visual_summary}"
-    return Document(page_content=fused_content, metadata={"source": filename, "page_number": page_num})
+    return Document(page_content=fused_content, metadata={"source": filename, "page_number": page_num}), complete
+
+def save_uploaded_files(uploaded_files: list, collection: str = DEFAULT_COLLECTION) -> list:
+    """
+    Persists uploaded files to UPLOAD_DIR so they outlive the HTTP request
+    and can be ingested by a background job. Files are copied in chunks and
+    validated on the way (see modules/uploads.py).
+    """
+    return [copy_upload(f.file, f.filename, collection) for f in uploaded_files]
+
+def classify_page(page) -> tuple:
+    """
+    Decides whether a page can be read from its embedded text layer.
+    Returns ("text", extracted_text) for born-digital pages and ("scanned", None)
+    for pages that need OCR, based on text-layer density and image coverage.
+    """
+    if EXTRACTION_MODE == "hi_res":
+        return "scanned", None
+    text = page.get_text("text", sort=True).strip()
+    if EXTRACTION_MODE == "fast":
+        return "text", text
+
+    page_area = abs(page.rect) or 1.0
+    image_area = 0.0
+    for info in page.get_image_info():
+        image_area += abs(fitz.Rect(info["bbox"]) & page.rect)
+    coverage = min(image_area / page_area, 1.0)
+
+    if len(text) >= FAST_PATH_MIN_CHARS and coverage <= FAST_PATH_MAX_IMAGE_COVERAGE:
+        return "text", text
+    return "scanned", None
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    """Lazily creates the process pool shared by all ingestion jobs for CPU-bound OCR."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            # "spawn" keeps worker processes free of the parent's threads and loaded models
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _ocr_pool
+
+def _extract_page_images(pdf_doc, page, claim=None) -> list:
+    """
+    Stores the colour sub-images of a page in the image store and returns their
+    image-index entries (file and thumbnail names, pixel area, bounding box on
+    the page and content hash). Images shared by several pages are stored once.
+    `claim` is passed on to `store_pixmap`.
+    """
+    entries = []
+    seen_xrefs = set()
+    for img in page.get_images(full=True):
+        xref = img[0]
+        if xref and xref not in seen_xrefs:
+            seen_xrefs.add(xref)
+            img_pix = fitz.Pixmap(pdf_doc, xref)
+            if img_pix.n - img_pix.alpha >= 3:
+                stored = store_pixmap(img_pix, claim)
+                rects = page.get_image_rects(xref)
+                entries.append({
+                    "file": stored["file"],
+                    "thumb": stored["thumb"],
+                    "area": img_pix.width * img_pix.height,
+                    "bbox": [round(v, 1) for v in rects[0]] if rects else None,
+                    "hash": stored["hash"],
+                })
+    return entries
+
+class _FileState:
+    """Book-keeping for one PDF while its pages are in flight; shared by all pipeline stages."""
+
+    def __init__(self, path: Path, pdf_hash: str, page_count: int, collection: str):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.pdf_hash = pdf_hash
+        self.page_count = page_count
+        self.collection = collection
+        self.page_images = {}
+        self.page_ids = []
+        self.remaining = page_count
+        self.has_failures = False
+        self._lock = threading.Lock()
 
-def load_vectorstore(uploaded_files: list):
+    def page_finished(self, page_id: str = None, failed: bool = False) -> bool:
+        """Records the outcome of one page. Returns True when it was the file's last page."""
+        with self._lock:
+            if page_id:
+                self.page_ids.append(page_id)
+            if failed:
+                self.has_failures = True
+            self.remaining -= 1
+            return self.remaining == 0
+
+def _finalize_file(state: _FileState, index, progress):
+    """Removes stale pages of a fully processed file and records it in the ingestion cache."""
+    if not state.has_failures:
+        # Files with failed pages keep their previous pages and are not marked,
+        # so the background retry (or uploading them again) redoes the missing pages
+        index.prune_source(state.collection, state.filename, state.page_ids)
+        ingest_cache.mark_ingested(state.pdf_hash, state.collection, state.filename, state.page_count)
+    checkpoints.finish_file(state.collection, state.filename, complete=not state.has_failures)
+    progress(state.filename, "done")
+    logger.info(f"Finished ingestion of {state.filename}: {len(state.page_ids)}/{state.page_count} page(s) indexed.")
+
+def load_vectorstore(file_paths: list, index, progress=_no_progress, collection: str = None) -> int:
     """
     Main ingestion pipeline. Processes PDFs using a hybrid, parallelized approach for maximum quality and optimized speed.
+    `progress(filename, stage, page_num=None, total_pages=None)` is called as files and pages advance.
+    Pages whose rendered image, OCR text or fused content were seen before are served from the ingestion cache.
+
+    Every page flows on its own through overlapping, bounded stages:
+    render/classify (this thread) -> hi_res OCR (process pool, scanned pages only)
+    -> summarize/describe -> embed and upsert into `index` in small batches.
+    A page is queryable as soon as its batch is upserted, and bounded queues
+    keep memory flat regardless of document size. Returns the number of pages indexed.
+
+    Page progress is checkpointed (see modules/checkpoints.py): running a file
+    again after a crash or a failure skips its indexed pages and embeds its
+    enriched pages straight from the checkpoint.
+
+    Pages are stored in `collection` (see modules/scoping.py), the default one
+    when None. Files of the same name in two collections are separate documents.
     """
-    file_paths = [UPLOAD_DIR / f.filename for f in uploaded_files]
-    for file, path in zip(uploaded_files, file_paths):
-        with open(path, "wb") as f: f.write(file.file.read())
-
-    hybrid_docs = []
-    for path in file_paths:
-        filename = os.path.basename(path)
-        print(f"Starting Hybrid & Parallel ingestion for: {path}")
-
-        elements = partition_pdf(str(path), strategy="hi_res", infer_table_structure=True)
-        pages_content = {}
-        for el in elements:
-            page_num = el.metadata.page_number
-            if page_num not in pages_content:
-                pages_content[page_num] = ""
-            pages_content[page_num] += "\n\n" + str(el)
-
-        tasks_to_run_in_parallel = []
-        pdf_doc = fitz.open(path)
-        for page in pdf_doc:
-            page_num = page.number + 1
-            image_path_full = IMAGE_SAVE_DIR / f"{os.path.splitext(filename)[0]}_p{page_num}_full.png"
-            page.get_pixmap(dpi=200).save(image_path_full)
-
-            for img_index, img in enumerate(page.get_images(full=True)):
-                xref = img[0]
-                if xref:
-                    img_pix = fitz.Pixmap(pdf_doc, xref)
-                    if img_pix.n - img_pix.alpha >= 3:
-                        img_path_specific = IMAGE_SAVE_DIR / f"{os.path.splitext(filename)[0]}_p{page_num}_img{img_index}.png"
-                        img_pix.save(img_path_specific)
-
-            if page_num in pages_content:
-                tasks_to_run_in_parallel.append((pages_content[page_num], filename, page_num, image_path_full))
-        
-        # Parallelize the AI-heavy processing across all pages
-        with ThreadPoolExecutor(max_workers=22) as executor:
-            future_to_page = {executor.submit(process_page_hybrid, task): task for task in tasks_to_run_in_parallel}
-            for future in as_completed(future_to_page):
-                try:
-                    hybrid_docs.append(future.result())
-                except Exception as exc:
-                    print(f"A processing task generated an error: {exc}")
-
-    vectorstore = Chroma.from_documents(hybrid_docs, embeddings, persist_directory=str(PERSIST_DIR))
-    print("High-Definition Hybrid & Parallel ingestion complete.")
-    return vectorstore
\ No newline at end of file
+    pages_indexed = 0
+
+    def finish_page(state: _FileState, page_id: str = None, failed: bool = False):
+        PAGES.inc(status=("degraded" if page_id else "failed") if failed else "indexed" if page_id else "empty")
+        if state.page_finished(page_id, failed):
+            _finalize_file(state, index, progress)
+
+    # --- Stage 4: embed + upsert ---
+    def embed_batch(batch: list):
+        nonlocal pages_indexed
+        index.upsert([doc for _, doc, _ in batch])
+        pages_indexed += len(batch)
+        for state, doc, complete in batch:
+            page_num = doc.metadata["page_number"]
+            if complete:
+                checkpoints.record(state.collection, state.filename, page_num, "embedded")
+            progress(state.filename, "embedded", page_num)
+            # Degraded pages stay indexed but count as failures, so the file is retried
+            finish_page(state, page_doc_id(state.collection, state.filename, page_num), failed=not complete)
+
+    def on_embed_error(batch: list, exc: Exception):
+        logger.error(f"Embedding a batch of {len(batch)} page(s) generated an error: {exc}")
+        for state, doc, _ in batch:
+            checkpoints.record(state.collection, state.filename, doc.metadata["page_number"], "failed", error=str(exc))
+            finish_page(state, failed=True)
+
+    # --- Stage 3: summarize + describe ---
+    def enrich(item: tuple):
+        state, page_num, text = item
+        image_name, image_hash = state.page_images[page_num]
+        doc, complete = process_page_hybrid((text, state.filename, page_num, image_name, image_hash), progress)
+        doc.metadata["collection"] = state.collection
+        checkpoints.record(state.collection, state.filename, page_num, "enriched" if complete else "degraded", content=doc.page_content)
+        embed_stage.put((state, doc, complete))
+
+    def on_enrich_error(item: tuple, exc: Exception):
+        state, page_num, _ = item
+        logger.error(f"A processing task generated an error: {exc}")
+        checkpoints.record(state.collection, state.filename, page_num, "failed", error=str(exc))
+        finish_page(state, failed=True)
+
+    def submit_text(state: _FileState, page_num: int, text: str):
+        checkpoints.record(state.collection, state.filename, page_num, "text")
+        progress(state.filename, "ocr", page_num)
+        enrich_stage.put((state, page_num, text))
+
+    def skip_empty(state: _FileState, page_num: int):
+        checkpoints.record(state.collection, state.filename, page_num, "empty")
+        finish_page(state)
+
+    # --- Stage 2: hi_res OCR on the process pool ---
+    def ocr(item: tuple):
+        state, page_range = item
+        pages_content, elapsed = _get_ocr_pool().submit(partition_pages, str(state.path), page_range).result()
+        # Measured inside the worker process, so queueing for a free worker is not included
+        observe_stage("ingest", "partition", elapsed)
+        logger.info(f"{state.filename}: hi_res OCR of pages {page_range[0]}-{page_range[-1]} took {elapsed:.1f} s ({elapsed / len(page_range):.2f} s/page)")
+        for page_num in page_range:
+            text = pages_content.get(page_num)
+            if text:
+                ingest_cache.put_ocr(state.page_images[page_num][1], text)
+                submit_text(state, page_num, text)
+            else:
+                skip_empty(state, page_num)
+
+    def on_ocr_error(item: tuple, exc: Exception):
+        state, page_range = item
+        logger.error(f"OCR of {state.filename} pages {page_range} generated an error: {exc}")
+        for page_num in page_range:
+            checkpoints.record(state.collection, state.filename, page_num, "failed", error=str(exc))
+            finish_page(state, failed=True)
+
+    embed_stage = Stage("embed", embed_batch, workers=1, maxsize=PIPELINE_QUEUE_SIZE, batch_size=EMBED_BATCH_SIZE, on_error=on_embed_error)
+    enrich_stage = Stage("enrich", enrich, workers=ENRICH_MAX_WORKERS, maxsize=PIPELINE_QUEUE_SIZE, on_error=on_enrich_error)
+    ocr_stage = Stage("ocr", ocr, workers=OCR_PROCESSES, maxsize=PIPELINE_QUEUE_SIZE, on_error=on_ocr_error)
+
+    # --- Stage 1: render + classify, feeding the stages above ---
+    try:
+        for path in file_paths:
+            filename = os.path.basename(path)
+            pdf_hash = uploaded_file_hash(path)
+            file_collection = collection or DEFAULT_COLLECTION
+            if filename in ingest_cache.find_document(pdf_hash, file_collection) and index.has_source(file_collection, filename):
+                logger.info(f"Skipping {filename}: identical content was already ingested.")
+                progress(filename, "done")
+                continue
+            logger.info(f"Starting Hybrid & Parallel ingestion for: {path}")
+
+            with fitz.open(path) as pdf_doc:
+                state = _FileState(path, pdf_hash, len(pdf_doc), file_collection)
+                saved_pages = checkpoints.start_file(file_collection, filename, str(Path(path).resolve()), pdf_hash, state.page_count)
+                if state.page_count == 0:
+                    _finalize_file(state, index, progress)
+                    continue
+                progress(filename, "processing", total_pages=state.page_count)
+                text_layer_pages = cache_hits = ocr_pages = resumed_pages = 0
+                page_range = []
+                image_entries = {}
+                claim = partial(claim_images, file_collection, filename)
+                for page in pdf_doc:
+                    page_num = page.number + 1
+                    started = time.perf_counter()
+                    kind, text = classify_page(page)
+                    with span("ingest", "render"):
+                        full_page = store_pixmap(page.get_pixmap(dpi=200), claim)
+                    image_hash = full_page["hash"]
+                    state.page_images[page_num] = (full_page["file"], image_hash)
+
+                    with span("ingest", "image_extraction"):
+                        sub_images = _extract_page_images(pdf_doc, page, claim)
+                    image_entries[page_num] = build_page_entry(full_page, sub_images)
+
+                    # Pages a previous run already finished, or enriched without embedding them
+                    status, content = saved_pages.get(page_num, (None, None))
+                    if status in DONE_PAGE_STATES or (status == "enriched" and content):
+                        resumed_pages += 1
+                        if status == "embedded":
+                            progress(filename, "embedded", page_num)
+                            finish_page(state, page_doc_id(file_collection, filename, page_num))
+                        elif status == "empty":
+                            finish_page(state)
+                        else:
+                            doc = Document(page_content=content, metadata={"source": filename, "page_number": page_num,
+                                                                           "collection": file_collection})
+                            embed_stage.put((state, doc, True))
+                        continue
+
+                    if kind == "text":
+                        text_layer_pages += 1
+                        logger.debug(f"{filename} p{page_num}: text layer extracted and rendered in {(time.perf_counter() - started) * 1000:.1f} ms")
+                        if text:
+                            submit_text(state, page_num, text)
+                        else:
+                            skip_empty(state, page_num)
+                        continue
+
+                    # Scanned pages whose rendered image was OCR'd before are served from the cache
+                    cached_text = ingest_cache.get_ocr(image_hash)
+                    if cached_text is not None:
+                        cache_hits += 1
+                        submit_text(state, page_num, cached_text)
+                        continue
+                    ocr_pages += 1
+                    page_range.append(page_num)
+                    if len(page_range) == OCR_PAGES_PER_TASK:
+                        ocr_stage.put((state, page_range))
+                        page_range = []
+                if page_range:
+                    ocr_stage.put((state, page_range))
+                write_image_index(file_collection, filename, image_entries)
+
+            logger.info(
+                f"{filename}: {resumed_pages} page(s) resumed from checkpoints, {text_layer_pages} via text layer, "
+                f"{cache_hits} from OCR cache, {ocr_pages} via hi_res OCR (mode={EXTRACTION_MODE})."
+            )
+    finally:
+        # Drain the stages in pipeline order so no stage receives work after it stopped
+        ocr_stage.close()
+        enrich_stage.close()
+        embed_stage.close()
+
+    logger.info("High-Definition Hybrid & Parallel ingestion complete.")
+    return pages_indexed
@@ -0,0 +1,141 @@
+# modules/metrics.py
+
+import time
+import threading
+from contextlib import contextmanager
+
+# --- Module-level Configuration ---
+# Latency buckets in seconds, from cache hits (ms) up to slow LLM/VLM calls and large OCR batches.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(labelnames: tuple, values: tuple) -> str:
+    if not labelnames:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter with labels, rendered in the Prometheus text format."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.labelnames + ("le",), key + (bound,))
+                yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), key + ('+Inf',))} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "visiondoc_stage_seconds",
+    "Duration of one pipeline stage. pipeline is ingest or query; ingest stages are per page or per batch.",
+    ("pipeline", "stage"),
+))
+STAGE_ERRORS = registry.register(Counter(
+    "visiondoc_stage_errors", "Pipeline stage executions that raised.", ("pipeline", "stage"),
+))
+PAGES = registry.register(Counter(
+    "visiondoc_pages", "Pages that finished ingestion, by outcome.", ("status",),
+))
+QUERIES_REJECTED = registry.register(Counter(
+    "visiondoc_queries_rejected", "Queries turned away by admission control, by HTTP status.", ("status",),
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "visiondoc_http_request_seconds", "HTTP request duration until the response headers are sent.", ("method", "route", "status"),
+))
+
+
+@contextmanager
+def span(pipeline: str, stage: str):
+    """Times a block as one `visiondoc_stage_seconds` observation and counts it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(pipeline=pipeline, stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, pipeline=pipeline, stage=stage)
+
+
+def observe_stage(pipeline: str, stage: str, seconds: float):
+    """Records a stage duration measured elsewhere, e.g. inside an OCR worker process."""
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage)
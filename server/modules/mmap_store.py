@@ -0,0 +1,407 @@
+# modules/mmap_store.py
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from modules.scoping import SCOPE_FIELDS, where_to_sql
+from logger import logger
+
+# --- Module-level Configuration ---
+# On-disk precision of the vectors: "int8" (per-row scale, 4x smaller than float32) or "float16".
+VECTOR_DTYPE = os.environ.get("VECTOR_DTYPE", "int8").lower()
+# Exact search below this many vectors; above it an IVF index (k-means lists) is trained.
+IVF_MIN_ROWS = int(os.environ.get("IVF_MIN_ROWS", 50000))
+# Number of IVF lists scanned per query.
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 8))
+SEARCH_BLOCK_ROWS = 65536  # rows dequantized at once while scoring
+INITIAL_CAPACITY = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_ROWS = 50000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    row INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    document TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    collection TEXT,
+    source TEXT,
+    page_number INTEGER
+);
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _column(key: str) -> str:
+    """SQL expression of a metadata key: the scope fields are indexed columns, the rest stay in the JSON."""
+    return key if key in SCOPE_FIELDS else f"json_extract(metadata, '$.{key}')"
+
+
+def _where_sql(where: Optional[dict]) -> Tuple[str, list]:
+    return where_to_sql(where or {}, _column)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Vector store that keeps the normalized bge-m3 vectors in a memory-mapped
+    int8 or float16 matrix on disk, with ids, page text and metadata in an
+    SQLite sidecar. Several worker processes can open the same directory: the
+    matrix pages are shared through the OS page cache instead of being loaded
+    per process, and each process notices writes by another one through
+    SQLite's `data_version` and remaps before its next search. The scope
+    fields of the metadata (collection, source, page number) are also kept as
+    indexed columns, so a scoped search only reads the rows in its scope.
+
+    Search is an exact, blockwise NumPy dot product; once the index holds
+    IVF_MIN_ROWS vectors, a k-means IVF index restricts each query to the
+    IVF_NPROBE closest lists. It implements the `VectorStore` methods used by
+    the retrievers and the `get`/`delete` calls IndexManager makes on Chroma.
+    """
+
+    def __init__(self, directory, embedding_function: Embeddings, dtype: str = VECTOR_DTYPE):
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._embedding = embedding_function
+        self._conn = sqlite3.connect(str(self._dir / "meta.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._add_scope_columns()
+        self._lock = threading.RLock()
+        self._requested_dtype = dtype
+        self._data_version = None
+        self._trained_rows = None
+        self._vectors = self._scales = self._lists = self._centroids = None
+        self._alive = np.zeros(0, dtype=bool)
+        with self._lock:
+            self._refresh(force=True)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    # --- Sidecar helpers ---
+    def _add_scope_columns(self):
+        """Adds the indexed scope columns to a sidecar created without them, filled from the JSON metadata."""
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+            missing = [field for field in SCOPE_FIELDS if field not in columns]
+            for field in missing:
+                self._conn.execute(f"ALTER TABLE entries ADD COLUMN {field} {'INTEGER' if field == 'page_number' else 'TEXT'}")
+            if missing:
+                assignments = ", ".join(f"{field} = json_extract(metadata, '$.{field}')" for field in SCOPE_FIELDS)
+                self._conn.execute(f"UPDATE entries SET {assignments}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_scope ON entries (collection, source, page_number)")
+
+    def _info(self, key: str, default=None):
+        row = self._conn.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_info(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _path(self, name: str) -> Path:
+        return self._dir / name
+
+    # --- Memory maps ---
+    def _map(self):
+        """(Re)opens the matrix files at the current capacity."""
+        shape = (self._capacity, self._dims)
+        self._vectors = np.memmap(self._path("vectors.bin"), dtype=self._dtype, mode="r+", shape=shape)
+        self._lists = np.memmap(self._path("lists.bin"), dtype=np.int32, mode="r+", shape=(self._capacity,))
+        self._scales = (
+            np.memmap(self._path("scales.bin"), dtype=np.float32, mode="r+", shape=(self._capacity,))
+            if self._dtype == np.int8 else None
+        )
+
+    def _files(self):
+        files = [("vectors.bin", self._dims * self._dtype.itemsize), ("lists.bin", 4)]
+        if self._dtype == np.int8:
+            files.append(("scales.bin", 4))
+        return files
+
+    def _grow(self, capacity: int):
+        """Extends every matrix file to `capacity` rows and remaps it. Call with the lock held."""
+        for name, row_bytes in self._files():
+            with open(self._path(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+        old = self._capacity
+        self._capacity = capacity
+        self._map()
+        self._lists[old:] = -1
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - old, dtype=bool)])
+        self._set_info("capacity", capacity)
+
+    def _refresh(self, force: bool = False):
+        """Reloads the live-row mask and remaps when another process changed the index. Call with the lock held."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if not force and version == self._data_version:
+            return
+        self._data_version = version
+        self._dims = int(self._info("dims", 0))
+        self._capacity = int(self._info("capacity", 0))
+        self._dtype = np.dtype(self._info("dtype", self._requested_dtype))
+        if force and self._dtype.name != self._requested_dtype:
+            logger.warning(f"Vector index in {self._dir} stores {self._dtype.name}; ignoring VECTOR_DTYPE={self._requested_dtype}.")
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        if not self._dims:
+            return
+        self._map()
+        rows = [row for (row,) in self._conn.execute("SELECT row FROM entries")]
+        self._alive[rows] = True
+        trained = self._info("trained_rows")
+        if trained != self._trained_rows:
+            self._trained_rows = trained
+            self._centroids = np.load(self._path("centroids.npy")) if trained else None
+
+    def _create(self, dims: int):
+        """Creates the matrix files once the embedding size is known. Call with the lock held."""
+        self._dims = dims
+        self._dtype = np.dtype(self._requested_dtype)
+        self._capacity = 0
+        self._alive = np.zeros(0, dtype=bool)
+        with self._conn:
+            self._set_info("dims", dims)
+            self._set_info("dtype", self._dtype.name)
+            self._grow(INITIAL_CAPACITY)
+
+    # --- Writes ---
+    def _encode(self, vectors: np.ndarray):
+        """Returns the stored form of normalized float32 vectors and their int8 scales (or None)."""
+        if self._dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        block = self._vectors[rows].astype(np.float32)
+        if self._scales is not None:
+            block *= self._scales[rows][:, None]
+        return block
+
+    def _nearest_lists(self, vectors: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.full(len(vectors), -1, dtype=np.int32)
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [f"{abs(hash(t))}-{i}" for i, t in enumerate(texts)]
+        vectors = _normalize(np.asarray(self._embedding.embed_documents(texts), dtype=np.float32))
+
+        with self._lock:
+            self._refresh()
+            if not self._dims:
+                self._create(vectors.shape[1])
+            encoded, scales = self._encode(vectors)
+            placeholders = ",".join("?" * len(ids))
+            existing = dict(self._conn.execute(f"SELECT id, row FROM entries WHERE id IN ({placeholders})", ids).fetchall())
+            missing = [doc_id for doc_id in ids if doc_id not in existing]
+            free = np.flatnonzero(~self._alive)
+            if len(free) < len(missing):
+                self._grow(max(self._capacity * 2, self._capacity + len(missing)))
+                free = np.flatnonzero(~self._alive)
+            new_rows = dict(zip(missing, free[:len(missing)].tolist()))
+            rows = np.array([existing.get(doc_id, new_rows.get(doc_id)) for doc_id in ids])
+
+            # Vectors are on disk before their rows become visible to other processes
+            self._vectors[rows] = encoded
+            if scales is not None:
+                self._scales[rows] = scales
+            self._lists[rows] = self._nearest_lists(vectors)
+            self._vectors.flush()
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (row, id, document, metadata, collection, source, page_number) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(int(row), doc_id, text, json.dumps(metadata), *(metadata.get(field) for field in SCOPE_FIELDS))
+                     for row, doc_id, text, metadata in zip(rows, ids, texts, metadatas)],
+                )
+            self._alive[rows] = True
+            self._maybe_train()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs):
+        if not ids:
+            return
+        with self._lock:
+            self._refresh()
+            placeholders = ",".join("?" * len(ids))
+            rows = [row for (row,) in self._conn.execute(f"SELECT row FROM entries WHERE id IN ({placeholders})", ids)]
+            with self._conn:
+                self._conn.execute(f"DELETE FROM entries WHERE id IN ({placeholders})", ids)
+            self._alive[rows] = False
+
+    # --- IVF ---
+    def _maybe_train(self):
+        """Trains (or retrains, after the index doubled) the IVF lists. Call with the lock held."""
+        live = np.flatnonzero(self._alive)
+        trained = int(self._trained_rows or 0)
+        if len(live) < IVF_MIN_ROWS or (trained and len(live) < 2 * trained):
+            return
+        n_lists = int(np.sqrt(len(live)))
+        logger.info(f"Training the IVF index: {n_lists} lists over {len(live)} vectors.")
+        rng = np.random.default_rng(0)
+        sample = self._decode(np.sort(rng.choice(live, size=min(len(live), KMEANS_SAMPLE_ROWS), replace=False)))
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = sample[assignment == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        self._centroids = centroids.astype(np.float32)
+        for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+            rows = live[start:start + SEARCH_BLOCK_ROWS]
+            self._lists[rows] = self._nearest_lists(self._decode(rows))
+        self._lists.flush()
+        tmp_path = self._path("centroids.tmp.npy")
+        np.save(tmp_path, self._centroids)
+        os.replace(tmp_path, self._path("centroids.npy"))
+        self._trained_rows = str(len(live))
+        with self._conn:
+            self._set_info("trained_rows", self._trained_rows)
+
+    # --- Reads ---
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return int(self._alive.sum())
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            include: Iterable[str] = ("documents", "metadatas"), **kwargs) -> dict:
+        """Chroma-compatible `get`: returns {"ids", "documents"?, "metadatas"?} for the matching entries."""
+        sql, params = _where_sql(where)
+        if ids is not None:
+            if not ids:
+                return {"ids": [], **{key: [] for key in include}}
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params = params + list(ids)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = params + [int(limit)]
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id, document, metadata FROM entries WHERE {sql}", params).fetchall()
+        result = {"ids": [row[0] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row[1] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[2]) for row in rows]
+        return result
+
+    def _scoped_rows(self, where: Optional[dict]) -> np.ndarray:
+        """Live rows matching `where`, looked up through the scope index. Call with the lock held."""
+        rows = np.flatnonzero(self._alive)
+        if where:
+            sql, params = _where_sql(where)
+            allowed = [row for (row,) in self._conn.execute(f"SELECT row FROM entries WHERE {sql}", params)]
+            rows = np.intersect1d(rows, np.array(allowed, dtype=np.int64))
+        return rows
+
+    def _candidates(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Rows of `rows` to score for one query: all of them, or those in its closest IVF lists."""
+        if self._centroids is not None and len(rows) > SEARCH_BLOCK_ROWS:
+            probes = np.argsort(-(self._centroids @ query))[:IVF_NPROBE]
+            lists = self._lists[rows]
+            rows = rows[np.isin(lists, probes) | (lists < 0)]
+        return rows
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs) -> List[Tuple[Document, float]]:
+        """Returns the `k` most similar entries with their cosine similarity, optionally restricted by a metadata filter."""
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter=filter)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None,
+                                               **kwargs) -> List[Tuple[Document, float]]:
+        """Like `similarity_search_with_score`, for a query that is already embedded."""
+        return self._search_vectors([embedding], k, filter)[0]
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4,
+                                     filter: Optional[dict] = None) -> List[List[Document]]:
+        """
+        Searches several already-embedded queries in one pass: each block of
+        stored vectors is read and dequantized once and scored against all of them.
+        """
+        return [[doc for doc, _ in hits] for hits in self._search_vectors(embeddings, k, filter)]
+
+    def _search_vectors(self, embeddings: List[List[float]], k: int, filter: Optional[dict]) -> List[List[Tuple[Document, float]]]:
+        queries = np.stack([_normalize(np.asarray(embedding, dtype=np.float32)) for embedding in embeddings])
+        with self._lock:
+            self._refresh()
+            if not self._dims:
+                return [[] for _ in embeddings]
+            # The scope is resolved once; with IVF each query then probes its own lists,
+            # and the union is scored once and masked per query
+            scoped = self._scoped_rows(filter)
+            per_query = [self._candidates(q, scoped) for q in queries]
+            vectors, scales = self._vectors, self._scales
+        rows = per_query[0] if len(per_query) == 1 else np.unique(np.concatenate(per_query))
+
+        scores = np.empty((len(queries), len(rows)), dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            block = rows[start:start + SEARCH_BLOCK_ROWS]
+            partial = vectors[block].astype(np.float32) @ queries.T
+            if scales is not None:
+                partial *= scales[block][:, None]
+            scores[:, start:start + len(block)] = partial.T
+
+        ranked = []
+        for i, candidates in enumerate(per_query):
+            columns = np.arange(len(rows)) if len(per_query) == 1 else np.flatnonzero(np.isin(rows, candidates))
+            query_scores = scores[i, columns]
+            if len(query_scores) > k:
+                top = np.argpartition(-query_scores, k)[:k]
+            else:
+                top = np.arange(len(query_scores))
+            top = top[np.argsort(-query_scores[top])]
+            ranked.append([(int(rows[columns[j]]), float(query_scores[j])) for j in top])
+
+        top_rows = sorted({row for hits in ranked for row, _ in hits})
+        if not top_rows:
+            return [[] for _ in embeddings]
+        with self._lock:
+            found = {
+                row: (document, json.loads(metadata))
+                for row, document, metadata in self._conn.execute(
+                    f"SELECT row, document, metadata FROM entries WHERE row IN ({','.join('?' * len(top_rows))})", top_rows
+                )
+            }
+        return [
+            [(Document(page_content=found[row][0], metadata=found[row][1]), score) for row, score in hits if row in found]
+            for hits in ranked
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None,
+                                    **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter=filter)]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, directory=None, **kwargs) -> "MmapVectorStore":
+        store = cls(directory, embedding)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,89 @@
+# modules/models.py
+
+import os
+import time
+import threading
+
+from logger import logger
+from modules.inference_backend import load_embeddings, load_cross_encoder, INFERENCE_BACKEND
+from modules.reranker import BatchingReranker
+
+# --- Module-level Configuration ---
+# "background" loads every model in a thread right after startup, "eager" blocks startup
+# until they are loaded, "off" loads each model on its first use.
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "background").lower()
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the heavy models. Each model is loaded exactly
+    once, on first use or during `warm_up`, and the same instance is shared by
+    ingestion and querying. Load times are recorded for `status`.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._load_seconds = {}
+        self._locks = {}
+
+    def register(self, name: str, loader):
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._locks[name]:
+            if name not in self._models:
+                started = time.perf_counter()
+                logger.info(f"Loading model '{name}'...")
+                self._models[name] = self._loaders[name]()
+                self._load_seconds[name] = time.perf_counter() - started
+                logger.info(f"Model '{name}' loaded in {self._load_seconds[name]:.1f} s.")
+            return self._models[name]
+
+    def lazy(self, name: str) -> "LazyModel":
+        """Returns a stand-in that loads the model the first time one of its attributes is used."""
+        return LazyModel(self, name)
+
+    def warm_up(self, names: list = None):
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def status(self) -> dict:
+        return {
+            name: {"loaded": name in self._models, "load_seconds": self._load_seconds.get(name)}
+            for name in self._loaders
+        }
+
+
+class LazyModel:
+    """Proxy that forwards attribute access to a registry model, loading it on first access."""
+
+    def __init__(self, registry: ModelRegistry, name: str):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr):
+        # Private and dunder lookups (copy, pickle, pydantic) must not trigger a model load
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self._registry.get(self._name), attr)
+
+
+registry = ModelRegistry()
+# bge-m3, shared by ingestion (document embeddings) and querying (query embeddings)
+registry.register("embeddings", load_embeddings)
+# bge-reranker-v2-m3 behind the micro-batching engine
+registry.register("reranker", lambda: BatchingReranker(load_cross_encoder()))
+
+
+def start_warm_up():
+    """Applies MODEL_WARMUP at application startup."""
+    logger.info(f"Inference backend: {INFERENCE_BACKEND}, model warm-up: {MODEL_WARMUP}.")
+    if MODEL_WARMUP == "eager":
+        registry.warm_up()
+    elif MODEL_WARMUP == "background":
+        threading.Thread(target=registry.warm_up, name="model-warmup", daemon=True).start()
@@ -0,0 +1,45 @@
+# modules/ocr_worker.py
+#
+# Runs inside the OCR process pool. Kept free of model and API imports so that
+# worker processes start quickly and only load what partitioning needs.
+
+import os
+import time
+import tempfile
+
+import fitz  # PyMuPDF
+from unstructured.partition.pdf import partition_pdf
+
+
+def partition_pages(path: str, page_numbers: list) -> tuple:
+    """
+    Runs hi_res partitioning on a subset of pages and returns ({page_number: text}, seconds).
+    When only some pages need OCR, they are copied into a temporary PDF first
+    so the layout model never sees the pages we already have text for.
+    """
+    started = time.perf_counter()
+    with fitz.open(path) as src:
+        whole_file = len(page_numbers) == len(src)
+        if whole_file:
+            elements = partition_pdf(str(path), strategy="hi_res", infer_table_structure=True)
+            page_map = {n: n for n in page_numbers}
+        else:
+            subset = fitz.open()
+            for num in page_numbers:
+                subset.insert_pdf(src, from_page=num - 1, to_page=num - 1)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                subset_path = os.path.join(tmp_dir, "subset.pdf")
+                subset.save(subset_path)
+                subset.close()
+                elements = partition_pdf(subset_path, strategy="hi_res", infer_table_structure=True)
+            page_map = {i + 1: num for i, num in enumerate(page_numbers)}
+
+    pages_content = {}
+    for el in elements:
+        page_num = page_map.get(el.metadata.page_number)
+        if page_num is None:
+            continue
+        if page_num not in pages_content:
+            pages_content[page_num] = ""
+        pages_content[page_num] += "\n\n" + str(el)
+    return pages_content, time.perf_counter() - started
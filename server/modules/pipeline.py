@@ -0,0 +1,76 @@
+# modules/pipeline.py
+
+import queue
+import threading
+
+from logger import logger
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One stage of a streaming pipeline: a pool of worker threads consuming a
+    bounded queue. `put` blocks while the queue is full, so a fast upstream
+    stage is throttled to the pace of a slow downstream one and the number of
+    items held in memory stays constant.
+
+    With `batch_size > 1` the handler receives a list of up to that many items:
+    whatever is already queued when a worker picks up work, without waiting
+    for a batch to fill.
+    """
+
+    def __init__(self, name: str, handler, workers: int = 1, maxsize: int = 32, batch_size: int = 1, on_error=None):
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        if self.batch_size == 1:
+            return first
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Leave the sentinel for this worker's next iteration
+                self._queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self):
+        while True:
+            work = self._next_batch()
+            if work is None:
+                return
+            try:
+                self.handler(work)
+            except Exception as exc:
+                if self.on_error:
+                    self.on_error(work, exc)
+                else:
+                    logger.exception(f"Pipeline stage '{self.name}' failed")
+
+    def close(self):
+        """Waits for every queued item to be handled, then stops the workers."""
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
@@ -2,13 +2,24 @@
 
 import os
 from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
 from logger import logger
-import fitz
-from modules.load_vectorstore import UPLOAD_DIR
+from modules.image_index import page_images
+from modules.llm import QA_CHAIN_PROMPT, format_context, get_llm
+from modules.metrics import span
 
 SERVER_ROOT = Path(__file__).parent.parent
 BASE_URL = "http://127.0.0.1:8000"
 
+# Questions accepted by one /ask_batch request; must stay below Starlette's limit of 1000 form fields.
+ASK_BATCH_MAX_QUESTIONS = int(os.environ.get("ASK_BATCH_MAX_QUESTIONS", 500))
+# Questions retrieved together: one embedding pass, one vector search and one rerank batch each.
+ASK_BATCH_RETRIEVAL_SIZE = int(os.environ.get("ASK_BATCH_RETRIEVAL_SIZE", 32))
+# Answer generations in flight at once across all batch requests, to stay within the LLM's rate limits.
+ASK_BATCH_LLM_CONCURRENCY = int(os.environ.get("ASK_BATCH_LLM_CONCURRENCY", 8))
+
+_generation_pool = ThreadPoolExecutor(max_workers=ASK_BATCH_LLM_CONCURRENCY, thread_name_prefix="batch-llm")
+
 def user_wants_image(user_input: str) -> bool:
     """
     Determines if the user's query implies a visual intent using keywords.
@@ -19,6 +30,29 @@ def user_wants_image(user_input: str) -> bool:
     ]
     return any(keyword in user_input.lower() for keyword in keywords)
 
+def _answer_image(source_documents: list, user_input: str):
+    """Returns (image_url, thumbnail_url) for the top document when the question asks for a visual."""
+    if not source_documents or not user_wants_image(user_input):
+        return None, None
+    metadata = source_documents[0].metadata
+    source_filename = metadata.get("source")
+    page_number = metadata.get("page_number")
+    if not (source_filename and page_number):
+        return None, None
+
+    # Heuristic: show the largest sub-image on the relevant page, resolved at
+    # ingestion time, falling back to the full page image
+    with span("query", "image_lookup"):
+        entry = page_images(metadata.get("collection"), source_filename, page_number)
+    if not entry:
+        return None, None
+    image = entry["largest"] or entry["full"]
+    logger.debug(f"Displaying specific image: {image['file']}")
+    return f"{BASE_URL}/static/images/{image['file']}", f"{BASE_URL}/static/images/{image['thumb']}"
+
+def _sources(source_documents: list) -> list:
+    return [doc.metadata.get("source", "N/A") for doc in source_documents]
+
 def query_chain(chain, user_input: str):
     """
     Orchestrates the RAG query, handling multimodal responses by constructing
@@ -28,40 +62,108 @@ def query_chain(chain, user_input: str):
         logger.debug(f"Executing High-Quality RAG for: {user_input}")
         result = chain.invoke({"query": user_input})
         
-        image_url = None
         source_documents = result.get("source_documents", [])
-        
-        if source_documents and user_wants_image(user_input):
-            top_doc = source_documents[0]
-            metadata = top_doc.metadata
-            source_filename = metadata.get("source")
-            page_number = metadata.get("page_number")
-
-            if source_filename and page_number:
-                # Default to the full page image as a fallback
-                image_filename_to_show = f"{os.path.splitext(source_filename)[0]}_p{page_number}_full.png"
-                
-                # Heuristic: Find the largest sub-image on the relevant page and display it
-                pdf_path = UPLOAD_DIR / source_filename
-                if pdf_path.exists():
-                    pdf_doc = fitz.open(pdf_path)
-                    if page_number <= len(pdf_doc):
-                        page = pdf_doc[page_number - 1]
-                        images_on_page = page.get_images(full=True)
-                        if images_on_page:
-                            largest_image_info = max(images_on_page, key=lambda img: fitz.Pixmap(pdf_doc, img[0]).size)
-                            img_index = images_on_page.index(largest_image_info)
-                            image_filename_to_show = f"{os.path.splitext(source_filename)[0]}_p{page_number}_img{img_index}.png"
-
-                relative_path = os.path.join("static/images", image_filename_to_show).replace("\\", "/")
-                image_url = f"{BASE_URL}/{relative_path}"
-                logger.debug(f"Displaying specific image: {image_filename_to_show}")
+        image_url, thumbnail_url = _answer_image(source_documents, user_input)
 
         return {
             "response": result["result"],
-            "sources": [doc.metadata.get("source", "N/A") for doc in source_documents],
-            "image_url": image_url
+            "sources": _sources(source_documents),
+            "image_url": image_url,
+            "thumbnail_url": thumbnail_url
         }
     except Exception as e:
         logger.exception("Error in query_chain")
-        raise
\ No newline at end of file
+        raise
+
+def stream_query(chain, user_input: str):
+    """
+    Streaming variant of `query_chain`. Yields events as dicts:
+    a "meta" event with the sources and image URLs as soon as retrieval and
+    reranking are done, one "token" event per generated chunk of the answer,
+    and a final "done" event carrying the full answer.
+    """
+    logger.debug(f"Streaming High-Quality RAG for: {user_input}")
+    source_documents = chain.retriever.invoke(user_input)
+    image_url, thumbnail_url = _answer_image(source_documents, user_input)
+    meta = {"sources": _sources(source_documents), "image_url": image_url, "thumbnail_url": thumbnail_url}
+    yield {"type": "meta", **meta}
+
+    prompt = QA_CHAIN_PROMPT.format(context=format_context(source_documents), question=user_input)
+    parts = []
+    for chunk in get_llm().stream(prompt):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield {"type": "token", "text": chunk.content}
+    yield {"type": "done", "response": "".join(parts), **meta}
+
+def _answer(source_documents: list, user_input: str) -> dict:
+    """Generates the answer to one question from its retrieved documents, as `query_chain` does."""
+    prompt = QA_CHAIN_PROMPT.format(context=format_context(source_documents), question=user_input)
+    image_url, thumbnail_url = _answer_image(source_documents, user_input)
+    return {
+        "response": get_llm().invoke(prompt).content,
+        "sources": _sources(source_documents),
+        "image_url": image_url,
+        "thumbnail_url": thumbnail_url
+    }
+
+def _resolved(result=None, error: Exception = None) -> Future:
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+def _batch_event(index: int, question: str, future: Future) -> dict:
+    try:
+        return {"type": "answer", "index": index, "question": question, **future.result()}
+    except Exception as e:
+        logger.error(f"Batch question {index} failed: {e}")
+        return {"type": "error", "index": index, "question": question, "error": str(e)}
+
+def answer_batch(chain, questions: list, cached: list = None):
+    """
+    Answers many questions with shared work and yields one event per question,
+    in the order given: {"type": "answer", "index", "question", "response", ...}
+    or {"type": "error", "index", "question", "error"}.
+
+    Questions without a `cached` answer are retrieved in groups of
+    ASK_BATCH_RETRIEVAL_SIZE (one embedding pass, one vector search and one
+    rerank batch per group), and their answers are generated on a shared pool
+    of ASK_BATCH_LLM_CONCURRENCY threads while the next group is retrieved.
+    A question repeated within the batch is answered once.
+    """
+    futures = [_resolved(result) if result is not None else None for result in (cached or [None] * len(questions))]
+    todo, first_asked = [], {}
+    for i, future in enumerate(futures):
+        if future is None and first_asked.setdefault(questions[i], i) == i:
+            todo.append(i)
+    next_index = 0
+    try:
+        for start in range(0, len(todo), ASK_BATCH_RETRIEVAL_SIZE):
+            group = todo[start:start + ASK_BATCH_RETRIEVAL_SIZE]
+            try:
+                retrieved = chain.retriever.retrieve_batch([questions[i] for i in group])
+            except Exception as e:
+                logger.exception("Error retrieving a group of batch questions")
+                for i in group:
+                    futures[i] = _resolved(error=e)
+            else:
+                for i, source_documents in zip(group, retrieved):
+                    futures[i] = _generation_pool.submit(_answer, source_documents, questions[i])
+            for i, future in enumerate(futures):
+                if future is None:
+                    futures[i] = futures[first_asked[questions[i]]]
+            # Hand back whatever is ready before retrieving the next group
+            while next_index < len(futures) and futures[next_index] is not None and futures[next_index].done():
+                yield _batch_event(next_index, questions[next_index], futures[next_index])
+                next_index += 1
+        while next_index < len(futures):
+            yield _batch_event(next_index, questions[next_index], futures[next_index])
+            next_index += 1
+    finally:
+        # The client went away: drop the generations that have not started yet
+        for future in futures[next_index:]:
+            if future is not None:
+                future.cancel()
@@ -0,0 +1,83 @@
+# modules/reranker.py
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import List
+
+from logger import logger
+
+# --- Module-level Configuration ---
+# How long the engine waits for pairs from other concurrent requests before running a batch.
+RERANK_BATCH_WINDOW_MS = float(os.environ.get("RERANK_BATCH_WINDOW_MS", 5))
+# Upper bound on the pairs scored in one engine batch (several requests' worth).
+RERANK_MAX_BATCH_PAIRS = int(os.environ.get("RERANK_MAX_BATCH_PAIRS", 64))
+# Mini-batch size of each CrossEncoder forward pass inside an engine batch.
+RERANK_MODEL_BATCH_SIZE = int(os.environ.get("RERANK_MODEL_BATCH_SIZE", 16))
+
+
+class BatchingReranker:
+    """
+    Shared reranking engine. Callers submit their (query, passage) pairs through
+    `predict`, which has the same shape as `CrossEncoder.predict`; a single
+    worker thread collects the pairs of concurrent requests for up to
+    RERANK_BATCH_WINDOW_MS, sorts them by length so each padded mini-batch holds
+    similar-length inputs, scores them in one call and hands every caller back
+    its own scores in the original order.
+    """
+
+    def __init__(self, model, window_ms: float = RERANK_BATCH_WINDOW_MS, max_pairs: int = RERANK_MAX_BATCH_PAIRS):
+        self.model = model
+        self.window = window_ms / 1000.0
+        self.max_pairs = max_pairs
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._work, name="rerank-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, pairs: List[List[str]], **_) -> List[float]:
+        if not pairs:
+            return []
+        future = Future()
+        self._queue.put((pairs, future))
+        return future.result()
+
+    def _collect(self) -> list:
+        """Blocks for the first request, then gathers more until the window closes or the batch is full."""
+        batch = [self._queue.get()]
+        total = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while total < self.max_pairs:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            total += len(item[0])
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._collect()
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+            # Sorting by length keeps padding per mini-batch small
+            order = sorted(range(len(all_pairs)), key=lambda i: len(all_pairs[i][0]) + len(all_pairs[i][1]))
+            try:
+                started = time.perf_counter()
+                sorted_scores = self.model.predict([all_pairs[i] for i in order], batch_size=RERANK_MODEL_BATCH_SIZE)
+                logger.debug(f"Reranked {len(all_pairs)} pairs from {len(batch)} request(s) in {(time.perf_counter() - started) * 1000:.0f} ms")
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+
+            scores = [0.0] * len(all_pairs)
+            for position, i in enumerate(order):
+                scores[i] = float(sorted_scores[position])
+            offset = 0
+            for pairs, future in batch:
+                future.set_result(scores[offset:offset + len(pairs)])
+                offset += len(pairs)
+
@@ -0,0 +1,117 @@
+# modules/scheduler.py
+
+import os
+import math
+import time
+import asyncio
+from fastapi.concurrency import run_in_threadpool
+
+from modules.metrics import observe_stage, QUERIES_REJECTED
+from logger import logger
+
+# --- Module-level Configuration ---
+# Queries executed at the same time by one worker process. Retrieval, reranking and the
+# embedding model are CPU-bound, so more parallel queries only slow each other down.
+QUERY_MAX_CONCURRENCY = int(os.environ.get("QUERY_MAX_CONCURRENCY", 4))
+# Queries allowed to wait for a free slot; further ones are turned away with 429 right away.
+QUERY_MAX_QUEUE = int(os.environ.get("QUERY_MAX_QUEUE", 32))
+# Default and maximum time a query may take, waiting included. Clients can ask for less
+# with the X-Request-Timeout header (seconds).
+QUERY_TIMEOUT_SECONDS = float(os.environ.get("QUERY_TIMEOUT_SECONDS", 60))
+# Weight of the latest query in the running service-time average used for Retry-After.
+_EWMA_ALPHA = 0.2
+
+
+class QueryRejectedError(Exception):
+    """
+    Raised when a query is not answered: 429 when the wait queue is full, 503 when its
+    deadline passed while waiting, 504 when it passed while running. `retry_after` is
+    the suggested wait in seconds.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class QueryScheduler:
+    """
+    Admission control for the query endpoints of one worker process.
+
+    At most `max_concurrent` queries run at once and at most `max_queue` wait
+    for a slot; anything beyond that is rejected immediately instead of piling
+    up threads that compete for the same models. Every query carries a
+    deadline covering both its wait and its execution. Work that outlives its
+    deadline cannot be interrupted, so it keeps its slot until it finishes and
+    the caller gets a 504 in the meantime.
+
+    Must be used from the event loop thread.
+    """
+
+    def __init__(self, max_concurrent: int = QUERY_MAX_CONCURRENCY, max_queue: int = QUERY_MAX_QUEUE,
+                 timeout: float = QUERY_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._running = 0
+        self._service_seconds = 1.0  # running average, seeded with a plausible query time
+
+    def deadline(self, requested: float = None) -> float:
+        """Absolute deadline (time.monotonic) for a query arriving now, capped at the server's timeout."""
+        timeout = self.timeout if requested is None or requested <= 0 else min(requested, self.timeout)
+        return time.monotonic() + timeout
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        backlog = self._waiting + self._running
+        return max(1, math.ceil(backlog * self._service_seconds / self.max_concurrent))
+
+    def _reject(self, message: str, status_code: int):
+        QUERIES_REJECTED.inc(status=status_code)
+        logger.warning(f"Query rejected ({status_code}): {message}")
+        raise QueryRejectedError(message, status_code, self.retry_after())
+
+    async def acquire(self, deadline: float):
+        """Waits for a query slot until `deadline`. Pair with `release`."""
+        if self._waiting + self._running >= self.max_concurrent + self.max_queue:
+            self._reject("Too many queries are waiting. Please retry later.", 429)
+        self._waiting += 1
+        arrived = time.monotonic()
+        acquiring = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(acquiring), timeout=max(deadline - time.monotonic(), 0))
+        except BaseException as e:
+            # The permit may have been granted just as the wait ended (timeout or cancellation);
+            # hand it back instead of leaking it
+            if not acquiring.cancel():
+                self._semaphore.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("The query timed out waiting for a free slot.", 503)
+            raise
+        finally:
+            self._waiting -= 1
+        observe_stage("query", "queue_wait", time.monotonic() - arrived)
+        self._running += 1
+
+    def release(self, started: float = None):
+        """Frees a slot; `started` (time.monotonic) feeds the service-time average."""
+        self._running -= 1
+        if started is not None:
+            elapsed = time.monotonic() - started
+            self._service_seconds += _EWMA_ALPHA * (elapsed - self._service_seconds)
+        self._semaphore.release()
+
+    async def run(self, func, *args, deadline: float):
+        """Runs `func(*args)` in the threadpool once a slot is free and returns its result by `deadline`."""
+        await self.acquire(deadline)
+        started = time.monotonic()
+        task = asyncio.ensure_future(run_in_threadpool(func, *args))
+        # The slot is released when the work ends, not when the caller stops waiting for it
+        task.add_done_callback(lambda t: (self.release(started), t.cancelled() or t.exception()))
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self._reject("The query did not finish before its deadline.", 504)
@@ -0,0 +1,84 @@
+# modules/scoping.py
+
+import re
+import json
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote
+
+# Collection of documents uploaded without one.
+DEFAULT_COLLECTION = "default"
+# Metadata fields a scope filters on; SQLite-backed indexes keep them as indexed columns.
+SCOPE_FIELDS = ("collection", "source", "page_number")
+
+_KEY_RE = re.compile(r"^\w+$")
+_COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def collection_dir(collection: str) -> str:
+    """File-system-safe directory name of a collection, for the files kept per collection."""
+    return quote(collection, safe="").replace(".", "%2E")
+
+
+def scope_filter(collection: str = None, sources: List[str] = None,
+                 page_from: int = None, page_to: int = None) -> Optional[dict]:
+    """
+    Builds the metadata filter that restricts a search to one collection, to
+    some documents (`source`) and/or to a page range (`page_number`, inclusive),
+    in the Chroma `where` syntax understood by both vector store backends.
+    Returns None when nothing is restricted, i.e. the whole index is searched.
+    """
+    conditions = []
+    if collection:
+        conditions.append({"collection": collection})
+    sources = [source for source in (sources or []) if source]
+    if len(sources) == 1:
+        conditions.append({"source": sources[0]})
+    elif sources:
+        conditions.append({"source": {"$in": sources}})
+    if page_from is not None:
+        conditions.append({"page_number": {"$gte": page_from}})
+    if page_to is not None:
+        conditions.append({"page_number": {"$lte": page_to}})
+    if not conditions:
+        return None
+    # Chroma rejects an "$and" with fewer than two operands
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def scope_key(where: Optional[dict]) -> str:
+    """Canonical form of a filter, so that answers to the same question under different scopes are cached apart."""
+    return json.dumps(where, sort_keys=True) if where else ""
+
+
+def where_to_sql(where: dict, column: Callable[[str], str]) -> Tuple[str, list]:
+    """
+    Translates a Chroma-style metadata filter into an SQL condition, with
+    `column(key)` giving the SQL expression of a metadata key. Supports
+    equality, `$eq`, `$ne`, `$gt`, `$gte`, `$lt`, `$lte`, `$in`, `$nin`,
+    `$and` and `$or`.
+    """
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(sub, column) for sub in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            params.extend(p for _, sub_params in parts for p in sub_params)
+            continue
+        if not _KEY_RE.match(key):
+            raise ValueError(f"Unsupported metadata key: {key!r}")
+        expression = column(key)
+        operator, value = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        if operator in ("$in", "$nin"):
+            if not value:
+                clauses.append("0" if operator == "$in" else "1")
+                continue
+            negate = "NOT " if operator == "$nin" else ""
+            clauses.append(f"{expression} {negate}IN ({','.join('?' * len(value))})")
+            params.extend(value)
+        elif operator in _COMPARISONS:
+            clauses.append(f"{expression} {_COMPARISONS[operator]} ?")
+            params.append(value)
+        else:
+            raise ValueError(f"Unsupported filter operator: {operator}")
+    return " AND ".join(clauses) or "1", params
@@ -0,0 +1,123 @@
+# modules/uploads.py
+
+import os
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+
+from modules.ingest_cache import sha256_file
+from modules.scoping import DEFAULT_COLLECTION, collection_dir
+
+# --- Module-level Configuration ---
+SERVER_ROOT = Path(__file__).parent.parent
+UPLOAD_DIR = SERVER_ROOT / "uploaded_pdfs"
+# Largest accepted PDF, in megabytes.
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", 512))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Bytes copied per read/write while streaming an upload to disk.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# The PDF header may be preceded by up to this many bytes of junk (PDF 1.7, annex H).
+PDF_HEADER_WINDOW = 1024
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+# SHA-256 of files written by UploadWriter, keyed by path and checked against size and mtime,
+# so ingestion does not read a freshly uploaded PDF a second time just to hash it.
+_known_hashes = {}
+_known_hashes_lock = threading.Lock()
+
+
+class UploadRejectedError(Exception):
+    """Raised when an upload is not a PDF or exceeds MAX_UPLOAD_MB. `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def upload_path(filename: str, collection: str = DEFAULT_COLLECTION) -> Path:
+    """Where an upload is kept: one directory per collection, so equal file names never collide across collections."""
+    name = os.path.basename(filename or "")
+    if not name:
+        raise UploadRejectedError("The upload has no file name.")
+    directory = UPLOAD_DIR / collection_dir(collection)
+    directory.mkdir(exist_ok=True)
+    return directory / name
+
+
+class UploadWriter:
+    """
+    Streams one upload to UPLOAD_DIR in chunks. The SHA-256 is computed while
+    writing, the PDF header is checked as soon as the first bytes arrive, and
+    the size limit is enforced on the bytes actually received. Data goes to a
+    temporary ".part" file that only replaces the target once complete, so
+    memory use is one chunk regardless of the file size and a failed upload
+    never leaves a truncated PDF behind.
+    """
+
+    def __init__(self, filename: str, collection: str = DEFAULT_COLLECTION, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.path = upload_path(filename, collection)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._head = b""
+        # Unique per upload, so two concurrent uploads of the same name do not interleave
+        self._tmp_path = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex[:8]}.part")
+        self._file = open(self._tmp_path, "wb")
+
+    def _check_header(self, final: bool = False):
+        if b"%PDF-" in self._head:
+            self._head = None  # validated
+        elif final or len(self._head) >= PDF_HEADER_WINDOW:
+            raise UploadRejectedError(f"'{self.path.name}' is not a PDF file.", status_code=415)
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadRejectedError(f"'{self.path.name}' exceeds the {MAX_UPLOAD_MB} MB upload limit.", status_code=413)
+        if self._head is not None:
+            self._head += chunk[:PDF_HEADER_WINDOW]
+            self._check_header()
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self) -> Path:
+        """Validates and publishes the upload. Returns its final path."""
+        if self._head is not None:
+            self._check_header(final=True)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        stat = self.path.stat()
+        with _known_hashes_lock:
+            _known_hashes[str(self.path)] = (stat.st_size, stat.st_mtime_ns, self._digest.hexdigest())
+        return self.path
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def copy_upload(source_file, filename: str, collection: str = DEFAULT_COLLECTION) -> Path:
+    """Streams a file-like object (e.g. a multipart UploadFile's spooled file) to UPLOAD_DIR in chunks."""
+    writer = UploadWriter(filename, collection)
+    try:
+        for chunk in iter(lambda: source_file.read(UPLOAD_CHUNK_SIZE), b""):
+            writer.write(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def uploaded_file_hash(path) -> str:
+    """SHA-256 of a PDF, reusing the hash computed during its upload when the file is unchanged."""
+    stat = os.stat(path)
+    with _known_hashes_lock:
+        known = _known_hashes.get(str(path))
+    if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return known[2]
+    return sha256_file(path)
@@ -0,0 +1,7 @@
+# tests/conftest.py
+
+import sys
+from pathlib import Path
+
+# The server modules are imported the way main.py imports them, from the server directory
+sys.path.insert(0, str(Path(__file__).parent.parent))
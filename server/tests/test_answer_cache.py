@@ -0,0 +1,86 @@
+# tests/test_answer_cache.py
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from modules.answer_cache import AnswerCache
+from modules.scheduler import QueryScheduler
+
+ANSWER = {"response": "answer", "sources": ["a.pdf"], "image_url": None, "thumbnail_url": None}
+
+
+class FakeIndex:
+    """Stands in for IndexManager: every write bumps the version."""
+
+    def __init__(self):
+        self.version = 1
+
+    def write(self):
+        self.version += 1
+
+    def snapshot(self, where=None):
+        return None, object(), self.version
+
+
+@pytest.fixture
+def server(monkeypatch):
+    computed = []
+
+    def stream_query(chain, question):
+        computed.append(question)
+        meta = {k: ANSWER[k] for k in ("sources", "image_url", "thumbnail_url")}
+        yield {"type": "meta", **meta}
+        yield {"type": "token", "text": ANSWER["response"]}
+        yield {"type": "done", **ANSWER}
+
+    def answer_batch(chain, questions, cached=None):
+        for i, question in enumerate(questions):
+            if cached[i] is None:
+                computed.append(question)
+            yield {"type": "answer", "index": i, "question": question, **(cached[i] or ANSWER)}
+
+    monkeypatch.setattr(main, "stream_query", stream_query)
+    monkeypatch.setattr(main, "answer_batch", answer_batch)
+    index = FakeIndex()
+    main.app.state.index = index
+    main.app.state.answers = AnswerCache()
+    main.app.state.queries = QueryScheduler()
+    # Not entered as a context manager, so the real index and models are never loaded
+    return TestClient(main.app), index, computed
+
+
+def _events(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_streamed_answers_are_cached_after_an_index_write(server):
+    client, index, computed = server
+    client.post("/ask_stream/", data={"question": "What is PN-2?"})
+    index.write()
+    for _ in range(2):
+        events = _events(client.post("/ask_stream/", data={"question": "What is PN-2?"}))
+        assert events[-1]["type"] == "done"
+    # Computed once per index version, the repeat after the write is a cache hit
+    assert computed == ["What is PN-2?", "What is PN-2?"]
+
+
+def test_batch_answers_are_cached_after_an_index_write(server):
+    client, index, computed = server
+    client.post("/ask_batch/", data={"questions": ["a?", "b?"]})
+    index.write()
+    for _ in range(2):
+        events = _events(client.post("/ask_batch/", data={"questions": ["a?", "b?"]}))
+        assert [e["type"] for e in events] == ["answer", "answer", "done"]
+    assert computed == ["a?", "b?", "a?", "b?"]
+
+
+def test_answers_of_an_older_version_are_not_stored():
+    cache = AnswerCache()
+    cache.put("q", 2, ANSWER)
+    cache.put("other", 1, ANSWER)
+    assert cache.get("q", 2) == ANSWER
+    assert cache.get("other", 1) is None
+    assert cache.get("other", 2) is None
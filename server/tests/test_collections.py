@@ -0,0 +1,52 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import FakeEmbeddings
+
+from modules import index_manager
+from modules.index_manager import IndexManager
+from modules.lexical_index import LexicalIndex
+from modules.scoping import scope_filter
+
+
+def page(collection, text):
+    return Document(page_content=text, metadata={"source": "report.pdf", "page_number": 1, "collection": collection})
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # The chain is never queried here; building the real one would need the LLM client
+    monkeypatch.setattr(index_manager, "get_rag_chain", lambda *args, **kwargs: object())
+    return IndexManager(FakeEmbeddings(size=16), persist_dir=tmp_path / "index")
+
+
+def test_same_file_name_is_kept_per_collection(index):
+    index.upsert([page("tenantA", "alpha pricing")])
+    index.upsert([page("tenantB", "beta pricing")])
+
+    tenant_a = index.vectorstore.get(where=scope_filter("tenantA"), include=["documents"])
+    assert tenant_a["documents"] == ["alpha pricing"]
+    assert index.has_source("tenantB", "report.pdf")
+
+
+def test_delete_source_only_touches_its_collection(index):
+    index.upsert([page("tenantA", "alpha pricing")])
+    index.upsert([page("tenantB", "beta pricing")])
+
+    assert index.delete_source("tenantB", "report.pdf") == 1
+    assert index.has_source("tenantA", "report.pdf")
+    assert not index.has_source("tenantB", "report.pdf")
+
+
+def test_lexical_search_filters_on_scope_columns(tmp_path):
+    lexical = LexicalIndex(tmp_path / "lexical.sqlite3")
+    pages = [("a", 1, "part AB-1234 on page one"), ("a", 5, "part AB-1234 on page five"),
+             ("b", 1, "part AB-1234 elsewhere"), ("a", 2, "cover"), ("a", 3, "contents"), ("a", 4, "notes")]
+    lexical.upsert(
+        [f"{collection}::report.pdf::p{number}" for collection, number, _ in pages],
+        [text for _, _, text in pages],
+        [{"collection": collection, "source": "report.pdf", "page_number": number} for collection, number, _ in pages],
+    )
+
+    hits = lexical.search("AB-1234", 10, where=scope_filter("a", ["report.pdf"], page_from=2))
+
+    assert [doc_id for doc_id, _ in hits] == ["a::report.pdf::p5"]
@@ -0,0 +1,35 @@
+import json
+
+from modules.image_index import ImageRefs
+
+
+def test_image_is_deleted_with_its_last_reference(tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for name in ("logo.jpg", "a.jpg", "b.jpg"):
+        (image_dir / name).write_bytes(b"x")
+    refs = ImageRefs(tmp_path / "refs.sqlite3", index_dir=tmp_path / "index", image_dir=image_dir)
+    refs.claim("default/a.json", ["logo.jpg", "a.jpg"])
+    refs.claim("default/b.json", ["logo.jpg", "b.jpg"])
+
+    assert refs.keep("default/a.json") == 1
+
+    assert sorted(p.name for p in image_dir.iterdir()) == ["b.jpg", "logo.jpg"]
+    assert refs.keep("default/b.json", ["b.jpg"]) == 1
+    assert not (image_dir / "logo.jpg").exists()
+
+
+def test_existing_sidecars_are_registered_once(tmp_path):
+    index_dir, image_dir = tmp_path / "index", tmp_path / "images"
+    (index_dir / "default").mkdir(parents=True)
+    image_dir.mkdir()
+    (image_dir / "p1.jpg").write_bytes(b"x")
+    entry = {"full": {"file": "p1.jpg", "thumb": "p1_thumb.jpg"}, "largest": None, "images": []}
+    (index_dir / "default" / "report.json").write_text(json.dumps({"1": entry}))
+
+    refs = ImageRefs(tmp_path / "refs.sqlite3", index_dir=index_dir, image_dir=image_dir)
+    refs.claim("default/other.json", ["p1.jpg"])
+    refs.keep("default/other.json")
+
+    assert (image_dir / "p1.jpg").exists()
+    assert refs.keep("default/report.json") == 1
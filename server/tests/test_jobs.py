@@ -0,0 +1,32 @@
+import threading
+import time
+
+from modules.jobs import JobManager, JobStore
+
+
+def test_shutdown_marks_cancelled_jobs_failed(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    manager = JobManager(max_workers=1, max_pending=4, store=store)
+    release = threading.Event()
+    running = manager.submit(["a.pdf"], lambda paths, progress: release.wait(5))
+    queued = manager.submit(["b.pdf"], lambda paths, progress: None)
+    while running.status != "running":
+        time.sleep(0.01)
+
+    manager.shutdown()
+    release.set()
+
+    assert store.get(queued.id)["status"] == "failed"
+    assert store.get(running.id)["status"] in ("running", "done")
+
+
+def test_prune_keeps_unfinished_jobs(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    for job_id, status in (("old-done", "done"), ("old-queued", "queued"), ("old-running", "running")):
+        store.save({"job_id": job_id, "status": status, "updated_at": 0.0})
+
+    store.prune(cutoff=time.time())
+
+    assert store.get("old-done") is None
+    assert store.get("old-queued") is not None
+    assert store.get("old-running") is not None
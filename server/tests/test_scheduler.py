@@ -0,0 +1,20 @@
+import asyncio
+import time
+
+import pytest
+
+from modules.scheduler import QueryScheduler, QueryRejectedError
+
+
+def test_timed_out_acquire_keeps_no_permit():
+    async def scenario():
+        scheduler = QueryScheduler(max_concurrent=1, max_queue=4, timeout=1)
+        await scheduler.acquire(time.monotonic() + 1)
+        with pytest.raises(QueryRejectedError):
+            await scheduler.acquire(time.monotonic() + 0.05)
+        scheduler.release()
+        await asyncio.sleep(0.05)
+        assert not scheduler._semaphore.locked()
+        await scheduler.acquire(time.monotonic() + 0.1)
+
+    asyncio.run(scenario())